@@ -0,0 +1,169 @@
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import ExitStack
+
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+
+def _fingerprint(path):
+    """Отпечаток файла: меняется при любом изменении содержимого на диске"""
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def _is_stale_file_id(error):
+    """Telegram отклонил сохраненный file_id (файл удален или id устарел)"""
+    return error.error_code == 400 and 'file' in str(error.description).lower()
+
+
+def _message_file_id(message, kind):
+    if kind == 'photo':
+        return message.photo[-1].file_id
+    return message.document.file_id
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    path TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    fingerprint TEXT NOT NULL
+);
+"""
+
+
+class AssetRegistry:
+    """Реестр файлов, уже загруженных в Telegram.
+
+    Каждый файл загружается один раз, дальше отправляется по file_id.
+    Кэш хранится в базе бота и привязан к пути и отпечатку файла (mtime + размер),
+    поэтому измененный файл будет загружен заново.
+    """
+
+    def __init__(self, bot, db_path):
+        self.bot = bot
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT path, file_id, fingerprint FROM assets").fetchall()
+        return {path: {'file_id': file_id, 'fingerprint': fingerprint} for path, file_id, fingerprint in rows}
+
+    def get(self, path):
+        """Возвращает file_id, если файл уже загружен и с тех пор не менялся"""
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None:
+            return None
+        try:
+            if entry['fingerprint'] != _fingerprint(path):
+                return None
+        except OSError:
+            return None
+        return entry['file_id']
+
+    def refresh(self):
+        """Подхватывает file_id, которые сохранили другие процессы бота"""
+        entries = self._load()
+        with self._lock:
+            for path, entry in entries.items():
+                self._entries.setdefault(path, entry)
+
+    def remember(self, path, file_id):
+        entry = {'file_id': file_id, 'fingerprint': _fingerprint(path)}
+        with self._lock, self._conn:
+            self._entries[path] = entry
+            self._conn.execute(
+                "INSERT OR REPLACE INTO assets (path, file_id, fingerprint) VALUES (?, ?, ?)",
+                (path, file_id, entry['fingerprint'])
+            )
+
+    def forget(self, path):
+        with self._lock, self._conn:
+            if self._entries.pop(path, None) is not None:
+                self._conn.execute("DELETE FROM assets WHERE path = ?", (path,))
+
+    def _send(self, kind, chat_id, path, **kwargs):
+        send = self.bot.send_photo if kind == 'photo' else self.bot.send_document
+
+        file_id = self.get(path)
+        if file_id:
+            try:
+                return send(chat_id, file_id, **kwargs)
+            except ApiTelegramException as e:
+                if not _is_stale_file_id(e):
+                    raise
+                logger.info("Устаревший file_id для %s, загружаю заново", path)
+                self.forget(path)
+
+        with open(path, 'rb') as f:
+            message = send(chat_id, f, **kwargs)
+        self.remember(path, _message_file_id(message, kind))
+        return message
+
+    def send_photo(self, chat_id, path, **kwargs):
+        return self._send('photo', chat_id, path, **kwargs)
+
+    def send_document(self, chat_id, path, **kwargs):
+        return self._send('document', chat_id, path, **kwargs)
+
+    def edit_media(self, chat_id, message_id, path, kind='photo', caption=None, parse_mode=None, **kwargs):
+        """Заменяет фото или документ в отправленном сообщении, по file_id, если файл уже загружен"""
+        media_class = types.InputMediaPhoto if kind == 'photo' else types.InputMediaDocument
+
+        file_id = self.get(path)
+        if file_id:
+            try:
+                return self.bot.edit_message_media(media_class(file_id, caption=caption, parse_mode=parse_mode),
+                                                   chat_id, message_id, **kwargs)
+            except ApiTelegramException as e:
+                if not _is_stale_file_id(e):
+                    raise
+                logger.info("Устаревший file_id для %s, загружаю заново", path)
+                self.forget(path)
+
+        with open(path, 'rb') as f:
+            message = self.bot.edit_message_media(media_class(f, caption=caption, parse_mode=parse_mode),
+                                                  chat_id, message_id, **kwargs)
+        self.remember(path, _message_file_id(message, kind))
+        return message
+
+    def _build_media(self, stack, items, kind, parse_mode, use_cache):
+        media_class = types.InputMediaPhoto if kind == 'photo' else types.InputMediaDocument
+        media = []
+        for path, caption in items:
+            file_id = self.get(path) if use_cache else None
+            source = file_id or stack.enter_context(open(path, 'rb'))
+            media.append(media_class(source, caption=caption, parse_mode=parse_mode if caption else None))
+        return media
+
+    def send_media_group(self, chat_id, items, kind='photo', parse_mode=None, **kwargs):
+        """Отправляет медиагруппу. items - список пар (путь, подпись или None)"""
+        items = list(items)
+        use_cache = True
+        while True:
+            with ExitStack() as stack:
+                media = self._build_media(stack, items, kind, parse_mode, use_cache)
+                try:
+                    messages = self.bot.send_media_group(chat_id, media, **kwargs)
+                except ApiTelegramException as e:
+                    if not use_cache or not _is_stale_file_id(e):
+                        raise
+                    logger.info("Устаревшие file_id в медиагруппе, загружаю заново")
+                    for path, _ in items:
+                        self.forget(path)
+                    use_cache = False
+                    continue
+
+            for (path, _), message in zip(items, messages):
+                if self.get(path) is None:
+                    self.remember(path, _message_file_id(message, kind))
+            return messages
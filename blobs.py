@@ -0,0 +1,103 @@
+import errno
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from downloads import stream_download
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blob_ids (
+    file_unique_id TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL REFERENCES blobs (sha256)
+);
+"""
+
+
+class BlobStore:
+    """Хранилище файлов пользователей по содержимому.
+
+    Каждый файл лежит на диске один раз под своим sha256. Telegram file_unique_id
+    запоминается, поэтому повторно присланный файл вообще не скачивается.
+    """
+
+    def __init__(self, root_dir, db_path):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _blob_path(self, sha256, file_ext):
+        return os.path.join(self.root_dir, sha256[:2], f"{sha256}.{file_ext}")
+
+    def lookup(self, file_unique_id):
+        """Путь к уже сохраненному файлу или None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT blobs.path FROM blob_ids JOIN blobs ON blobs.sha256 = blob_ids.sha256"
+                " WHERE blob_ids.file_unique_id = ?", (file_unique_id,)
+            ).fetchone()
+        if row and os.path.exists(row[0]):
+            return row[0]
+        return None
+
+    def fetch(self, bot, file_id, file_unique_id, file_ext, max_size):
+        """Возвращает путь к файлу в хранилище, скачивая его только если он еще не известен.
+
+        Результат: (путь, {'bytes': ..., 'seconds': ..., 'cached': ...}).
+        """
+        path = self.lookup(file_unique_id)
+        if path is not None:
+            return path, {'bytes': 0, 'seconds': 0.0, 'cached': True}
+
+        hasher = hashlib.sha256()
+        tmp_path = os.path.join(self.root_dir, f"incoming_{uuid.uuid4().hex}.{file_ext}")
+        result = stream_download(bot, file_id, tmp_path, max_size, hasher=hasher)
+        sha256 = hasher.hexdigest()
+
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT path FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row and os.path.exists(row[0]):
+                # Такое содержимое уже есть под другим file_unique_id
+                os.remove(tmp_path)
+                path = row[0]
+            else:
+                path = self._blob_path(sha256, file_ext)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO blobs (sha256, path, size, created_at) VALUES (?, ?, ?, ?)",
+                    (sha256, path, result['bytes'], time.time())
+                )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blob_ids (file_unique_id, sha256) VALUES (?, ?)",
+                (file_unique_id, sha256)
+            )
+
+        result['cached'] = False
+        return path, result
+
+
+def link_blob(blob_path, link_path):
+    """Делает файл хранилища доступным под понятным именем (жесткая ссылка, иначе копия)"""
+    os.makedirs(os.path.dirname(link_path), exist_ok=True)
+    try:
+        os.link(blob_path, link_path)
+    except OSError as e:
+        # Копия - только если жесткие ссылки невозможны (другой диск, файловая система без них).
+        # Занятое имя - ошибка: копия поверх него испортила бы файл, на который оно ссылается
+        if e.errno not in (errno.EXDEV, errno.EPERM):
+            raise
+        shutil.copyfile(blob_path, link_path)
+    return link_path
@@ -0,0 +1,436 @@
+"""Каталог: цены, тексты и фото разделов главного меню в файле catalog.json.
+
+Файл загружается в готовые к отправке разделы (текст, клавиатура в JSON, списки
+файлов) и проверяется целиком: ошибки в тексте, разметке или кнопках отклоняют
+весь файл. CatalogWatcher следит за mtime файла и подменяет каталог без
+перезапуска бота; если новый файл не прошел проверку, остается прежний.
+"""
+import json
+import logging
+import os
+import threading
+from html.parser import HTMLParser
+
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+# Ограничения Telegram
+TEXT_LIMIT = 4096
+CAPTION_LIMIT = 1024
+MEDIA_GROUP_LIMIT = 10
+CALLBACK_DATA_LIMIT = 64
+# id результата inline-запроса
+RESULT_ID_LIMIT = 64
+
+MEDIA_KINDS = ('photo', 'document')
+BUTTON_KINDS = ('url', 'callback', 'inline')
+PARSE_MODES = ('HTML', None)
+
+# Теги, которые Telegram принимает в parse_mode=HTML
+ALLOWED_TAGS = {'b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'a', 'code', 'pre',
+                'span', 'tg-spoiler', 'tg-emoji', 'blockquote'}
+
+
+class CatalogError(Exception):
+    """Файл каталога не прошел проверку, в сообщении - что и где не так"""
+
+
+class _TagChecker(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+        self.errors = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ALLOWED_TAGS:
+            self.errors.append(f"тег <{tag}> не поддерживается")
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack[-1] != tag:
+            self.errors.append(f"лишний или не на месте </{tag}>")
+            return
+        self.stack.pop()
+
+
+def check_html(text):
+    """Проверяет, что в тексте только теги Telegram и все они закрыты. Возвращает список ошибок"""
+    checker = _TagChecker()
+    checker.feed(text)
+    checker.close()
+    errors = checker.errors
+    if checker.stack:
+        errors.append("не закрыт <" + ">, <".join(checker.stack) + ">")
+    return errors
+
+
+class MediaBlock:
+    """Файлы раздела: медиагруппа фото или отдельные фото/документы.
+
+    caption - подпись к первому файлу, missing_text - сообщение, если ни одного файла нет на диске.
+    """
+
+    def __init__(self, kind, files, caption=None, group=False, missing_text=None, timeout=None):
+        self.kind = kind
+        self.files = tuple(files)
+        self.caption = caption
+        self.group = group
+        self.missing_text = missing_text
+        self.timeout = timeout
+
+    def existing_files(self):
+        return [path for path in self.files if os.path.exists(path)]
+
+
+class Section:
+    """Раздел меню: кнопка главного меню и готовые сообщения, которые она отправляет"""
+
+    def __init__(self, section_id, title, text, parse_mode='HTML', reply_markup=None, media=(), cost=None,
+                 gallery=None):
+        self.id = section_id
+        self.title = title
+        self.text = text
+        self.parse_mode = parse_mode
+        # Клавиатура уже в JSON, telebot отправляет строку как есть
+        self.reply_markup = reply_markup
+        self.media = tuple(media)
+        self.cost = cost
+        # Категория галереи, которая открывается перед текстом раздела
+        self.gallery = gallery
+
+
+class Design:
+    """Лист дизайнов капы одной категории: фото, название и слова для поиска"""
+
+    def __init__(self, design_id, title, path, keywords=(), caption=None, reply_markup=None):
+        self.id = design_id
+        self.title = title
+        self.path = path
+        self.keywords = tuple(keywords)
+        self.caption = caption
+        # JSON, как у разделов
+        self.reply_markup = reply_markup
+
+
+class GalleryPage:
+    """Фото галереи: подпись и клавиатура листания (в JSON) подготовлены заранее"""
+
+    def __init__(self, category, index, path, caption, reply_markup):
+        self.category = category
+        self.index = index
+        self.path = path
+        self.caption = caption
+        self.reply_markup = reply_markup
+
+
+class Catalog:
+    """Загруженный каталог. Не меняется: при перезагрузке создается новый целиком"""
+
+    def __init__(self, sections, menu_row_width=2, mtime_ns=None, designs=(), gallery=None):
+        self.sections = {section.title: section for section in sections}
+        self.ordered = tuple(sections)
+        self.designs = tuple(designs)
+        # Категория галереи -> страницы по порядку
+        self.gallery = gallery or {}
+        markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=menu_row_width)
+        markup.add(*[types.KeyboardButton(section.title) for section in sections])
+        self.menu_markup = markup.to_json()
+        self.mtime_ns = mtime_ns
+
+    def gallery_page(self, category, index):
+        """Страница галереи (номер по кругу) или None, если такой категории нет"""
+        pages = self.gallery.get(category)
+        if not pages:
+            return None
+        return pages[index % len(pages)]
+
+    def costs(self):
+        """Вес кнопок меню для анти-флуда"""
+        return {section.title: section.cost for section in self.ordered if section.cost is not None}
+
+    def photo_folders(self):
+        """Папки с фото разделов - для подготовки облегченных копий"""
+        folders = {os.path.dirname(path) for section in self.ordered for block in section.media
+                   if block.kind == 'photo' for path in block.files}
+        # Фото дизайнов готовит поток загрузки вместе с file_id
+        design_paths = {design.path for design in self.designs}
+        folders.update(os.path.dirname(page.path) for pages in self.gallery.values() for page in pages
+                       if page.path not in design_paths)
+        return sorted(folders)
+
+
+def _require(condition, where, message):
+    if not condition:
+        raise CatalogError(f"{where}: {message}")
+
+
+def _check_text(where, text, limit, parse_mode):
+    _require(isinstance(text, str) and text.strip(), where, "нужен непустой текст")
+    _require(len(text) <= limit, where, f"текст длиннее {limit} символов ({len(text)})")
+    if parse_mode == 'HTML':
+        errors = check_html(text)
+        _require(not errors, where, "; ".join(errors))
+
+
+def _build_markup(where, rows):
+    _require(isinstance(rows, list), where, "buttons - список рядов кнопок")
+    markup = types.InlineKeyboardMarkup()
+    for row_number, row in enumerate(rows, 1):
+        _require(isinstance(row, list) and row, where, f"ряд {row_number} - непустой список кнопок")
+        buttons = []
+        for button in row:
+            button_where = f"{where}, ряд {row_number}"
+            _require(isinstance(button, dict) and button.get('text'), button_where, "у кнопки нет text")
+            _require(sum(kind in button for kind in BUTTON_KINDS) == 1, button_where,
+                     f"у кнопки «{button['text']}» должен быть один из {', '.join(BUTTON_KINDS)}")
+            if 'inline' in button:
+                # Открывает inline-поиск дизайнов в этом же чате с заданным запросом
+                buttons.append(types.InlineKeyboardButton(
+                    button['text'], switch_inline_query_current_chat=str(button['inline'])))
+            elif 'url' in button:
+                _require(str(button['url']).startswith(('https://', 'http://', 'tg://')), button_where,
+                         f"неверная ссылка у кнопки «{button['text']}»")
+                buttons.append(types.InlineKeyboardButton(button['text'], url=button['url']))
+            else:
+                _require(0 < len(str(button['callback']).encode('utf-8')) <= CALLBACK_DATA_LIMIT, button_where,
+                         f"callback кнопки «{button['text']}» длиннее {CALLBACK_DATA_LIMIT} байт")
+                buttons.append(types.InlineKeyboardButton(button['text'], callback_data=button['callback']))
+        markup.row(*buttons)
+    return markup.to_json() if rows else None
+
+
+def _build_media(where, data, parse_mode):
+    _require(isinstance(data, dict), where, "ожидается объект")
+    kind = data.get('kind', 'photo')
+    _require(kind in MEDIA_KINDS, where, f"kind - одно из {', '.join(MEDIA_KINDS)}")
+    files = data.get('files')
+    _require(isinstance(files, list) and files and all(isinstance(f, str) and f for f in files),
+             where, "files - непустой список путей")
+    group = bool(data.get('group', False))
+    if group:
+        _require(len(files) <= MEDIA_GROUP_LIMIT, where, f"в медиагруппе больше {MEDIA_GROUP_LIMIT} файлов")
+    caption = data.get('caption')
+    if caption is not None:
+        _check_text(where + ", caption", caption, CAPTION_LIMIT, parse_mode)
+    timeout = data.get('timeout')
+    _require(timeout is None or (isinstance(timeout, (int, float)) and timeout > 0), where,
+             "timeout - число секунд")
+    return MediaBlock(kind, files, caption=caption, group=group,
+                      missing_text=data.get('missing_text'), timeout=timeout)
+
+
+def _build_designs(data):
+    """Раздел designs: общие подпись (с {title}) и кнопки и список листов дизайнов"""
+    where = "designs"
+    _require(isinstance(data, dict), where, "ожидается объект с полем items")
+    template = data.get('caption', '<b>{title}</b>')
+    reply_markup = _build_markup(where, data.get('buttons', []))
+    items = data.get('items')
+    _require(isinstance(items, list), where, "items - список дизайнов")
+
+    designs = []
+    ids = set()
+    for number, item in enumerate(items, 1):
+        item_where = f"{where}, дизайн {number}"
+        _require(isinstance(item, dict), item_where, "ожидается объект")
+        design_id, title, path = item.get('id'), item.get('title'), item.get('file')
+        _require(isinstance(design_id, str) and design_id, item_where, "нужен id")
+        _require(len(design_id.encode('utf-8')) <= RESULT_ID_LIMIT, item_where,
+                 f"id длиннее {RESULT_ID_LIMIT} байт")
+        _require(design_id not in ids, item_where, f"id {design_id} повторяется")
+        _require(isinstance(title, str) and title.strip(), item_where, "нужен title")
+        _require(isinstance(path, str) and path, item_where, "нужен file")
+        keywords = item.get('keywords', [])
+        _require(isinstance(keywords, list) and all(isinstance(word, str) for word in keywords),
+                 item_where, "keywords - список строк")
+        try:
+            caption = template.format(title=title)
+        except (KeyError, IndexError, ValueError) as e:
+            raise CatalogError(f"{where}: неверный шаблон подписи: {e}") from e
+        _check_text(item_where + ", caption", caption, CAPTION_LIMIT, 'HTML')
+        ids.add(design_id)
+        designs.append(Design(design_id, title, path, keywords, caption, reply_markup))
+    return designs
+
+
+def gallery_callback(category, index, step):
+    """callback_data кнопки галереи: категория, текущая страница и шаг (-1, 1 или 0)"""
+    return f"gallery:{category}:{index}:{step}"
+
+
+def _gallery_markup(categories, category, index, count, extra_rows):
+    markup = types.InlineKeyboardMarkup()
+    if count > 1:
+        markup.row(types.InlineKeyboardButton("◀️", callback_data=gallery_callback(category, index, -1)),
+                   types.InlineKeyboardButton(f"{index + 1} / {count}",
+                                              callback_data=gallery_callback(category, index, 0)),
+                   types.InlineKeyboardButton("▶️", callback_data=gallery_callback(category, index, 1)))
+    if len(categories) > 1:
+        markup.row(*[types.InlineKeyboardButton(("• " if other == category else "") + title,
+                                                callback_data=gallery_callback(other, 0, 0))
+                     for other, title in categories])
+    for row in extra_rows:
+        markup.row(*[types.InlineKeyboardButton.de_json(button) for button in row])
+    return markup.to_json()
+
+
+def _build_gallery(data, designs):
+    """Раздел gallery: категории фото для листания в одном сообщении.
+
+    Категория - либо листы дизайнов ("designs": true), либо список files с общей подписью.
+    """
+    where = "gallery"
+    _require(isinstance(data, dict), where, "ожидается объект с полем categories")
+    raw_categories = data.get('categories')
+    _require(isinstance(raw_categories, list) and raw_categories, where, "categories - непустой список")
+    extra_markup = _build_markup(where, data.get('buttons', []))
+    extra_rows = json.loads(extra_markup)['inline_keyboard'] if extra_markup else []
+
+    categories = []
+    items = {}
+    for number, raw in enumerate(raw_categories, 1):
+        item_where = f"{where}, категория {number}"
+        _require(isinstance(raw, dict), item_where, "ожидается объект")
+        category, title = raw.get('id'), raw.get('title')
+        _require(isinstance(category, str) and category.isascii() and category.isidentifier()
+                 and len(category) <= 20, item_where, "id - латиница, цифры и _, до 20 символов")
+        _require(category not in items, item_where, f"id {category} повторяется")
+        _require(isinstance(title, str) and title.strip(), item_where, "нужен title")
+        if raw.get('designs'):
+            _require(designs, item_where, "в каталоге нет дизайнов")
+            items[category] = [(design.path, design.caption) for design in designs]
+        else:
+            files = raw.get('files')
+            _require(isinstance(files, list) and files and all(isinstance(f, str) and f for f in files),
+                     item_where, "files - непустой список путей")
+            caption = raw.get('caption')
+            if caption is not None:
+                _check_text(item_where + ", caption", caption, CAPTION_LIMIT, 'HTML')
+            items[category] = [(path, caption) for path in files]
+        categories.append((category, title))
+
+    return {
+        category: [GalleryPage(category, index, path, caption,
+                               _gallery_markup(categories, category, index, len(pages), extra_rows))
+                   for index, (path, caption) in enumerate(pages)]
+        for category, pages in items.items()
+    }
+
+
+def parse_catalog(data, mtime_ns=None):
+    """Собирает Catalog из данных файла. При любой ошибке бросает CatalogError"""
+    _require(isinstance(data, dict), "каталог", "ожидается объект с полем sections")
+    raw_sections = data.get('sections')
+    _require(isinstance(raw_sections, list) and raw_sections, "каталог", "sections - непустой список")
+
+    sections = []
+    ids, titles = set(), set()
+    for number, raw in enumerate(raw_sections, 1):
+        where = f"раздел {number}"
+        _require(isinstance(raw, dict), where, "ожидается объект")
+        section_id, title = raw.get('id'), raw.get('title')
+        _require(isinstance(section_id, str) and section_id, where, "нужен id")
+        where = f"раздел {section_id}"
+        _require(section_id not in ids, where, "id повторяется")
+        _require(isinstance(title, str) and title.strip(), where, "нужен title")
+        _require(title not in titles, where, f"кнопка «{title}» повторяется")
+        _require(not title.startswith('/'), where, "title не может начинаться с /")
+        ids.add(section_id)
+        titles.add(title)
+
+        parse_mode = raw.get('parse_mode', 'HTML')
+        _require(parse_mode in PARSE_MODES, where, "parse_mode - HTML или null")
+        text = raw.get('text')
+        _check_text(where, text, TEXT_LIMIT, parse_mode)
+        cost = raw.get('cost')
+        _require(cost is None or (isinstance(cost, int) and cost > 0), where, "cost - целое больше 0")
+
+        media = [_build_media(f"{where}, media {i}", block, parse_mode)
+                 for i, block in enumerate(raw.get('media', []), 1)]
+        gallery_category = raw.get('gallery')
+        _require(gallery_category is None or isinstance(gallery_category, str), where,
+                 "gallery - id категории галереи")
+        sections.append(Section(section_id, title, text, parse_mode=parse_mode,
+                                reply_markup=_build_markup(where, raw.get('buttons', [])),
+                                media=media, cost=cost, gallery=gallery_category))
+
+    row_width = data.get('menu_row_width', 2)
+    _require(isinstance(row_width, int) and 1 <= row_width <= 8, "каталог", "menu_row_width - от 1 до 8")
+    designs = _build_designs(data['designs']) if 'designs' in data else []
+    gallery = _build_gallery(data['gallery'], designs) if 'gallery' in data else {}
+    for section in sections:
+        _require(section.gallery is None or section.gallery in gallery, f"раздел {section.id}",
+                 f"нет категории галереи {section.gallery}")
+    return Catalog(sections, menu_row_width=row_width, mtime_ns=mtime_ns, designs=designs, gallery=gallery)
+
+
+def load_catalog(path):
+    """Читает и проверяет файл каталога. При ошибке бросает CatalogError"""
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise CatalogError(f"не удалось прочитать {path}: {e}") from e
+    return parse_catalog(data, mtime_ns)
+
+
+class CatalogWatcher:
+    """Держит текущий каталог и перечитывает файл, когда меняется его mtime.
+
+    current - всегда целиком проверенный каталог: замена - одно присваивание ссылки,
+    обработчики, уже взявшие прежний каталог, дорабатывают с ним. on_reload(catalog)
+    вызывается после каждой успешной загрузки, включая первую.
+    """
+
+    def __init__(self, path, interval=2.0, on_reload=None):
+        self.path = path
+        self.interval = interval
+        self.on_reload = on_reload
+        # Первая загрузка без запасного варианта: с неверным каталогом бот не запускается
+        self.current = load_catalog(path)
+        self._notify(self.current)
+        self._seen_mtime_ns = self.current.mtime_ns
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _notify(self, catalog):
+        if self.on_reload is not None:
+            self.on_reload(catalog)
+
+    def check(self):
+        """Перечитывает файл, если он изменился. True, если каталог заменен"""
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            logger.error("Файл каталога %s недоступен: %s", self.path, e)
+            return False
+        if mtime_ns == self._seen_mtime_ns:
+            return False
+        # Запоминаем mtime и при ошибке, чтобы не повторять ее в лог, пока файл не изменят снова
+        self._seen_mtime_ns = mtime_ns
+        try:
+            catalog = load_catalog(self.path)
+        except CatalogError as e:
+            logger.error("Каталог не обновлен, работает прежний: %s", e)
+            return False
+        self.current = catalog
+        self._notify(catalog)
+        logger.info("Каталог обновлен: разделов %s", len(catalog.ordered))
+        return True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error("Ошибка проверки каталога: %s", e)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="catalog-watcher", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stopped.set()
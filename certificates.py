@@ -0,0 +1,232 @@
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+# Шрифты с кириллицей, которые ищутся, если шрифт не задан явно
+FONT_CANDIDATES = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf",
+    "C:/Windows/Fonts/arialbd.ttf",
+)
+
+# Шаблон больше этого размера уменьшается при загрузке, фото в Telegram все равно сжимается
+TEMPLATE_MAX_SIDE = 2000
+# Шаблон, если файла нет: темный фон с рамкой и заголовком
+FALLBACK_SIZE = (1600, 1000)
+FALLBACK_BACKGROUND = (20, 20, 20)
+FALLBACK_ACCENT = (200, 30, 30)
+
+# Надписи на шаблоне: (центр по x, центр по y) в долях ширины и высоты, размер шрифта в долях высоты
+AMOUNT_POSITION = (0.5, 0.52)
+AMOUNT_SIZE = 0.13
+NAME_POSITION = (0.5, 0.70)
+NAME_SIZES = (0.08, 0.065, 0.05, 0.04)
+CODE_POSITION = (0.5, 0.88)
+CODE_SIZE = 0.04
+# Имя уменьшается, пока не поместится в эту долю ширины
+NAME_MAX_WIDTH = 0.8
+TEXT_COLOR = (255, 255, 255)
+
+PDF_RESOLUTION = 150
+PHOTO_QUALITY = 90
+
+# Шрифты и шаблон процесса пула: загружаются один раз при запуске процесса
+_worker = {}
+
+
+def certificate_code(amount, name, buyer_id, secret):
+    """Код сертификата: подпись покупателя, суммы и имени.
+
+    Разные покупатели получают разные коды, повторный запрос того же покупателя - тот же код.
+    """
+    message = f"{buyer_id}:{amount}:{' '.join(name.split()).casefold()}".encode('utf-8')
+    digest = hmac.new(secret.encode('utf-8'), message, hashlib.sha256).digest()
+    code = base64.b32encode(digest).decode('ascii')[:8]
+    return f"MRT-{code[:4]}-{code[4:]}"
+
+
+def format_amount(amount):
+    return f"{amount:,}".replace(',', ' ') + " руб."
+
+
+def find_font(path=None):
+    """Заданный шрифт или первый найденный из FONT_CANDIDATES, None - встроенный шрифт Pillow"""
+    if path:
+        return path
+    for candidate in FONT_CANDIDATES:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def _font(path, size):
+    if path is None:
+        return ImageFont.load_default(size)
+    return ImageFont.truetype(path, size)
+
+
+def _fallback_template(font_path):
+    image = Image.new("RGB", FALLBACK_SIZE, FALLBACK_BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    width, height = image.size
+    border = height // 30
+    draw.rectangle((border, border, width - border, height - border), outline=FALLBACK_ACCENT, width=border // 3)
+    draw.text((width / 2, height * 0.17), "MORTAL", font=_font(font_path, int(height * 0.12)),
+              fill=FALLBACK_ACCENT, anchor="mm")
+    draw.text((width / 2, height * 0.32), "GIFT CERTIFICATE", font=_font(font_path, int(height * 0.06)),
+              fill=TEXT_COLOR, anchor="mm")
+    return image
+
+
+def load_template(template_path, font_path):
+    """Шаблон сертификата в RGB, без файла шаблона - сгенерированный"""
+    if template_path and os.path.exists(template_path):
+        with Image.open(template_path) as image:
+            image = image.convert("RGB")
+        image.thumbnail((TEMPLATE_MAX_SIDE, TEMPLATE_MAX_SIDE), Image.LANCZOS)
+        return image
+    return _fallback_template(font_path)
+
+
+def _load_worker(template_path, font_path):
+    """Запуск процесса пула: шаблон и все размеры шрифтов готовятся заранее"""
+    template = load_template(template_path, font_path)
+    height = template.height
+    _worker['template'] = template
+    _worker['amount_font'] = _font(font_path, int(height * AMOUNT_SIZE))
+    _worker['name_fonts'] = [_font(font_path, int(height * size)) for size in NAME_SIZES]
+    _worker['code_font'] = _font(font_path, int(height * CODE_SIZE))
+
+
+def _save(image, path, *args, **kwargs):
+    # Пишем во временный файл, чтобы бот не отправил недописанный сертификат
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    image.save(tmp_file, *args, **kwargs)
+    os.replace(tmp_file, path)
+
+
+def render_certificate(amount, name, code, photo_path, pdf_path):
+    """Рисует сумму, имя и код на шаблоне и сохраняет JPEG и PDF. Выполняется в процессе пула"""
+    image = _worker['template'].copy()
+    draw = ImageDraw.Draw(image)
+    width, height = image.size
+
+    name_font = _worker['name_fonts'][-1]
+    for font in _worker['name_fonts']:
+        if font.getlength(name) <= width * NAME_MAX_WIDTH:
+            name_font = font
+            break
+    for text, font, (x, y) in ((format_amount(amount), _worker['amount_font'], AMOUNT_POSITION),
+                               (name, name_font, NAME_POSITION),
+                               (code, _worker['code_font'], CODE_POSITION)):
+        draw.text((width * x, height * y), text, font=font, fill=TEXT_COLOR, anchor="mm")
+
+    os.makedirs(os.path.dirname(photo_path), exist_ok=True)
+    _save(image, photo_path, "JPEG", quality=PHOTO_QUALITY, optimize=True)
+    _save(image, pdf_path, "PDF", resolution=PDF_RESOLUTION)
+    return photo_path, pdf_path
+
+
+class Certificate:
+    """Готовый сертификат: код, фото для чата и PDF для печати"""
+
+    def __init__(self, amount, name, code, photo, pdf):
+        self.amount = amount
+        self.name = name
+        self.code = code
+        self.photo = photo
+        self.pdf = pdf
+
+
+class CertificateRenderer:
+    """Именные сертификаты: рисуются в пуле процессов и кэшируются на диске.
+
+    Файл называется по хэшу покупателя, суммы, имени и кода, поэтому повторный запрос с теми же
+    параметрами (в том числе из другого процесса бота) отдает готовый файл, а его file_id
+    остается в реестре загруженных файлов. На диске хранятся cache_size последних
+    сертификатов, вытесненные удаляются и передаются в on_evict(path).
+    """
+
+    def __init__(self, cache_dir, template, font, secret, workers=1, cache_size=200, on_evict=None):
+        if not secret:
+            raise ValueError("Не задан секрет для кодов сертификатов")
+        self.cache_dir = cache_dir
+        self.template = template
+        self.font = find_font(font)
+        self.secret = secret
+        self.workers = workers
+        self.cache_size = cache_size
+        self.on_evict = on_evict
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._files = self._scan()
+        if self.font is None:
+            logger.warning("Шрифт для сертификатов не найден, используется встроенный (без кириллицы)")
+        if not (template and os.path.exists(template)):
+            logger.warning("Нет шаблона сертификата %s, используется сгенерированный", template)
+
+    def _scan(self):
+        """Сертификаты, оставшиеся с прошлого запуска, от старых к новым"""
+        files = OrderedDict()
+        if not os.path.isdir(self.cache_dir):
+            return files
+        photos = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.jpg')]
+        for entry in sorted(photos, key=lambda entry: entry.stat().st_mtime):
+            base = entry.name[:-len('.jpg')]
+            files[base] = (entry.path, os.path.join(self.cache_dir, base + '.pdf'))
+        return files
+
+    def _paths(self, amount, name, buyer_id, code):
+        base = hashlib.sha1(f"{buyer_id}\n{amount}\n{name}\n{code}".encode('utf-8')).hexdigest()
+        return base, os.path.join(self.cache_dir, base + '.jpg'), os.path.join(self.cache_dir, base + '.pdf')
+
+    def render(self, amount, name, buyer_id, timeout=60):
+        """Сертификат покупателя buyer_id на сумму amount для name: из кэша или только что нарисованный"""
+        code = certificate_code(amount, name, buyer_id, self.secret)
+        base, photo, pdf = self._paths(amount, name, buyer_id, code)
+        with self._lock:
+            future = self._pending.get(base)
+            if future is None:
+                if os.path.exists(photo) and os.path.exists(pdf):
+                    self._touch(base, photo, pdf)
+                    return Certificate(amount, name, code, photo, pdf)
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_load_worker,
+                                                     initargs=(self.template, self.font))
+                # Одинаковые запросы, пришедшие одновременно, ждут одной отрисовки
+                future = self._pool.submit(render_certificate, amount, name, code, photo, pdf)
+                self._pending[base] = future
+        try:
+            future.result(timeout)
+        finally:
+            with self._lock:
+                if self._pending.get(base) is future and future.done():
+                    del self._pending[base]
+                    if future.exception() is None:
+                        self._touch(base, photo, pdf)
+        return Certificate(amount, name, code, photo, pdf)
+
+    def _touch(self, base, photo, pdf):
+        self._files[base] = (photo, pdf)
+        self._files.move_to_end(base)
+        while len(self._files) > self.cache_size:
+            _, paths = self._files.popitem(last=False)
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+                if self.on_evict is not None:
+                    self.on_evict(path)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,116 @@
+import json
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateCheckpoint:
+    """Номер последнего принятого апдейта и журнал необработанных в базе бота.
+
+    После перезапуска опрос продолжается со следующего апдейта. Фоновый поток раз
+    в interval секунд записывает значение source(), если оно изменилось; close()
+    записывает последнее значение.
+
+    Журнал нужен, когда апдейты подтверждаются в Telegram (или главному процессу
+    кластера) раньше, чем обработаны: add() записывает их вместе с номером последнего
+    принятого, поток удаляет из журнала номера, которые вернул finished(), а pending()
+    после перезапуска отдает то, что обработать не успели.
+    """
+
+    def __init__(self, path, key='update_offset'):
+        self.path = path
+        self.key = key
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Номер апдейта должен пережить и сбой питания, пишем с полной синхронизацией
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS pending_updates (update_id INTEGER PRIMARY KEY, body TEXT NOT NULL)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._saved = None
+        self._source = None
+        self._finished = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def load(self):
+        """Последний принятый update_id или 0, если бот еще не запускался"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (self.key,)).fetchone()
+        self._saved = int(row[0]) if row else 0
+        return self._saved
+
+    def save(self, update_id):
+        if update_id == self._saved:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                               (self.key, str(update_id)))
+        self._saved = update_id
+
+    def add(self, updates):
+        """Записывает принятые апдейты (словари JSON) в журнал до их подтверждения в Telegram.
+
+        Возвращает апдейты, которых в журнале еще не было: остальные уже ждут обработки.
+        """
+        last = max(update['update_id'] for update in updates)
+        added = []
+        with self._lock, self._conn:
+            for update in updates:
+                cursor = self._conn.execute("INSERT OR IGNORE INTO pending_updates (update_id, body) VALUES (?, ?)",
+                                            (update['update_id'], json.dumps(update, ensure_ascii=False)))
+                if cursor.rowcount:
+                    added.append(update)
+            if self._saved is None or last > self._saved:
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (self.key, str(last)))
+                self._saved = last
+        return added
+
+    def pending(self, owns=None):
+        """Апдейты из журнала, которые не были обработаны до остановки, по порядку.
+
+        owns(update) отбирает апдейты этого процесса, если журнал общий у нескольких.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT body FROM pending_updates ORDER BY update_id").fetchall()
+        updates = [json.loads(row[0]) for row in rows]
+        return [update for update in updates if owns is None or owns(update)]
+
+    def done(self, update_ids):
+        """Удаляет обработанные апдейты из журнала"""
+        if not update_ids:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM pending_updates WHERE update_id = ?",
+                                   [(update_id,) for update_id in update_ids])
+
+    def _flush(self):
+        if self._finished is not None:
+            self.done(self._finished())
+        if self._source is not None:
+            self.save(self._source())
+
+    def _run(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self._flush()
+            except Exception as e:
+                logger.error("Не удалось сохранить номер апдейта: %s", e)
+
+    def start(self, source=None, interval=1.0, finished=None):
+        self._source = source
+        self._finished = finished
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="update-checkpoint", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._flush()
+        logger.info("Сохранен номер последнего принятого апдейта: %s", self._saved)
+        with self._lock:
+            self._conn.close()
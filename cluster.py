@@ -0,0 +1,227 @@
+"""Запуск бота несколькими процессами на одном хосте.
+
+Главный процесс один забирает апдейты через getUpdates (Telegram не дает
+опрашивать бота параллельно) и пересылает каждый в процесс-обработчик по id
+пользователя: все апдейты пользователя всегда попадают в один и тот же процесс.
+Обработчики - это обычный main.py в режиме вебхука на 127.0.0.1; заявки, файлы,
+анкеты и очередь отправки у них общие, в SQLite.
+
+Пример: BOT_TOKEN=... python cluster.py --workers 4
+"""
+import argparse
+import json
+import logging
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+from telebot import apihelper
+
+import logs
+from checkpoint import UpdateCheckpoint
+from dispatcher import raw_update_user_id, worker_for
+from webhook import SECRET_HEADER
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WEBHOOK_PATH = "/webhook"
+
+logger = logging.getLogger("cluster")
+
+
+class Worker:
+    """Процесс main.py, который принимает апдейты своей доли пользователей"""
+
+    def __init__(self, index, count, port, secret, env):
+        self.index = index
+        self.url = f"http://127.0.0.1:{port}{WEBHOOK_PATH}"
+        self.env = dict(env, BOT_MODE="webhook", WEBHOOK_HOST="127.0.0.1", WEBHOOK_PORT=str(port),
+                        WEBHOOK_PATH=WEBHOOK_PATH, WEBHOOK_SECRET=secret,
+                        WORKER_INDEX=str(index), WORKER_COUNT=str(count))
+        # Обработчики не регистрируют вебхук в Telegram: апдейты им пересылает главный процесс
+        self.env.pop("WEBHOOK_URL", None)
+        if env.get("METRICS_PORT"):
+            self.env["METRICS_PORT"] = str(int(env["METRICS_PORT"]) + index)
+        self.headers = {SECRET_HEADER: secret, "Content-Type": "application/json"}
+        self.session = requests.Session()
+        self.process = None
+        self.terminated = False
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, "main.py")],
+                                        cwd=BASE_DIR, env=self.env)
+        self.terminated = False
+        logger.info("Запущен обработчик %s (pid %s)", self.index, self.process.pid)
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def wait_ready(self, timeout=120):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.alive():
+                return False
+            try:
+                if self.session.get(self.url, timeout=1).status_code == 200:
+                    return True
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        return False
+
+    def deliver(self, body):
+        """Передает апдейт обработчику. True, если он его принял"""
+        try:
+            return self.session.post(self.url, data=body, headers=self.headers, timeout=10).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def terminate(self):
+        """SIGTERM: обработчик доделывает принятые апдейты и завершается"""
+        if self.alive() and not self.terminated:
+            self.process.terminate()
+            # Повторный сигнал прервал бы обработчик, не дав ему доделать апдейты
+            self.terminated = True
+
+    def stop(self, timeout=30):
+        self.terminate()
+        if self.process is not None:
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning("Обработчик %s не завершился за %s с", self.index, timeout)
+                self.process.kill()
+
+
+class Cluster:
+    """Главный процесс: опрос getUpdates и пересылка апдейтов обработчикам.
+
+    checkpoint - UpdateCheckpoint для номера последнего пересланного апдейта: после
+    перезапуска опрос продолжается с него, и принятые обработчиками апдейты не повторяются.
+    """
+
+    def __init__(self, token, workers, base_port, env=None, checkpoint=None):
+        self.token = token
+        secret = secrets.token_hex(16)
+        env = dict(os.environ if env is None else env)
+        self.workers = [Worker(index, workers, base_port + index, secret, env) for index in range(workers)]
+        self.checkpoint = checkpoint
+        self.offset = 0
+        # True, пока апдейты пересылаются обработчикам: это SIGTERM не прерывает
+        self.delivering = False
+        self._stopped = threading.Event()
+
+    def _ensure_running(self, worker):
+        if worker.alive():
+            return
+        logger.warning("Обработчик %s остановился, перезапускаю", worker.index)
+        worker.start()
+        worker.wait_ready()
+
+    def dispatch(self, update):
+        """Отправляет апдейт процессу пользователя; ждет, пока тот его примет (порядок важен)"""
+        key = raw_update_user_id(update)
+        worker = self.workers[worker_for(key if key is not None else update['update_id'], len(self.workers))]
+        body = json.dumps(update, ensure_ascii=False).encode()
+        delay = 0.5
+        while not self._stopped.is_set():
+            if worker.deliver(body):
+                return True
+            self._ensure_running(worker)
+            time.sleep(delay)
+            delay = min(delay * 2, 10)
+        return False
+
+    def run(self, long_polling_timeout=20):
+        # Первый обработчик готовит каталог и переносит старые заявки, остальные ждут его
+        first, others = self.workers[0], self.workers[1:]
+        first.start()
+        if not first.wait_ready():
+            raise RuntimeError("Первый обработчик не запустился")
+        for worker in others:
+            worker.start()
+        for worker in others:
+            if not worker.wait_ready():
+                raise RuntimeError(f"Обработчик {worker.index} не запустился")
+
+        # Апдейты забирает только главный процесс, вебхук в Telegram не должен быть установлен
+        apihelper.delete_webhook(self.token)
+        if self.checkpoint is not None:
+            self.offset = self.checkpoint.load() + 1
+            self.checkpoint.start(lambda: self.offset - 1)
+        logger.info("Обработчиков: %s, опрашиваю getUpdates", len(self.workers))
+        while not self._stopped.is_set():
+            try:
+                updates = apihelper.get_updates(self.token, offset=self.offset, limit=100,
+                                                long_polling_timeout=long_polling_timeout)
+            except Exception as e:
+                logger.error("Ошибка getUpdates: %s", e)
+                self._stopped.wait(3)
+                continue
+            self.delivering = True
+            try:
+                for update in updates:
+                    if not self.dispatch(update):
+                        return
+                    self.offset = update['update_id'] + 1
+            finally:
+                self.delivering = False
+
+    def interrupt(self, signum=None, frame=None):
+        """Обработчик SIGTERM: пересылка останавливается после текущего апдейта, все остальное - сразу"""
+        self._stopped.set()
+        if not self.delivering:
+            raise KeyboardInterrupt
+
+    def stop(self):
+        self._stopped.set()
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+        # Останавливаем обработчики одновременно: каждый доделывает свои апдейты
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бот в нескольких процессах")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="число процессов-обработчиков")
+    parser.add_argument("--base-port", type=int, default=8600, help="порт первого обработчика")
+    args = parser.parse_args()
+
+    listener = logs.setup_logging(os.environ.get("LOG_LEVEL", "INFO"), fmt=os.environ.get("LOG_FORMAT", "json"))
+    token = os.environ.get("BOT_TOKEN")
+    if not token:
+        logger.error("Укажите токен бота в BOT_TOKEN")
+        listener.stop()
+        return 1
+
+    api_url = os.environ.get("TELEGRAM_API_URL")
+    if api_url:
+        apihelper.API_URL = api_url + "/bot{0}/{1}"
+
+    # Номер апдейта хранится в общей базе бота, как и в режиме одного процесса
+    users_data_dir = os.path.join(BASE_DIR, os.environ.get("USERS_DATA_DIR", "users_data"))
+    os.makedirs(users_data_dir, exist_ok=True)
+    checkpoint = UpdateCheckpoint(os.path.join(users_data_dir, "bot.db"))
+
+    cluster = Cluster(token, args.workers, args.base_port, checkpoint=checkpoint)
+    # SIGTERM останавливает опрос, не обрывая пересылку апдейта, и останавливает обработчики
+    signal.signal(signal.SIGTERM, cluster.interrupt)
+    try:
+        cluster.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cluster.stop()
+        listener.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
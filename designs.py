@@ -0,0 +1,111 @@
+import logging
+import re
+import threading
+import time
+
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+# Ответ на inline-запрос - не больше 50 результатов
+INLINE_RESULTS_LIMIT = 50
+
+_WORD = re.compile(r"\w+")
+
+
+def words(text):
+    """Слова для поиска: нижний регистр, ё как е"""
+    return _WORD.findall(text.lower().replace('ё', 'е'))
+
+
+class PreparedResult(types.JsonSerializable):
+    """Результат inline-запроса, сериализованный один раз при сборке индекса"""
+
+    def __init__(self, result):
+        self.id = result.id
+        self.json = result.to_json()
+
+    def to_json(self):
+        return self.json
+
+
+class DesignIndex:
+    """Индекс дизайнов для inline-поиска по названию категории и ключевым словам.
+
+    Для каждого слова заранее записаны все его начала, поэтому поиск по мере
+    набора - несколько обращений к словарю. results - готовые результаты по id
+    дизайна; дизайны без результата (фото еще не загружено) в поиск не попадают.
+    """
+
+    def __init__(self, designs, results):
+        self.designs = tuple(designs)
+        self.complete = all(design.id in results for design in self.designs)
+        self._ordered = [results[design.id] for design in self.designs if design.id in results]
+        position = {result.id: number for number, result in enumerate(self._ordered)}
+        self._prefixes = {}
+        for design in self.designs:
+            if design.id not in results:
+                continue
+            for word in set(words(design.title)) | {w for keyword in design.keywords for w in words(keyword)}:
+                for end in range(1, len(word) + 1):
+                    self._prefixes.setdefault(word[:end], set()).add(position[design.id])
+
+    def __len__(self):
+        return len(self._ordered)
+
+    def search(self, query, limit=INLINE_RESULTS_LIMIT):
+        """Дизайны, у которых каждое слово запроса - начало названия или ключевого слова"""
+        found = None
+        for word in words(query):
+            matches = self._prefixes.get(word, set())
+            found = matches if found is None else found & matches
+            if not found:
+                return []
+        if found is None:
+            return self._ordered[:limit]
+        return [self._ordered[number] for number in sorted(found)[:limit]]
+
+
+class DesignSearch:
+    """Текущий индекс дизайнов: пересобирается при изменении каталога или загрузке фото.
+
+    make_result(design) - готовый результат inline-запроса или None, если у фото
+    еще нет file_id. Пока индекс неполный, не чаще раза в refresh_interval секунд
+    вызывается refresh() (подхватить file_id, загруженные другим процессом) и индекс
+    собирается заново.
+    """
+
+    def __init__(self, make_result, refresh=None, refresh_interval=30):
+        self.make_result = make_result
+        self.refresh = refresh
+        self.refresh_interval = refresh_interval
+        self.index = DesignIndex((), {})
+        self._refreshed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def rebuild(self, designs=None):
+        with self._lock:
+            if designs is None:
+                designs = self.index.designs
+            results = {}
+            for design in designs:
+                try:
+                    result = self.make_result(design)
+                except Exception as e:
+                    logger.error("Не удалось подготовить дизайн %s: %s", design.id, e)
+                    continue
+                if result is not None:
+                    results[design.id] = PreparedResult(result)
+            self.index = DesignIndex(designs, results)
+        if not self.index.complete:
+            logger.info("Дизайнов в поиске: %s из %s", len(self.index), len(designs))
+        return self.index
+
+    def search(self, query, limit=INLINE_RESULTS_LIMIT):
+        index = self.index
+        if not index.complete and self.refresh is not None \
+                and time.monotonic() - self._refreshed_at > self.refresh_interval:
+            self._refreshed_at = time.monotonic()
+            self.refresh()
+            index = self.rebuild()
+        return index.search(query, limit)
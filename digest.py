@@ -0,0 +1,49 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class AdminDigest:
+    """Сводка новых заявок для администратора раз в window секунд.
+
+    Очередь сводки хранится в базе заявок (переживает перезапуск и общая для
+    процессов), send_digest(orders) получает все заявки, накопленные за окно.
+    """
+
+    def __init__(self, order_repo, window, send_digest):
+        self.order_repo = order_repo
+        self.window = window
+        self.send_digest = send_digest
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add(self, order_id):
+        self.order_repo.queue_digest(order_id)
+
+    def flush(self):
+        """Отправляет сводку, если за окно пришли заявки. Возвращает их число"""
+        orders = self.order_repo.pending_digest()
+        if orders:
+            self.send_digest(orders)
+            # Заявки уходят из очереди только после того, как сводка попала в очередь отправки:
+            # если send_digest упадет, они попадут в следующую сводку
+            self.order_repo.done_digest([order['order_id'] for order in orders])
+            logger.info("Сводка заявок отправлена: %s", len(orders))
+        return len(orders)
+
+    def _run(self):
+        while not self._stopped.wait(self.window):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("Ошибка отправки сводки заявок: %s", e)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="admin-digest", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=5):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,167 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+
+import telebot
+
+import logs
+
+logger = logging.getLogger(__name__)
+
+# Типы апдейтов, у которых есть отправитель
+USER_UPDATE_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query',
+    'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+)
+
+
+def update_user_id(update):
+    """Возвращает id пользователя, от которого пришел апдейт"""
+    for field in USER_UPDATE_FIELDS:
+        obj = getattr(update, field, None)
+        if obj is not None and getattr(obj, 'from_user', None) is not None:
+            return obj.from_user.id
+    return None
+
+
+def raw_update_user_id(update):
+    """То же для апдейта в виде словаря JSON, без разбора в объекты telebot"""
+    for field in USER_UPDATE_FIELDS:
+        sender = (update.get(field) or {}).get('from')
+        if sender is not None:
+            return sender['id']
+    return None
+
+
+def worker_for(key, workers):
+    """Номер процесса, который обслуживает пользователя (или апдейт без пользователя)"""
+    return int(key) % workers
+
+
+class OrderedDispatcher:
+    """Пул потоков, в котором задачи одного пользователя выполняются строго по очереди.
+
+    Каждый пользователь закреплен за одним потоком (по id), поэтому его сообщения
+    обрабатываются в порядке поступления, а разные пользователи - параллельно.
+    """
+
+    def __init__(self, workers=8):
+        self._queues = [queue.Queue() for _ in range(workers)]
+        self._processed = [0] * workers
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._worker, args=(index,),
+                                      name=f"dispatcher-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def shard(self, key):
+        # Процесс кластера выбирается по user_id % N, поэтому поток выбирается по другому
+        # признаку: иначе в каждом процессе работала бы только часть потоков
+        return zlib.crc32(str(key).encode()) % len(self._queues)
+
+    def submit(self, key, func, *args, **kwargs):
+        self._queues[self.shard(key)].put((func, args, kwargs))
+
+    def _worker(self, index):
+        tasks = self._queues[index]
+        while True:
+            func, args, kwargs = tasks.get()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logger.exception("Ошибка в обработчике (поток %s): %s", index, e)
+            finally:
+                self._processed[index] += 1
+                tasks.task_done()
+
+    def join(self):
+        """Ждет, пока все поставленные задачи будут выполнены"""
+        for tasks in self._queues:
+            tasks.join()
+
+    def unfinished(self):
+        return sum(tasks.unfinished_tasks for tasks in self._queues)
+
+    def drain(self, timeout):
+        """Ждет выполнения поставленных задач не дольше timeout секунд. Возвращает число невыполненных"""
+        deadline = time.monotonic() + timeout
+        while self.unfinished() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self.unfinished()
+
+    def stats(self):
+        depths = [tasks.qsize() for tasks in self._queues]
+        return {
+            'workers': len(self._queues),
+            'queued': sum(depths),
+            'max_queue': max(depths),
+            'queue_depths': depths,
+            'processed': sum(self._processed),
+        }
+
+
+class OrderedTeleBot(telebot.TeleBot):
+    """TeleBot, который раздает апдейты по потокам OrderedDispatcher по id пользователя.
+
+    Номер для getUpdates сдвигается, как только апдейты переданы в потоки, поэтому
+    медленный обработчик одного пользователя не задерживает прием апдейтов остальных.
+    Telegram при этом считает их подтвержденными; чтобы апдейты, не обработанные к
+    остановке процесса, не потерялись, они до подтверждения записываются в journal
+    (UpdateCheckpoint), а take_finished() отдает номера обработанных для удаления оттуда.
+    """
+
+    def __init__(self, token, workers=8, journal=None, **kwargs):
+        kwargs['threaded'] = False
+        self._lock = threading.Lock()
+        self._received = 0
+        self._finished_ids = []
+        self.journal = journal
+        super().__init__(token, **kwargs)
+        self.dispatcher = OrderedDispatcher(workers)
+
+    @property
+    def last_update_id(self):
+        with self._lock:
+            return self._received
+
+    @last_update_id.setter
+    def last_update_id(self, update_id):
+        # Задается при создании бота, при восстановлении с сохраненного номера и из
+        # TeleBot.process_new_updates для каждого обработанного апдейта - только вперед
+        with self._lock:
+            self._received = max(self._received, update_id)
+
+    def get_updates(self, offset=None, limit=None, timeout=20, allowed_updates=None, long_polling_timeout=20):
+        json_updates = telebot.apihelper.get_updates(
+            self.token, offset=offset, limit=limit, timeout=timeout, allowed_updates=allowed_updates,
+            long_polling_timeout=long_polling_timeout)
+        # Следующий getUpdates подтвердит эти апдейты, до него они должны быть в журнале
+        if json_updates and self.journal is not None:
+            self.journal.add(json_updates)
+        return [telebot.types.Update.de_json(json_update) for json_update in json_updates]
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            self.last_update_id = update.update_id
+            key = update_user_id(update)
+            self.dispatcher.submit(key if key is not None else update.update_id, self._handle_update, update, key)
+
+    def _handle_update(self, update, user_id):
+        # Все записи лога во время обработки апдейта получают id пользователя
+        context = logs.bind(user_id=user_id)
+        try:
+            super().process_new_updates([update])
+        finally:
+            logs.restore(context)
+            if self.journal is not None:
+                with self._lock:
+                    self._finished_ids.append(update.update_id)
+
+    def take_finished(self):
+        """Номера апдейтов, обработанных с прошлого вызова"""
+        with self._lock:
+            finished, self._finished_ids = self._finished_ids, []
+        return finished
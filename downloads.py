@@ -0,0 +1,83 @@
+import os
+import time
+
+import requests
+from telebot import apihelper
+
+
+class DownloadRejected(Exception):
+    """Файл не принят: слишком большой или недопустимого типа. Текст исключения показывается пользователю"""
+
+
+def _mime_allowed(mime_type, allowed_mime_types):
+    if not allowed_mime_types:
+        return True
+    mime_type = (mime_type or '').lower()
+    for allowed in allowed_mime_types:
+        if allowed.endswith('/*') and mime_type.startswith(allowed[:-1]):
+            return True
+        if mime_type == allowed:
+            return True
+    return False
+
+
+def describe_upload(message):
+    """Возвращает (file_id, file_unique_id, расширение, размер, mime-тип) для фото или документа"""
+    if message.content_type == 'photo':
+        photo = message.photo[-1]
+        return photo.file_id, photo.file_unique_id, 'jpg', photo.file_size, 'image/jpeg'
+
+    document = message.document
+    file_ext = document.file_name.split('.')[-1] if document.file_name else 'bin'
+    return document.file_id, document.file_unique_id, file_ext, document.file_size, document.mime_type
+
+
+def check_upload(size, mime_type, max_size, allowed_mime_types):
+    """Проверяет файл по данным из апдейта, еще до скачивания"""
+    if size and size > max_size:
+        raise DownloadRejected(f"Файл слишком большой ({size // (1024 * 1024)} МБ), "
+                               f"максимум {max_size // (1024 * 1024)} МБ")
+    if not _mime_allowed(mime_type, allowed_mime_types):
+        raise DownloadRejected(f"Файлы типа {mime_type or 'неизвестного'} не принимаются. "
+                               "Пришлите изображение или PDF")
+
+
+def _file_url(token, file_path):
+    if apihelper.FILE_URL is None:
+        return "https://api.telegram.org/file/bot{0}/{1}".format(token, file_path)
+    return apihelper.FILE_URL.format(token, file_path)
+
+
+def stream_download(bot, file_id, dest_path, max_size, chunk_size=64 * 1024, timeout=60, hasher=None):
+    """Скачивает файл Telegram по частям во временный файл и атомарно переименовывает его.
+
+    Не держит файл целиком в памяти и обрывает загрузку, если размер превысил max_size.
+    Если передан hasher (например hashlib.sha256()), он обновляется каждой частью файла.
+    Возвращает {'bytes': ..., 'seconds': ...}.
+    """
+    started = time.monotonic()
+    file_info = bot.get_file(file_id)
+    if file_info.file_size and file_info.file_size > max_size:
+        raise DownloadRejected(f"Файл слишком большой, максимум {max_size // (1024 * 1024)} МБ")
+
+    tmp_path = dest_path + '.part'
+    size = 0
+    try:
+        with requests.get(_file_url(bot.token, file_info.file_path), stream=True,
+                          timeout=timeout, proxies=apihelper.proxy) as response:
+            if response.status_code != 200:
+                raise apihelper.ApiHTTPException('Download file', response)
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise DownloadRejected(f"Файл слишком большой, максимум {max_size // (1024 * 1024)} МБ")
+                    f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+        os.replace(tmp_path, dest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return {'bytes': size, 'seconds': time.monotonic() - started}
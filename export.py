@@ -0,0 +1,90 @@
+"""Выгрузка заявок в CSV или zip с файлами.
+
+Заявки читаются из базы пачками и сразу пишутся в файл, поэтому выгрузка
+любого размера не держит все заявки в памяти. Zip с файлами делится на части
+не больше part_size байт, чтобы каждую можно было отправить в Telegram.
+"""
+import csv
+import io
+import os
+import zipfile
+
+from orders import ANSWER_FIELDS
+
+CSV_FIELDS = ('order_id', 'created_at', 'user_id', 'username', 'first_name') + ANSWER_FIELDS + ('files',)
+
+# Фото и pdf уже сжаты, в zip их только складываем
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.pdf', '.zip')
+
+
+def _archive_name(order, file):
+    return f"files/{order['order_id']}/{os.path.basename(file['path'])}"
+
+
+def _csv_row(order, file_names):
+    user_info = order['user_info']
+    row = {
+        'order_id': order['order_id'],
+        'created_at': user_info['timestamp'],
+        'user_id': user_info['user_id'],
+        'username': user_info['username'],
+        'first_name': user_info['first_name'],
+        'files': ';'.join(file_names),
+    }
+    row.update({field: order['answers'].get(field) for field in ANSWER_FIELDS})
+    return row
+
+
+def write_csv(orders, stream, archive_names=False):
+    """Пишет заявки в текстовый поток. archive_names=True - пути файлов как в zip. Возвращает число заявок"""
+    writer = csv.DictWriter(stream, CSV_FIELDS)
+    writer.writeheader()
+    count = 0
+    for order in orders:
+        names = [_archive_name(order, file) if archive_names else file['path'] for file in order['files']]
+        writer.writerow(_csv_row(order, names))
+        count += 1
+    return count
+
+
+def export_csv(orders, path):
+    # utf-8-sig - чтобы Excel сразу открыл кириллицу
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        return write_csv(orders, f)
+
+
+def export_zip(make_orders, path_template, part_size):
+    """Пишет orders.csv и файлы заявок в zip-архивы path_template.format(номер части).
+
+    make_orders() возвращает новый итератор заявок: по ним проходим дважды,
+    для таблицы и для файлов. Возвращает (число заявок, список частей).
+    """
+    parts = [path_template.format(1)]
+    archive = zipfile.ZipFile(parts[0], 'w', zipfile.ZIP_DEFLATED)
+    try:
+        with archive.open('orders.csv', 'w') as raw:
+            with io.TextIOWrapper(raw, encoding='utf-8-sig', newline='') as stream:
+                count = write_csv(make_orders(), stream, archive_names=True)
+
+        for order in make_orders():
+            for file in order['files']:
+                if not os.path.exists(file['path']):
+                    continue
+                # Следующий файл не влезает в текущую часть - начинаем новую
+                if archive.fp.tell() + os.path.getsize(file['path']) > part_size and archive.namelist():
+                    archive.close()
+                    parts.append(path_template.format(len(parts) + 1))
+                    archive = zipfile.ZipFile(parts[-1], 'w', zipfile.ZIP_DEFLATED)
+                compress = zipfile.ZIP_STORED if file['path'].lower().endswith(STORED_EXTENSIONS) \
+                    else zipfile.ZIP_DEFLATED
+                archive.write(file['path'], _archive_name(order, file), compress_type=compress)
+    finally:
+        archive.close()
+    return count, parts
+
+
+def compress_file(path, zip_path):
+    """Упаковывает один файл в zip. Возвращает путь к архиву"""
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.write(path, os.path.basename(path))
+    return zip_path
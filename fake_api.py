@@ -0,0 +1,232 @@
+"""Локальная замена Telegram Bot API для нагрузочных тестов.
+
+Поддерживает getUpdates, sendMessage, sendPhoto, sendDocument, sendMediaGroup,
+getFile и скачивание файлов, умеет добавлять задержку и отвечать 429.
+Бот подключается к нему через TELEGRAM_API_URL=http://127.0.0.1:<порт>.
+
+Запуск отдельно: python fake_api.py --port 8081 --latency 50 --rate-limit 0.01
+"""
+import argparse
+import io
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+# Методы, на которые может прийти искусственный 429
+SEND_METHODS = {'sendMessage', 'sendPhoto', 'sendDocument', 'sendMediaGroup', 'editMessageMedia'}
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Бот закрыл соединение посреди long polling - для теста это нормально
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def _sample_jpeg(size=(1600, 1200)):
+    """Настоящий JPEG, чтобы бот мог построить из него превью"""
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class FakeBotAPI:
+    """Сервер Bot API в памяти. Записывает все вызовы бота для подсчета задержек"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, rate_limit_ratio=0.0, retry_after=1):
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.file_content = _sample_jpeg()
+
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._cond = threading.Condition()
+        # chat_id -> число вызовов бота в этот чат
+        self._chat_calls = {}
+        self.calls = []
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+        self.rate_limited = 0
+        # Бот начал опрашивать getUpdates - можно подавать апдейты
+        self.polling = threading.Event()
+
+        self._server = _QuietServer((host, port), self._make_handler())
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+
+    def start(self):
+        thread = threading.Thread(target=self._server.serve_forever, name="fake-api", daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Апдейты от "пользователей"
+
+    def push_update(self, update):
+        with self._cond:
+            update['update_id'] = next(self._update_ids)
+            self._updates.append(update)
+            self._cond.notify_all()
+        return update['update_id']
+
+    def chat_calls(self, chat_id):
+        with self._cond:
+            return self._chat_calls.get(str(chat_id), 0)
+
+    def wait_for_calls(self, chat_id, count, timeout):
+        """Ждет, пока бот сделает count вызовов в чат. Возвращает False по таймауту"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._chat_calls.get(str(chat_id), 0) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    # Обработка запросов бота
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset', 0) or 0)
+        timeout = float(params.get('timeout', 0) or 0)
+        deadline = time.monotonic() + timeout
+        self.polling.set()
+        with self._cond:
+            # Все, что раньше offset, бот уже подтвердил
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return list(self._updates[:int(params.get('limit', 100) or 100)])
+
+    def _message(self, chat_id, **fields):
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                   'chat': {'id': int(chat_id), 'type': 'private'}}
+        message.update(fields)
+        return message
+
+    def _file(self, kind):
+        number = next(self._file_ids)
+        file = {'file_id': f"fake-{kind}-{number}", 'file_unique_id': f"fake-u-{number}",
+                'file_size': len(self.file_content)}
+        if kind == 'photo':
+            file.update(width=1600, height=1200)
+            return [file]
+        return file
+
+    def _record(self, method, params, body_size):
+        chat_id = params.get('chat_id')
+        with self._cond:
+            self.calls.append((time.monotonic(), method, chat_id, body_size))
+            self.bytes_uploaded += body_size
+            if chat_id is not None:
+                self._chat_calls[str(chat_id)] = self._chat_calls.get(str(chat_id), 0) + 1
+                self._cond.notify_all()
+
+    def handle_method(self, method, params, body_size):
+        """Возвращает (HTTP-код, ответ JSON)"""
+        if method in SEND_METHODS and random.random() < self.rate_limit_ratio:
+            with self._cond:
+                self.rate_limited += 1
+            return 429, {'ok': False, 'error_code': 429,
+                         'description': f"Too Many Requests: retry after {self.retry_after}",
+                         'parameters': {'retry_after': self.retry_after}}
+
+        if method != 'getUpdates':
+            self._record(method, params, body_size)
+
+        chat_id = params.get('chat_id')
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        elif method == 'getUpdates':
+            result = self._get_updates(params)
+        elif method == 'sendMessage':
+            result = self._message(chat_id, text=params.get('text', ''))
+        elif method == 'sendPhoto':
+            result = self._message(chat_id, photo=self._file('photo'), caption=params.get('caption'))
+        elif method == 'sendDocument':
+            result = self._message(chat_id, document=self._file('document'), caption=params.get('caption'))
+        elif method == 'sendMediaGroup':
+            media = json.loads(params.get('media', '[]'))
+            result = [self._message(chat_id, **{item['type']: self._file(item['type'])}) for item in media]
+        elif method == 'editMessageMedia':
+            result = self._message(chat_id, photo=self._file('photo'))
+        elif method == 'getFile':
+            result = {'file_id': params.get('file_id'), 'file_unique_id': params.get('file_id'),
+                      'file_size': len(self.file_content), 'file_path': f"files/{params.get('file_id')}.jpg"}
+        else:
+            # answerCallbackQuery, setWebhook и прочие служебные методы
+            result = True
+        return 200, {'ok': True, 'result': result}
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, code, body, content_type="application/json"):
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self):
+                url = urlparse(self.path)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+                if api.latency:
+                    time.sleep(api.latency)
+
+                parts = url.path.strip('/').split('/')
+                if parts[0] == 'file':
+                    with api._cond:
+                        api.bytes_downloaded += len(api.file_content)
+                    self._reply(200, api.file_content, "application/octet-stream")
+                    return
+
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if body and self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                    params.update({key: values[0] for key, values in parse_qs(body.decode()).items()})
+                code, result = api.handle_method(parts[-1], params, len(body))
+                self._reply(code, json.dumps(result).encode())
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный сервер Bot API")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, мс")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="доля ответов 429 на отправку")
+    args = parser.parse_args()
+
+    fake = FakeBotAPI(port=args.port, latency=args.latency / 1000, rate_limit_ratio=args.rate_limit).start()
+    print(f"Fake Bot API: {fake.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
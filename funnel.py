@@ -0,0 +1,99 @@
+from telebot import types
+
+# Состояние пользователя после последнего шага анкеты
+COMPLETED = 'completed'
+
+
+class InvalidAnswer(Exception):
+    """Ответ не прошел проверку шага. Содержит подсказку для пользователя"""
+
+    def __init__(self, prompt):
+        super().__init__(prompt.text or prompt.caption)
+        self.prompt = prompt
+
+
+class Prompt:
+    """Готовое к отправке сообщение: текст или документ и заранее сериализованная клавиатура"""
+
+    def __init__(self, text=None, reply_markup=None, document=None, caption=None):
+        self.text = text
+        self.document = document
+        self.caption = caption
+        # Клавиатуру переводим в JSON один раз, telebot отправляет строку как есть
+        if isinstance(reply_markup, types.JsonSerializable):
+            reply_markup = reply_markup.to_json()
+        self.reply_markup = reply_markup
+
+    def with_prefix(self, prefix):
+        """Тот же prompt с дополнительным текстом в начале"""
+        if self.document:
+            return Prompt(reply_markup=self.reply_markup, document=self.document,
+                          caption=prefix + (self.caption or ''))
+        return Prompt(prefix + self.text, self.reply_markup)
+
+
+class Step:
+    """Шаг анкеты.
+
+    prompt - сообщение, которое получает пользователь при переходе на этот шаг.
+    field - поле анкеты, куда записывается текстовый ответ.
+    parse - функция text -> {поле: значение}, вместо field; для ошибки бросает InvalidAnswer.
+    next_step - имя следующего шага или функция text -> имя.
+    file_field / file_kind / file_next_step / file_prompt - что делать, если на шаге
+    прислали файл (file_field=None - файлы на этом шаге не принимаются).
+    """
+
+    def __init__(self, name, prompt, field=None, parse=None, next_step=None,
+                 file_field=None, file_kind=None, file_next_step=None, file_prompt=None):
+        self.name = name
+        self.prompt = prompt
+        self.field = field
+        self.parse = parse
+        self.next_step = next_step
+        self.file_field = file_field
+        self.file_kind = file_kind
+        self.file_next_step = file_next_step
+        self.file_prompt = file_prompt
+
+
+class Funnel:
+    """Анкета, заданная таблицей шагов. Переход по состоянию - один поиск в словаре"""
+
+    def __init__(self, steps, completed_prompt):
+        self.steps = {step.name: step for step in steps}
+        self.prompts = {step.name: step.prompt for step in steps}
+        self.prompts[COMPLETED] = completed_prompt
+
+    def __contains__(self, state):
+        return state in self.steps
+
+    def answer_text(self, response, state, text):
+        """Записывает текстовый ответ и возвращает (новое состояние, сообщение пользователю)"""
+        step = self.steps[state]
+        if step.parse is not None:
+            values = step.parse(text)
+        elif step.field is not None:
+            values = {step.field: text}
+        else:
+            # Шаг ждет файл - напоминаем, что нужно прислать
+            return state, step.prompt
+
+        for field, value in values.items():
+            setattr(response, field, value)
+
+        next_step = step.next_step(text) if callable(step.next_step) else step.next_step
+        return next_step, self.prompts[next_step]
+
+    def file_kind(self, state):
+        """Вид файла, который ждет шаг (для имени файла), или None, если файлы не принимаются"""
+        step = self.steps.get(state)
+        if step is None or step.file_field is None:
+            return None
+        return step.file_kind
+
+    def answer_file(self, response, state, saved_file):
+        """Записывает присланный файл и возвращает (новое состояние, сообщение пользователю)"""
+        step = self.steps[state]
+        setattr(response, step.file_field, f"Файл: {saved_file['path']}")
+        response.files.append(saved_file)
+        return step.file_next_step, step.file_prompt or self.prompts[step.file_next_step]
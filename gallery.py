@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict
+
+from ratelimit import Debouncer
+
+
+class GalleryNavigator:
+    """Листание галереи в одном сообщении: какая страница нужна в каждом сообщении.
+
+    Нажатие сразу меняет целевую страницу сообщения, а сама правка идет через
+    Debouncer: при частых нажатиях Telegram получает одну правку сразу и одну,
+    с последней выбранной страницей, в конце интервала. Шаги нажатий складываются,
+    поэтому три быстрых "вперед" перелистывают на три страницы.
+    show(chat_id, message_id, category, index) - показать страницу (номер может выйти
+    за число страниц, show берет его по кругу).
+    """
+
+    def __init__(self, show, debounce=0.7, max_messages=10000):
+        self.show = show
+        self.max_messages = max_messages
+        self._targets = OrderedDict()
+        self._debouncer = Debouncer(debounce)
+        self._lock = threading.Lock()
+
+    def tap(self, chat_id, message_id, category, index, step):
+        """Нажатие кнопки галереи: index - страница, на которой была кнопка, step - -1, 1 или 0.
+
+        Возвращает False, если страница от нажатия не меняется.
+        """
+        key = (chat_id, message_id)
+        with self._lock:
+            target = self._targets.get(key)
+            # Предыдущее нажатие еще не показано - считаем шаг от него
+            if step and target is not None and target[0] == category:
+                index = target[1]
+            new_target = (category, index + step)
+            if new_target == target:
+                return False
+            self._targets[key] = new_target
+            self._targets.move_to_end(key)
+            if len(self._targets) > self.max_messages:
+                self._targets.popitem(last=False)
+        self._debouncer.call(key, lambda: self._render(key))
+        return True
+
+    def _render(self, key):
+        with self._lock:
+            target = self._targets.get(key)
+        if target is not None:
+            self.show(key[0], key[1], *target)
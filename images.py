@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Папки с фотографиями каталога
+CATALOG_FOLDERS = ("maiki", "tshirts")
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Параметры облегченных вариантов для отправки в Telegram
+VARIANT_MAX_SIDE = 1280
+VARIANT_QUALITY = 85
+
+# Превью файлов пользователей для администратора
+PREVIEW_MAX_SIDE = 2048
+PREVIEW_QUALITY = 85
+
+
+def variant_path(source, cache_dir):
+    """Путь к облегченной копии фото в папке кэша"""
+    base, _ = os.path.splitext(source)
+    return os.path.join(cache_dir, base + ".jpg")
+
+
+def _is_fresh(source, variant):
+    return os.path.exists(variant) and os.path.getmtime(variant) >= os.path.getmtime(source)
+
+
+def catalog_image(source, cache_dir):
+    """Возвращает облегченную копию фото, если она готова, иначе оригинал"""
+    variant = variant_path(source, cache_dir)
+    if os.path.exists(source) and _is_fresh(source, variant):
+        return variant
+    return source
+
+
+def render_variant(source, variant, max_side=VARIANT_MAX_SIDE, quality=VARIANT_QUALITY):
+    """Уменьшает фото, поворачивает по EXIF и пересохраняет без метаданных"""
+    variant_dir = os.path.dirname(variant)
+    if variant_dir:
+        os.makedirs(variant_dir, exist_ok=True)
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        # Пишем во временный файл, чтобы бот не отправил недописанное фото.
+        # Файл свой у каждого процесса: одну копию могут готовить одновременно
+        tmp_file = f"{variant}.{os.getpid()}.tmp"
+        image.save(tmp_file, "JPEG", quality=quality, optimize=True, progressive=True)
+    os.replace(tmp_file, variant)
+    return variant
+
+
+def _catalog_sources(folders):
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(folder, name)
+
+
+def preprocess_catalog(cache_dir, folders=CATALOG_FOLDERS, max_side=VARIANT_MAX_SIDE,
+                       quality=VARIANT_QUALITY, workers=None):
+    """Готовит облегченные копии всех фото каталога в пуле процессов.
+
+    Уже актуальные копии пропускаются. Возвращает число обработанных фото.
+    """
+    jobs = [(source, variant_path(source, cache_dir)) for source in _catalog_sources(folders)]
+    jobs = [(source, variant) for source, variant in jobs if not _is_fresh(source, variant)]
+    if not jobs:
+        return 0
+
+    processed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_variant, source, variant, max_side, quality): source
+                   for source, variant in jobs}
+        for future, source in futures.items():
+            try:
+                future.result()
+                processed += 1
+            except Exception as e:
+                logger.error("Не удалось обработать %s: %s", source, e)
+    return processed
+
+
+def render_preview(source, preview, max_side=PREVIEW_MAX_SIDE, quality=PREVIEW_QUALITY):
+    """Проверяет, что файл - целое изображение, и сохраняет превью с исправленной ориентацией"""
+    with Image.open(source) as image:
+        image.verify()
+    # После verify() файл нужно открыть заново
+    return render_variant(source, preview, max_side, quality)
+
+
+class UploadProcessor:
+    """Готовит превью файлов пользователей в пуле процессов, не занимая потоки бота.
+
+    Оригинал не меняется и остается для производства, превью кладется в preview_dir
+    под именем, вычисленным из пути к оригиналу. Файл, который не открылся как
+    изображение, помечается файлом .invalid рядом с превью.
+    """
+
+    def __init__(self, preview_dir, workers=2):
+        self.preview_dir = preview_dir
+        self.workers = workers
+        self._pool = None
+
+    def preview_path(self, source):
+        name = hashlib.sha1(os.path.abspath(source).encode('utf-8')).hexdigest()
+        return os.path.join(self.preview_dir, name[:2], name + ".jpg")
+
+    def preview_for(self, source):
+        """Готовое превью файла или None"""
+        preview = self.preview_path(source)
+        if os.path.exists(source) and _is_fresh(source, preview):
+            return preview
+        return None
+
+    def invalid_path(self, source):
+        return self.preview_path(source) + ".invalid"
+
+    def is_invalid(self, source):
+        """Файл не прошел проверку изображения"""
+        return os.path.exists(self.invalid_path(source))
+
+    def submit(self, source, on_invalid=None):
+        """Ставит файл в очередь на обработку. Не-изображения пропускаются.
+
+        on_invalid(error) вызывается, если файл не открылся как изображение.
+        """
+        if not source.lower().endswith(IMAGE_EXTENSIONS) or self.preview_for(source):
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        future = self._pool.submit(render_preview, source, self.preview_path(source))
+        future.add_done_callback(lambda done: self._report(source, done, on_invalid))
+        return future
+
+    def _report(self, source, future, on_invalid):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            return
+        logger.warning("Не удалось подготовить превью %s: %s", source, error)
+        marker = self.invalid_path(source)
+        try:
+            os.makedirs(os.path.dirname(marker), exist_ok=True)
+            with open(marker, 'w', encoding='utf-8') as f:
+                f.write(str(error))
+        except OSError as e:
+            logger.error("Не удалось пометить файл %s: %s", source, e)
+        if on_invalid is not None:
+            try:
+                on_invalid(error)
+            except Exception as e:
+                logger.error("Ошибка уведомления о файле %s: %s", source, e)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    # Запуск вручную: python images.py
+    count = preprocess_catalog(os.path.join("cache", "catalog"))
+    print(f"✅ Обработано фото каталога: {count}")
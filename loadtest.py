@@ -0,0 +1,164 @@
+"""Нагрузочный тест бота на локальном Bot API (fake_api.py).
+
+Запускает main.py отдельным процессом, направляет его на локальный сервер и
+прогоняет N пользователей по сценарию: /start, МЕРЧ с листанием галереи, анкета с фото и документом,
+/send_to_admin. Для каждого шага считает время от апдейта до ответа бота.
+
+Пример: python loadtest.py --users 200 --concurrency 50 --latency 30 --rate-limit 0.01
+С --workers N бот запускается через cluster.py в N процессах.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_api import FakeBotAPI
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Шаги сценария: (название, содержимое апдейта, сколько сообщений бот пришлет в чат)
+SCENARIO = [
+    ('start', {'text': '/start'}, 1),
+    ('merch', {'text': 'МЕРЧ'}, 2),
+    ('gallery', {'callback': 'gallery:maiki:0:1'}, 1),
+    ('design', {'callback': 'design_single_layer'}, 1),
+    ('main_color_photo', {'photo': True}, 1),
+    ('text_color', {'text': 'Красный'}, 1),
+    ('text', {'text': 'ИВАНОВ'}, 1),
+    ('additional', {'text': 'Да'}, 1),
+    ('additional_document', {'document': True}, 1),
+    ('position', {'text': 'Надпись слева, логотип справа'}, 1),
+    ('age_height', {'text': '16, 175'}, 1),
+    ('font', {'text': 'Arial'}, 1),
+    ('send_to_admin', {'text': '/send_to_admin'}, 1),
+]
+
+
+def make_update(user_id, step, sequence):
+    """Апдейт Telegram от пользователя user_id для шага сценария"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+    chat = {'id': user_id, 'type': 'private'}
+    message = {'message_id': sequence, 'date': int(time.time()), 'chat': chat, 'from': user}
+
+    if 'callback' in step:
+        return {'callback_query': {'id': f"{user_id}-{sequence}", 'from': user, 'chat_instance': str(user_id),
+                                   'data': step['callback'],
+                                   'message': dict(message, text="Выберите", **{'from': dict(user, id=1, is_bot=True)})}}
+    if step.get('photo'):
+        message['photo'] = [{'file_id': f"photo-{user_id}-{sequence}", 'file_unique_id': f"up-{user_id}-{sequence}",
+                             'width': 1600, 'height': 1200, 'file_size': 100 * 1024}]
+    elif step.get('document'):
+        message['document'] = {'file_id': f"doc-{user_id}-{sequence}", 'file_unique_id': f"ud-{user_id}-{sequence}",
+                               'file_name': 'logo.jpg', 'mime_type': 'image/jpeg', 'file_size': 100 * 1024}
+    else:
+        message['text'] = step['text']
+        if step['text'].startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(step['text'])}]
+    return {'message': message}
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def run_user(api, user_id, timeout, latencies, timeouts, lock):
+    """Проходит сценарий за одного пользователя, шаг за шагом дожидаясь ответа бота"""
+    expected = api.chat_calls(user_id)
+    for sequence, (name, step, replies) in enumerate(SCENARIO, 1):
+        expected += replies
+        started = time.monotonic()
+        api.push_update(make_update(user_id, step, sequence))
+        answered = api.wait_for_calls(user_id, expected, timeout)
+        with lock:
+            if answered:
+                latencies.setdefault(name, []).append(time.monotonic() - started)
+            else:
+                timeouts[name] = timeouts.get(name, 0) + 1
+        if not answered:
+            # Дальше по сценарию идти нельзя: бот отстал от пользователя
+            return False
+    return True
+
+
+def start_bot(api, data_dir, env_overrides, log_file, workers=1, base_port=18600):
+    env = dict(os.environ)
+    env.update({
+        'TELEGRAM_API_URL': api.url,
+        'USERS_DATA_DIR': os.path.join(data_dir, 'users_data'),
+        'CACHE_DIR': os.path.join(data_dir, 'cache'),
+    })
+    env.update(env_overrides)
+    if workers > 1:
+        env.setdefault('BOT_TOKEN', '1:loadtest')
+        command = [sys.executable, os.path.join(BASE_DIR, 'cluster.py'),
+                   '--workers', str(workers), '--base-port', str(base_port)]
+    else:
+        command = [sys.executable, os.path.join(BASE_DIR, 'main.py')]
+    return subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота")
+    parser.add_argument("--users", type=int, default=100, help="сколько пользователей пройдет сценарий")
+    parser.add_argument("--concurrency", type=int, default=20, help="сколько пользователей одновременно")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="доля ответов 429 на отправку")
+    parser.add_argument("--timeout", type=float, default=30.0, help="сколько ждать ответа на шаг, с")
+    parser.add_argument("--bot-workers", type=int, help="BOT_WORKERS для бота")
+    parser.add_argument("--workers", type=int, default=1, help="число процессов бота (cluster.py)")
+    parser.add_argument("--base-port", type=int, default=18600, help="порт первого процесса бота")
+    parser.add_argument("--bot-log", help="куда писать вывод бота (по умолчанию во временную папку)")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.latency / 1000, rate_limit_ratio=args.rate_limit).start()
+    env_overrides = {}
+    if args.bot_workers:
+        env_overrides['BOT_WORKERS'] = str(args.bot_workers)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        log_path = args.bot_log or os.path.join(data_dir, 'bot.log')
+        with open(log_path, 'wb') as log_file:
+            bot_process = start_bot(api, data_dir, env_overrides, log_file, args.workers, args.base_port)
+            try:
+                if not api.polling.wait(60) or bot_process.poll() is not None:
+                    print(f"❌ Бот не запустился, см. {log_path}")
+                    return 1
+                print(f"🚀 Бот запущен ({args.workers} проц.), API: {api.url}. Пользователей: {args.users}, "
+                      f"одновременно: {args.concurrency}")
+
+                latencies, timeouts, lock = {}, {}, threading.Lock()
+                started = time.monotonic()
+                with ThreadPoolExecutor(args.concurrency) as pool:
+                    results = list(pool.map(
+                        lambda user_id: run_user(api, user_id, args.timeout, latencies, timeouts, lock),
+                        range(1_000_001, 1_000_001 + args.users)
+                    ))
+                elapsed = time.monotonic() - started
+            finally:
+                bot_process.terminate()
+                bot_process.wait(30)
+
+    steps = sum(len(values) for values in latencies.values())
+    print(f"\n⏱️ {elapsed:.1f} с, шагов: {steps} ({steps / elapsed:.1f} в секунду), "
+          f"сценариев пройдено: {sum(results)}/{args.users}")
+    print(f"📡 Вызовов API: {len(api.calls)}, ответов 429: {api.rate_limited}, "
+          f"загружено: {api.bytes_uploaded // 1024} КБ, скачано: {api.bytes_downloaded // 1024} КБ\n")
+    print(f"{'шаг':<22}{'n':>6}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'макс, мс':>10}{'таймауты':>10}")
+    for name, _, _ in SCENARIO:
+        values = latencies.get(name, [])
+        print(f"{name:<22}{len(values):>6}"
+              f"{percentile(values, 0.5) * 1000:>10.0f}{percentile(values, 0.95) * 1000:>10.0f}"
+              f"{percentile(values, 0.99) * 1000:>10.0f}{max(values, default=0) * 1000:>10.0f}"
+              f"{timeouts.get(name, 0):>10}")
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Структурированные логи бота.
+
+Обработчики только кладут запись в очередь (QueueHandler), в stdout ее пишет
+фоновый поток (QueueListener), поэтому медленный сборщик логов не тормозит бота.
+Каждая запись - строка JSON с полями user_id, handler, step и duration_ms,
+если они известны, и worker - номером процесса, если бот запущен через cluster.py. Частые события можно прореживать: logger.debug(..., extra=sampled()).
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+# Поля контекста, которые попадают в каждую запись
+CONTEXT_FIELDS = ('worker', 'user_id', 'handler', 'step', 'duration_ms')
+
+_context = threading.local()
+
+
+def bind(**fields):
+    """Добавляет поля к контексту текущего потока (например user_id на время апдейта)"""
+    current = getattr(_context, 'fields', None) or {}
+    _context.fields = dict(current, **fields)
+    return current
+
+
+def restore(previous):
+    """Возвращает контекст, сохраненный bind()"""
+    _context.fields = previous
+
+
+def sampled(key=None):
+    """extra для частого события: в лог попадет только каждое N-е (N задается в setup_logging)"""
+    return {'sample_key': key or True}
+
+
+class ContextFilter(logging.Filter):
+    """Переносит поля контекста потока и общие поля процесса в запись. Работает в потоке обработчика"""
+
+    def __init__(self, fields=None):
+        super().__init__()
+        self.fields = fields or {}
+
+    def filter(self, record):
+        for field, value in {**self.fields, **(getattr(_context, 'fields', None) or {})}.items():
+            if not hasattr(record, field):
+                setattr(record, field, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает каждую N-ю запись частого события, остальные отбрасывает до очереди"""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, every)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'sample_key', None)
+        if key is None or self.every == 1:
+            return True
+        if key is True:
+            key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        record.sampled = self.every
+        return count % self.every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS + ('sampled',):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Читаемый формат для локального запуска"""
+
+    def format(self, record):
+        context = ' '.join(f"{field}={getattr(record, field)}" for field in CONTEXT_FIELDS
+                           if getattr(record, field, None) is not None)
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname[0]} " \
+               f"{record.name}: {record.getMessage()}"
+        return f"{line} [{context}]" if context else line
+
+
+def parse_levels(spec):
+    """'outbox=DEBUG,bot.files=WARNING' -> {'outbox': 'DEBUG', 'bot.files': 'WARNING'}"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level="INFO", module_levels=None, fmt="json", sample_every=10, stream=None, fields=None):
+    """Настраивает корневой логгер на очередь и запускает фоновую запись.
+
+    fields - поля, которые получает каждая запись процесса (например {'worker': 2}).
+
+    Возвращает QueueListener; listener.stop() дописывает оставшиеся записи.
+    """
+    # Очередь без ограничения: put() в обработчике никогда не ждет
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(SamplingFilter(sample_every))
+    queue_handler.addFilter(ContextFilter(fields))
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level.upper())
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -1,29 +1,272 @@
-
-import telebot
 import os
-import json
-from PIL import Image
-import io
-from telebot import types
-from datetime import datetime
+import atexit
+import functools
+import logging
+import secrets
+import signal
+import uuid
+from telebot import apihelper, types
+from telebot.apihelper import ApiTelegramException
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from assets import AssetRegistry
+from digest import AdminDigest
+from designs import DesignSearch
+from dispatcher import OrderedTeleBot, raw_update_user_id, worker_for
+from orders import OrderRepository
+from outbox import Outbox
+from blobs import BlobStore, link_blob
+from catalog import CatalogWatcher
+from certificates import CertificateRenderer, format_amount
+from checkpoint import UpdateCheckpoint
+from export import compress_file, export_csv, export_zip
+from downloads import DownloadRejected, check_upload, describe_upload
+from gallery import GalleryNavigator
+from funnel import COMPLETED, Funnel, InvalidAnswer, Prompt, Step
+import logs
+from images import UploadProcessor, catalog_image, preprocess_catalog, render_variant, variant_path
+from metrics import BotMetrics, start_metrics_server
+from throttle import FloodGuard
+from sessions import SessionTable, create_session_store
+from webhook import run_webhook_server
+
+# Адрес Bot API. Можно указать локальный сервер, например fake_api.py для нагрузочных тестов
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL")
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL + "/bot{0}/{1}"
+    apihelper.FILE_URL = TELEGRAM_API_URL + "/file/bot{0}/{1}"
+
+# Запуск несколькими процессами (cluster.py): номер этого процесса и сколько их всего.
+# Пользователь всегда обслуживается процессом worker_for(user_id, WORKER_COUNT)
+WORKER_INDEX = int(os.environ.get("WORKER_INDEX", "0"))
+WORKER_COUNT = int(os.environ.get("WORKER_COUNT", "1"))
+
+# Логи: общий уровень, уровни отдельных модулей ("outbox=DEBUG,bot.files=WARNING"),
+# формат json или text и прореживание частых событий (в лог попадает каждое N-е)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_SAMPLE = int(os.environ.get("LOG_SAMPLE", "10"))
+
+# Запись логов идет в фоновом потоке, обработчики только ставят записи в очередь
+log_listener = logs.setup_logging(LOG_LEVEL, logs.parse_levels(LOG_LEVELS), LOG_FORMAT, LOG_SAMPLE,
+                                  fields={'worker': WORKER_INDEX} if WORKER_COUNT > 1 else None)
+atexit.register(log_listener.stop)
+logger = logging.getLogger("bot")
+files_log = logging.getLogger("bot.files")
+orders_log = logging.getLogger("bot.orders")
+catalog_log = logging.getLogger("bot.catalog")
+
+# Метрики Prometheus: порт HTTP-сервера (0 - выключены) и построчная трассировка апдейтов
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_TRACE = os.environ.get("METRICS_TRACE") == "1"
+
+# Время обработчиков и все вызовы Bot API
+metrics = BotMetrics(trace=METRICS_TRACE)
+metrics.instrument_api()
+
+# Токен бота
+BOT_TOKEN = os.environ.get("BOT_TOKEN", "8241443312:AAFrGbX9bpWJpJvdugF8gZ8D7gepVDlYYCA")
+
+# Число потоков-обработчиков: сообщения одного пользователя всегда идут в один поток
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", "8"))
+# Сколько секунд при остановке ждать, пока обработчики доделают принятые апдейты
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", "20"))
+
+# Анти-флуд: жетонов в секунду и запас на каждое действие пользователя,
+# и сколько апдейтов в секунду (и подряд) пользователь может прислать всего
+FLOOD_RATE = float(os.environ.get("FLOOD_RATE", "1"))
+FLOOD_BURST = int(os.environ.get("FLOOD_BURST", "10"))
+FLOOD_USER_RATE = float(os.environ.get("FLOOD_USER_RATE", "3"))
+FLOOD_USER_BURST = int(os.environ.get("FLOOD_USER_BURST", "20"))
+# Вес действий: тяжелые (много файлов, сообщения администратору) можно повторять реже.
+# Вес кнопок главного меню задается в каталоге (cost раздела)
+FLOOD_COSTS = {
+    "/start": 1,
+    "/send_to_admin": 30,
+    "file": 2,
+    "callback:design_single_layer": 2,
+    "callback:design_double_layer": 2,
+    "callback:originals": 10,
+    "callback:order": 3,
+    "callback:gallery": 1,
+    "/certificate": 5,
+    "/export": 10,
+}
 
 # Инициализация бота
-bot = telebot.TeleBot("8241443312:AAFrGbX9bpWJpJvdugF8gZ8D7gepVDlYYCA")
+bot = OrderedTeleBot(BOT_TOKEN, workers=BOT_WORKERS,
+                     use_class_middlewares=True)
+
+
+def reply_throttled(update, action, wait, first):
+    """Отвечает на отброшенное анти-флудом действие, но не чаще раза за период ожидания"""
+    metrics.throttled.inc(action)
+    text = f"⏳ Слишком часто. Повторите через {int(wait) + 1} с"
+    if isinstance(update, types.CallbackQuery):
+        # На нажатие кнопки нужно ответить всегда, иначе она останется "в загрузке"
+        bot.answer_callback_query(update.id, text)
+    elif first:
+        bot.send_message(update.chat.id, text)
+
+
+flood_guard = FloodGuard(FLOOD_RATE, FLOOD_BURST, FLOOD_USER_RATE, FLOOD_USER_BURST,
+                         costs=FLOOD_COSTS, on_throttled=reply_throttled)
+bot.setup_middleware(flood_guard)
 
 # Папка для хранения данных пользователей
-USERS_DATA_DIR = "users_data"
+USERS_DATA_DIR = os.environ.get("USERS_DATA_DIR", "users_data")
 ADMIN_ID  = 8109501986
 
-# Создаем папку если ее нет
-if not os.path.exists(USERS_DATA_DIR):
-    os.makedirs(USERS_DATA_DIR)
+# Папка для служебных кэшей бота
+CACHE_DIR = os.environ.get("CACHE_DIR", "cache")
+# Облегченные копии фото каталога
+CATALOG_CACHE_DIR = os.path.join(CACHE_DIR, "catalog")
+# Временные файлы выгрузки заявок и максимальный размер одного файла (лимит Telegram - 50 МБ)
+EXPORT_DIR = os.path.join(CACHE_DIR, "exports")
+EXPORT_PART_SIZE = int(os.environ.get("EXPORT_PART_SIZE", str(45 * 1024 * 1024)))
+
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+# Публичный адрес бота, который регистрируется в Telegram (например https://bot.example.com)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+# Секрет в заголовке запросов Telegram. Если не задан, а бот сам регистрирует вебхук
+# (WEBHOOK_URL), генерируется при каждом запуске; без того и другого вебхук не запускается
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+
+# Где хранить незавершенные анкеты: sqlite (переживает перезапуск), memory
+# или свой класс хранилища "модуль:Класс"
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite")
+# Как часто (в секундах) накопленные изменения анкет сбрасываются на диск
+SESSION_FLUSH_INTERVAL = float(os.environ.get("SESSION_FLUSH_INTERVAL", "1.0"))
+# Лимиты анкет в памяти: сколько всего, через сколько секунд простоя удалять
+# и через сколько напомнить о брошенной анкете (0 - не напоминать)
+SESSION_MAX = int(os.environ.get("SESSION_MAX", "10000"))
+SESSION_TTL = int(os.environ.get("SESSION_TTL", str(24 * 3600)))
+SESSION_REMINDER_AFTER = int(os.environ.get("SESSION_REMINDER_AFTER", "0"))
+SESSION_SWEEP_INTERVAL = 60
+SESSION_REMINDER_TEXT = "⏳ Вы не закончили анкету для макета капы. Продолжим?\n\n"
+
+# База данных бота
+DB_PATH = os.path.join(USERS_DATA_DIR, "bot.db")
+
+# Сводка заявок администратору: раз в сколько секунд (0 - каждая заявка сразу)
+# и типы кап из анкеты ("Однослойная", "Двухслойная"), о которых администратор узнает сразу, без сводки
+ADMIN_DIGEST_WINDOW = int(os.environ.get("ADMIN_DIGEST_WINDOW", "0"))
+ADMIN_URGENT_TYPES = [capa_type for capa_type in os.environ.get("ADMIN_URGENT_TYPES", "").split(",") if capa_type]
+# Сколько заявок в одном сообщении сводки
+DIGEST_PAGE_SIZE = 20
+
+# Ограничения Telegram: файлов в медиагруппе и символов в подписи
+MEDIA_GROUP_LIMIT = 10
+CAPTION_LIMIT = 1024
+
+# Ограничения на файлы от пользователей: размер в байтах и допустимые mime-типы
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", str(20 * 1024 * 1024)))
+ALLOWED_UPLOAD_TYPES = os.environ.get(
+    "ALLOWED_UPLOAD_TYPES", "image/*,application/pdf,application/postscript"
+).split(",")
+
+# Сколько процессов готовят превью присланных изображений
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "2"))
+
+# Лимиты исходящих сообщений: всего в секунду и в один чат в секунду
+OUTBOX_GLOBAL_RATE = float(os.environ.get("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_CHAT_RATE = float(os.environ.get("OUTBOX_CHAT_RATE", "1"))
+
+# Создаем папки если их нет
+for folder in (USERS_DATA_DIR, CACHE_DIR):
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+# Реестр file_id уже загруженных в Telegram файлов (мерч, сертификаты, шрифты)
+assets = AssetRegistry(bot, DB_PATH)
+
+# Каталог: цены, тексты и фото разделов меню. Файл перечитывается при изменении без перезапуска
+CATALOG_FILE = os.environ.get("CATALOG_FILE", "catalog.json")
+CATALOG_RELOAD_INTERVAL = float(os.environ.get("CATALOG_RELOAD_INTERVAL", "2"))
+# Inline-поиск дизайнов: сколько секунд Telegram кэширует ответ на запрос и служебный чат,
+# куда фото дизайнов один раз загружаются ради file_id. Без него фото не загружаются заранее,
+# и в поиск попадают только дизайны, уже показанные в галерее
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", "300"))
+ASSET_CHAT_ID = int(os.environ["ASSET_CHAT_ID"]) if os.environ.get("ASSET_CHAT_ID") else None
+# Галерея: нажатия на одно сообщение чаще раза в столько секунд склеиваются в одну правку
+GALLERY_DEBOUNCE = float(os.environ.get("GALLERY_DEBOUNCE", "0.7"))
+# Именные сертификаты: шаблон, шрифт с кириллицей (по умолчанию ищется DejaVu Sans / Arial),
+# секрет для кодов (обязателен, без него /certificate выключена), допустимые суммы, процессы отрисовки и сколько последних хранить на диске
+CERTIFICATE_TEMPLATE = os.environ.get("CERTIFICATE_TEMPLATE", "sertifikate/подарочный-сертификат-MOPTAЛ.jpg")
+CERTIFICATE_FONT = os.environ.get("CERTIFICATE_FONT")
+CERTIFICATE_SECRET = os.environ.get("CERTIFICATE_SECRET")
+CERTIFICATE_MIN_AMOUNT = int(os.environ.get("CERTIFICATE_MIN_AMOUNT", "2700"))
+CERTIFICATE_MAX_AMOUNT = int(os.environ.get("CERTIFICATE_MAX_AMOUNT", "100000"))
+CERTIFICATE_NAME_LIMIT = 40
+CERTIFICATE_WORKERS = int(os.environ.get("CERTIFICATE_WORKERS", "1"))
+CERTIFICATE_CACHE_SIZE = int(os.environ.get("CERTIFICATE_CACHE_SIZE", "200"))
+
+
+def design_result(design):
+    """Результат inline-запроса по уже загруженному фото дизайна или None"""
+    file_id = assets.get(catalog_image(design.path, CATALOG_CACHE_DIR))
+    if file_id is None:
+        return None
+    markup = types.InlineKeyboardMarkup.de_json(design.reply_markup) if design.reply_markup else None
+    return types.InlineQueryResultCachedPhoto(design.id, file_id, title=design.title, caption=design.caption,
+                                              parse_mode="HTML", reply_markup=markup)
+
+
+# Индекс дизайнов в памяти: inline-запрос не читает ни диск, ни базу
+design_search = DesignSearch(design_result, refresh=assets.refresh)
+# Фото дизайнов загружает в Telegram один поток первого процесса
+design_uploads = ThreadPoolExecutor(max_workers=1, thread_name_prefix="design-upload")
+atexit.register(design_uploads.shutdown, wait=False, cancel_futures=True)
+
+
+def upload_designs(designs):
+    """Готовит и загружает облегченные копии фото дизайнов, у которых еще нет file_id, и пересобирает индекс"""
+    uploaded = 0
+    for design in designs:
+        if not os.path.exists(design.path):
+            catalog_log.warning("Нет фото дизайна %s: %s", design.id, design.path)
+            continue
+        variant = variant_path(design.path, CATALOG_CACHE_DIR)
+        try:
+            if catalog_image(design.path, CATALOG_CACHE_DIR) != variant:
+                render_variant(design.path, variant)
+            if assets.get(variant) is None:
+                assets.send_photo(ASSET_CHAT_ID, variant, disable_notification=True)
+                uploaded += 1
+        except Exception as e:
+            catalog_log.error("Не удалось загрузить фото дизайна %s: %s", design.id, e)
+    if uploaded:
+        catalog_log.info("Загружено фото дизайнов: %s", uploaded)
+    design_search.rebuild()
+
+
+def apply_catalog(new_catalog):
+    # Новая таблица весов целиком, анти-флуд видит либо старую, либо новую
+    flood_guard.costs = {**FLOOD_COSTS, **new_catalog.costs()}
+    design_search.rebuild(new_catalog.designs)
+    if WORKER_INDEX == 0 and ASSET_CHAT_ID is not None:
+        design_uploads.submit(upload_designs, new_catalog.designs)
+
+
+if ASSET_CHAT_ID is None and WORKER_INDEX == 0:
+    catalog_log.warning("ASSET_CHAT_ID не задан, фото дизайнов не загружаются для inline-поиска")
 
-# Временное хранилище для текущих ответов пользователей
-user_sessions = {}
-user_states = {}
+catalog = CatalogWatcher(CATALOG_FILE, CATALOG_RELOAD_INTERVAL, on_reload=apply_catalog)
 
 
 class UserResponse:
+    FIELDS = ('user_id', 'username', 'first_name', 'capa_type', 'main_color', 'text_color', 'text',
+              'additional_elements', 'elements_position', 'age', 'height', 'font', 'timestamp', 'files')
+    # Без __dict__ у каждой анкеты: меньше памяти на сессию
+    __slots__ = FIELDS
+
     def __init__(self, user_id):
         self.user_id = user_id
         self.username = None
@@ -38,89 +281,136 @@ class UserResponse:
         self.height = None
         self.font = None
         self.timestamp = None
-
-
-def get_user_file_path(user_id):
-    """Генерирует путь к файлу пользователя"""
-    return os.path.join(USERS_DATA_DIR, f"user_{user_id}.json")
+        # Файлы, прикрепленные к анкете: [{'kind': ..., 'path': ...}]
+        self.files = []
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        user_response = cls(data['user_id'])
+        for field in cls.FIELDS:
+            setattr(user_response, field, data.get(field))
+        user_response.files = user_response.files or []
+        return user_response
+
+
+# Заявки пользователей
+order_repo = OrderRepository(DB_PATH)
+
+# Файлы пользователей без дублей: по file_unique_id и хэшу содержимого
+blob_store = BlobStore(os.path.join(USERS_DATA_DIR, "blobs"), DB_PATH)
+
+# Проверка и превью присланных изображений в отдельных процессах
+upload_processor = UploadProcessor(os.path.join(USERS_DATA_DIR, "previews"), UPLOAD_WORKERS)
+atexit.register(upload_processor.close)
+
+# Очередь исходящих сообщений администратору: обработчики только ставят задачи.
+# Очередь общая для всех процессов, отправляет из нее только первый (общий лимит Telegram)
+outbox = Outbox(bot, DB_PATH, global_rate=OUTBOX_GLOBAL_RATE, chat_rate=OUTBOX_CHAT_RATE,
+                sender=WORKER_INDEX == 0, idle_interval=5.0 if WORKER_COUNT == 1 else 0.5)
+atexit.register(outbox.close)
+
+# Хранилище незавершенных анкет на диске
+session_store = create_session_store(SESSION_BACKEND, DB_PATH, SESSION_FLUSH_INTERVAL)
+atexit.register(session_store.close)
+
+
+def remind_session(user_id, session):
+    """Один раз напоминает пользователю о брошенной анкете"""
+    prompt = DESIGN_FUNNEL.prompts[session.state]
+    outbox.enqueue('send_message', user_id, text=SESSION_REMINDER_TEXT + (prompt.text or prompt.caption))
+
+
+def drop_session(user_id, session, reason):
+    """Анкета удалена из памяти по простою или по лимиту - удаляем и с диска"""
+    logger.info("Анкета удалена (%s)", reason, extra={'user_id': user_id, 'step': session.state})
+    metrics.funnel_dropoff.inc(session.state, reason)
+    session_store.delete(user_id)
+
+
+# Текущие анкеты пользователей: ограничены по числу и времени простоя
+session_table = SessionTable(
+    max_sessions=SESSION_MAX,
+    ttl=SESSION_TTL,
+    reminder_after=SESSION_REMINDER_AFTER or None,
+    on_remind=remind_session,
+    on_evict=drop_session,
+)
+
+# Восстанавливаем всех, кто был в процессе до перезапуска (только своих пользователей)
+for saved_user_id, (saved_state, saved_data) in session_store.load_all().items():
+    if worker_for(saved_user_id, WORKER_COUNT) != WORKER_INDEX:
+        continue
+    session_table.put(saved_user_id, saved_state, UserResponse.from_dict(saved_data))
+session_table.start_sweeper(SESSION_SWEEP_INTERVAL)
+
+metrics.gauge("bot_funnel_active", "Незавершенные анкеты по текущему шагу", ('step',),
+              session_table.count_by_state)
+metrics.gauge("bot_dispatcher_queued", "Апдейты в очереди потока-обработчика", ('worker',),
+              lambda: dict(enumerate(bot.dispatcher.stats()['queue_depths'])))
+metrics.gauge("bot_outbox_pending", "Сообщения в очереди на отправку", (),
+              lambda: {(): outbox.pending_count()})
+
+
+def persist_session(user_id):
+    """Ставит текущее состояние анкеты в очередь на запись в хранилище сессий"""
+    session = session_table.get(user_id)
+    if session is None:
+        session_store.delete(user_id)
+    else:
+        session_store.save(user_id, session.state, session.response.to_dict())
 
 
 def save_user_responses(user_response):
-    """Сохраняет ответы пользователя в его отдельный файл"""
-    user_file = get_user_file_path(user_response.user_id)
-
-    user_data = {
-        'user_info': {
-            'user_id': user_response.user_id,
-            'username': user_response.username,
-            'first_name': user_response.first_name,
-            'timestamp': user_response.timestamp
-        },
-        'answers': {
-            'capa_type': user_response.capa_type,
-            'main_color': user_response.main_color,
-            'text_color': user_response.text_color,
-            'text': user_response.text,
-            'additional_elements': user_response.additional_elements,
-            'elements_position': user_response.elements_position,
-            'age': user_response.age,
-            'height': user_response.height,
-            'font': user_response.font
-        },
-        'files_info': {  # Добавляем информацию о файлах
-            'has_files': False,
-            'files_count': 0,
-            'photos_dir': f"user_{user_response.user_id}_photos"
-        }
+    """Сохраняет заполненную анкету как новую заявку пользователя"""
+    user_info = {
+        'user_id': user_response.user_id,
+        'username': user_response.username,
+        'first_name': user_response.first_name,
+        'timestamp': user_response.timestamp
     }
+    answers = {
+        'capa_type': user_response.capa_type,
+        'main_color': user_response.main_color,
+        'text_color': user_response.text_color,
+        'text': user_response.text,
+        'additional_elements': user_response.additional_elements,
+        'elements_position': user_response.elements_position,
+        'age': user_response.age,
+        'height': user_response.height,
+        'font': user_response.font
+    }
+    # Список файлов берем из анкеты, а не сканированием папки
+    return order_repo.create_order(user_info, answers, user_response.files)
 
-    # Проверяем наличие файлов
-    user_photos_dir = os.path.join(USERS_DATA_DIR, f"user_{user_response.user_id}_photos")
-    if os.path.exists(user_photos_dir):
-        files_count = len([f for f in os.listdir(user_photos_dir) if os.path.isfile(os.path.join(user_photos_dir, f))])
-        user_data['files_info']['has_files'] = True
-        user_data['files_info']['files_count'] = files_count
-
-    with open(user_file, 'w', encoding='utf-8') as f:
-        json.dump(user_data, f, ensure_ascii=False, indent=2)
 
 def load_user_responses(user_id):
-    """Загружает ответы пользователя из его файла"""
-    user_file = get_user_file_path(user_id)
-
-    print(f"🔄 Загружаю данные пользователя {user_id} из {user_file}")  # Отладочное сообщение
-
-    if not os.path.exists(user_file):
-        print(f"❌ Файл {user_file} не существует")  # Отладочное сообщение
-        return None
+    """Загружает последнюю заявку пользователя"""
+    orders_log.debug("Загружаю заявку пользователя %s", user_id)
 
     try:
-        with open(user_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        print(f"✅ Данные пользователя {user_id} успешно загружены")  # Отладочное сообщение
-        return data
+        data = order_repo.latest_order(user_id)
     except Exception as e:
-        print(f"❌ Ошибка загрузки файла {user_file}: {e}")  # Отладочное сообщение
+        orders_log.exception("Ошибка загрузки заявки пользователя %s: %s", user_id, e)
         return None
 
+    if data is None:
+        orders_log.info("У пользователя %s нет заявок", user_id)
+        return None
+
+    orders_log.debug("Заявка №%s пользователя %s загружена", data['order_id'], user_id)
+    return data
 
-# Главное меню
-@bot.message_handler(commands=['start'])
-def start(message):
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
 
-    btn1 = types.KeyboardButton("Самые продаваемые дизайны стандартных кап")
-    btn2 = types.KeyboardButton("Стандартная однослойная")
-    btn3 = types.KeyboardButton("Стандартная двухслойная")
-    btn4 = types.KeyboardButton("Индивидуальная капа по слепкам")
-    btn5 = types.KeyboardButton("Оптовый заказ")
-    btn6 = types.KeyboardButton("МЕРЧ")
-    btn7 = types.KeyboardButton("Сертификаты")
+WELCOME_TEXT = "Здравствуйте! 👋 Рады приветствовать вас в MORTAL в разделе по изготовлению стандартных и индивидуальных кап с личным дизайном!"
 
-    markup.add(btn1, btn2, btn3, btn4, btn5, btn6, btn7)
 
-    welcome_text = "Здравствуйте! 👋 Рады приветствовать вас в MORTAL в разделе по изготовлению стандартных и индивидуальных кап с личным дизайном!"
-    bot.send_message(message.chat.id, welcome_text, reply_markup=markup)
+@bot.message_handler(commands=['start'])
+def start(message):
+    # Главное меню собирается из каталога и сериализуется при каждой его загрузке
+    bot.send_message(message.chat.id, WELCOME_TEXT, reply_markup=catalog.current.menu_markup)
 
 
 # Обработка текстовых сообщений (кроме команд)
@@ -130,472 +420,326 @@ def handle_text(message):
     user_id = str(message.from_user.id)
 
     # Проверяем, находится ли пользователь в процессе разработки дизайна
-    if user_id in user_states and user_states[user_id] != 'completed':
+    session = session_table.get(user_id)
+    if session is not None and session.state in DESIGN_FUNNEL:
         handle_design_states(message)
         return
 
-    if message.text == "Самые продаваемые дизайны стандартных кап":
-        send_popular_designs(chat_id)
-
-    elif message.text == "Стандартная однослойная":
-        send_single_layer(chat_id)
-
-    elif message.text == "Стандартная двухслойная":
-        send_double_layer(chat_id)
-
-    elif message.text == "Индивидуальная капа по слепкам":
-        send_custom_mouthguard(chat_id)
-
-    elif message.text == "Оптовый заказ":
-        send_wholesale(chat_id)
-
-    elif message.text == "МЕРЧ":
-        send_merch(chat_id)
-
-    elif message.text == "Сертификаты":
-        send_sertificate(chat_id)
-
+    section = catalog.current.sections.get(message.text)
+    if section is not None:
+        section_action(section.id)(chat_id, section)
 
 
-# 1. Самые продаваемые дизайны
-def send_popular_designs(chat_id):
-    markup = types.InlineKeyboardMarkup()
-    btn = types.InlineKeyboardButton("Заказать", url="https://t.me/mortal_shop_team")
-    markup.add(btn)
-
-    bot.send_message(chat_id,
-                         "<b>Цена капы с готовым дизайном: 2.700руб.</b>\n"
-                         "<b>Готовые дизайны смотри по ссылке:</b> https://t.me/mrLanski/4185"
-                         "\n\nДля заказа капы с любым дизайном напишите: @mortal_shop_team",
-                         parse_mode="HTML",
-                         reply_markup=markup)
-
-
-# 2. Стандартная однослойная
-def send_single_layer(chat_id):
-    markup = types.InlineKeyboardMarkup()
-    btn_order = types.InlineKeyboardButton("Заказать", url="https://t.me/mortal_shop_team")
-    btn_design = types.InlineKeyboardButton("Разработать дизайн", callback_data="design_single_layer")
-    markup.add(btn_design, btn_order)
-
-    text = """
-<b>· Однослойная капа — 2 700 ₽</b>
-<b>· Разработка макета — бесплатно!</b>
-
-Выберите действие:
-"""
-    bot.send_message(chat_id, text, parse_mode="HTML", reply_markup=markup)
-
-
-# 3. Стандартная двухслойная
-def send_double_layer(chat_id):
-    markup = types.InlineKeyboardMarkup()
-    btn_order = types.InlineKeyboardButton("Заказать", url="https://t.me/mortal_shop_team")
-    btn_design = types.InlineKeyboardButton("Разработать дизайн", callback_data="design_double_layer")
-    markup.add(btn_design, btn_order)
-
-    text = """
-<b>· Двухслойная капа — 3 000 ₽</b>
-<b>· Разработка макета — бесплатно!</b>
+def send_media_block(chat_id, block, parse_mode):
+    """Отправляет файлы раздела: медиагруппой или по одному (уже загруженные - по file_id)"""
+    files = block.existing_files()
+    if not files:
+        if block.missing_text:
+            bot.send_message(chat_id, block.missing_text)
+        catalog_log.warning("Нет файлов для отправки: %s", ", ".join(block.files))
+        return
 
-Выберите действие:
-"""
-    bot.send_message(chat_id, text, parse_mode="HTML", reply_markup=markup)
+    if block.kind == 'photo':
+        files = [catalog_image(path, CATALOG_CACHE_DIR) for path in files]
+    if block.group:
+        media = [(path, block.caption if i == 0 else None) for i, path in enumerate(files)]
+        try:
+            assets.send_media_group(chat_id, media, kind=block.kind, parse_mode=parse_mode)
+            catalog_log.debug("Медиагруппа %s отправлена", files[0], extra=logs.sampled())
+            return
+        except Exception as e:
+            catalog_log.error("Ошибка отправки медиагруппы %s: %s", files[0], e)
+            # Если медиагруппа не сработала, отправляем по одному
 
+    send = assets.send_photo if block.kind == 'photo' else assets.send_document
+    for i, path in enumerate(files):
+        kwargs = {'timeout': block.timeout} if block.timeout else {}
+        if i == 0 and block.caption:
+            kwargs.update(caption=block.caption, parse_mode=parse_mode)
+        try:
+            send(chat_id, path, **kwargs)
+        except Exception as e:
+            catalog_log.error("Ошибка отправки %s: %s", path, e)
 
-# 4. Индивидуальная капа по слепкам
-def send_custom_mouthguard(chat_id):
-    markup = types.InlineKeyboardMarkup()
-    btn = types.InlineKeyboardButton("Заказать", url="https://t.me/mortal_shop_team")
-    markup.add(btn)
 
-    text = """
-<b>Цены на индивидуальные капы:</b>
+def send_section(chat_id, section):
+    """Раздел каталога: сначала файлы или галерея, описание с кнопками - в конце"""
+    for block in section.media:
+        send_media_block(chat_id, block, section.parse_mode)
+    if section.gallery:
+        send_gallery_page(chat_id, catalog.current.gallery_page(section.gallery, 0))
+    bot.send_message(chat_id, section.text, parse_mode=section.parse_mode, reply_markup=section.reply_markup)
 
-1. ИНДИВИДУАЛЬНАЯ ПРОЗРАЧНАЯ КАПА - 10.000₽
-2. ИНДИВИДУАЛЬНАЯ ЦВЕТНАЯ КАПА - 11.000₽
-3. ИНДИВИДУАЛЬНАЯ КАПА С НАДПИСЬЮ,ЛОГО - 12.000₽
-4. ИНДИВИДУАЛЬНАЯ ЦВЕТНАЯ КАПА С ЛИЧНЫМ ДИЗАЙНОМ - 13.000₽
-5. ИНДИВИДУАЛЬНАЯ ХОККЕЙНАЯ КАПА - 14.000₽
 
-При заказе вы будете перенаправлены менеджеру @mortal_shop_team
-    """
-    bot.send_message(chat_id, text, parse_mode="HTML", reply_markup=markup)
+def send_gallery_page(chat_id, page):
+    """Сообщение галереи: дальше оно только правится кнопками листания"""
+    if page is None:
+        return
+    path = catalog_image(page.path, CATALOG_CACHE_DIR)
+    if not os.path.exists(path):
+        catalog_log.warning("Нет фото галереи: %s", page.path)
+        return
+    try:
+        assets.send_photo(chat_id, path, caption=page.caption, parse_mode="HTML", reply_markup=page.reply_markup)
+    except Exception as e:
+        catalog_log.error("Ошибка отправки галереи %s: %s", page.path, e)
 
 
-# 5. Оптовый заказ
-def send_wholesale(chat_id):
-    markup = types.InlineKeyboardMarkup()
-    btn = types.InlineKeyboardButton("Заказать", url="https://t.me/mortal_shop_team")
-    markup.add(btn)
+def show_gallery_page(chat_id, message_id, category, index):
+    """Меняет фото, подпись и кнопки сообщения галереи на страницу index категории"""
+    page = catalog.current.gallery_page(category, index)
+    if page is None:
+        return
+    try:
+        assets.edit_media(chat_id, message_id, catalog_image(page.path, CATALOG_CACHE_DIR),
+                          caption=page.caption, parse_mode="HTML", reply_markup=page.reply_markup)
+    except ApiTelegramException as e:
+        # Быстрые нажатия вернули ту же страницу, что уже показана
+        if 'message is not modified' not in str(e.description):
+            catalog_log.error("Ошибка листания галереи %s: %s", page.path, e)
+    except Exception as e:
+        catalog_log.error("Ошибка листания галереи %s: %s", page.path, e)
 
-    text = """
-<b>Оптовые цены кап под ключ однослойные:</b>
-• Стандартные однослойные
-5-20шт - 1.100 руб/шт
-21-50 штук - 1.050 руб/шт  
-51-100 штук - 1.000 руб/шт
-101-500 штук - 900 руб/шт
-500+ штук - 800 руб/шт 
 
-• Стандартные двухслойные
-10+ штук - 1.500 руб/шт
+# Листание галереи правкой одного сообщения, частые нажатия склеиваются
+gallery_navigator = GalleryNavigator(show_gallery_page, debounce=GALLERY_DEBOUNCE)
 
-Разработка упаковки и наклейки для футляра 3.500руб. разово, если брендированная упаковка не нужна, то отправляем в базовой.
 
-При заказе вы будете перенаправлены менеджеру @mortal_shop_team
-    """
-    bot.send_message(chat_id, text, parse_mode="HTML", reply_markup=markup)
-
-
-# 6. МЕРЧ
-def send_merch(chat_id):
-    maiki_folders = "maiki"
-    tshirt_folders = "tshirts"
-
-    # Создаем медиагруппу для маек
-    media = []
-    photo_files = [
-        os.path.join(maiki_folders, "maikaME1.JPG"),
-        os.path.join(maiki_folders, "maikaME2.JPG"),
-        os.path.join(maiki_folders, "maikaME3.JPG"),
-        os.path.join(maiki_folders, "maikaME4.JPG"),
-        os.path.join(maiki_folders, "maikaME5.JPG"),
-        os.path.join(maiki_folders, "maikaME6.JPG")
-    ]
-
-    # Формируем медиагруппу
-    for i, photo_file in enumerate(photo_files):
-        if os.path.exists(photo_file):
-            try:
-                with open(photo_file, 'rb') as tshirt:
-                    photo_data = tshirt.read()
-
-                if i == 0:
-                    media.append(types.InputMediaPhoto(photo_data,
-                                                       caption="<b>Майки «ME vs ME»</b>\n\nСиний, красный, черный цвета - 3.500руб",
-                                                       parse_mode="HTML"))
-                else:
-                    media.append(types.InputMediaPhoto(photo_data))
-
-            except Exception as e:
-                print(f"Ошибка чтения {photo_file}: {e}")
-
-    # Отправляем медиагруппу
-    if media:
+# Inline-режим: поиск дизайнов по категории или слову из любого чата (@бот бойцы)
+@bot.inline_handler(func=lambda query: True)
+def inline_designs(query):
+    results = design_search.search(query.query)
+    bot.answer_inline_query(query.id, results, cache_time=INLINE_CACHE_TIME, is_personal=False)
+
+
+@functools.lru_cache(maxsize=None)
+def own_bot_id():
+    """id бота: запрашивается у Telegram один раз"""
+    return bot.get_me().id
+
+
+def is_own_inline_choice(message):
+    return message.via_bot is not None and message.via_bot.id == own_bot_id()
+
+
+# Дизайн, выбранный через inline-режим этого бота в чате с ним, - не файл для анкеты.
+# Фото через других inline-ботов доходят до обработчика файлов как обычные
+@bot.message_handler(content_types=['photo'], func=is_own_inline_choice)
+def handle_inline_choice(message):
+    files_log.debug("Выбран дизайн через inline-режим, в анкету не добавляется", extra=logs.sampled())
+
+
+# Обертки с метрикой времени по id раздела: разделы могут появиться при перезагрузке каталога
+_section_actions = {}
+
+
+def section_action(section_id):
+    action = _section_actions.get(section_id)
+    if action is None:
+        action = _section_actions.setdefault(section_id, metrics.timed("send_" + section_id, send_section))
+    return action
+
+
+# Анкета для разработки дизайна капы: шаги, проверки и переходы заданы таблицей,
+# сообщения и клавиатуры подготовлены заранее
+REMOVE_KEYBOARD = types.ReplyKeyboardRemove().to_json()
+
+YES_NO_MARKUP = types.ReplyKeyboardMarkup(resize_keyboard=True)
+YES_NO_MARKUP.add(types.KeyboardButton('Да'), types.KeyboardButton('Нет'))
+
+COMPLETED_MARKUP = types.ReplyKeyboardMarkup(resize_keyboard=True)
+COMPLETED_MARKUP.add(types.KeyboardButton('/send_to_admin'), types.KeyboardButton('/start'))
+
+AGE_HEIGHT_ERROR = Prompt(
+    "Пожалуйста, укажите в правильном формате:\n"
+    "Возраст, Рост\n"
+    "Например: 16, 175"
+)
+
+
+def parse_age_height(text):
+    parts = text.split(',')
+    if len(parts) != 2:
+        raise InvalidAnswer(AGE_HEIGHT_ERROR)
+    return {'age': parts[0].strip(), 'height': parts[1].strip()}
+
+
+def parse_additional_elements(text):
+    if text == 'Да':
+        return {'additional_elements': "Да (ожидается файл)"}
+    return {'additional_elements': "Нет"}
+
+
+ELEMENTS_POSITION_PROMPT = Prompt(
+    "5. Опишите расположение всех элементов на капе.\n\n"
+    "Где и как именно должны находиться надпись, логотип и другие детали?",
+    REMOVE_KEYBOARD
+)
+TEXT_COLOR_PROMPT = Prompt(
+    "2. Какой цвет должен быть у надписи?\n\n"
+    "Укажите цвет текста:"
+)
+
+DESIGN_FUNNEL = Funnel([
+    Step('waiting_main_color',
+         Prompt("1. Укажите основной цвет капы или прикрепите фото/изображение для фона в хорошем качестве (не скриншот).\n\n"
+                "Напишите название цвета или отправьте изображение:", REMOVE_KEYBOARD),
+         field='main_color', next_step='waiting_text_color',
+         file_field='main_color', file_kind='main_color', file_next_step='waiting_text_color',
+         file_prompt=TEXT_COLOR_PROMPT.with_prefix("✅ Файл основного цвета сохранен!\n\n")),
+    Step('waiting_text_color', TEXT_COLOR_PROMPT,
+         field='text_color', next_step='waiting_text'),
+    Step('waiting_text',
+         Prompt("3. Напишите текст для нанесения.\n\n"
+                "Укажите именно так, как должно быть отображено (например, \"ИВАНОВ\", \"Победитель\" или \"чемпион\"):"),
+         field='text', next_step='waiting_additional_elements'),
+    Step('waiting_additional_elements',
+         Prompt("4. Планируются ли дополнительные элементы (логотип, картинка, фото)?\n\n"
+                "Если да, пожалуйста, прикрепите файл в хорошем качестве (не скриншот).\n"
+                "Сначала выберете <Да> либо <Нет>", YES_NO_MARKUP),
+         parse=parse_additional_elements,
+         next_step=lambda text: 'waiting_additional_file' if text == 'Да' else 'waiting_elements_position'),
+    Step('waiting_additional_file',
+         Prompt("Пожалуйста, прикрепите файл с дополнительными элементами:", REMOVE_KEYBOARD),
+         file_field='additional_elements', file_kind='additional', file_next_step='waiting_elements_position',
+         file_prompt=Prompt("✅ Дополнительный файл сохранен!\n\n" + ELEMENTS_POSITION_PROMPT.text)),
+    Step('waiting_elements_position', ELEMENTS_POSITION_PROMPT,
+         field='elements_position', next_step='waiting_age_height'),
+    Step('waiting_age_height',
+         Prompt("6. Подтвердите, пожалуйста:\n"
+                "• Ваш возраст\n"
+                "• Ваш рост\n\n"
+                "Укажите в формате: Возраст, Рост\n"
+                "Например: 16, 175"),
+         parse=parse_age_height, next_step='waiting_font'),
+    Step('waiting_font',
+         Prompt(document="font.JPG", caption="7. Выберите шрифт:"),
+         field='font', next_step=COMPLETED),
+], completed_prompt=Prompt(
+    "✅ Все ответы сохранены в ваш персональный файл!\n\n"
+    "Используйте команды:\n"
+    "/send_to_admin - отправить заявку администратору\n"
+    "/start - вернуться в главное меню",
+    COMPLETED_MARKUP
+))
+
+
+def send_prompt(chat_id, prompt):
+    """Отправляет заранее подготовленное сообщение анкеты"""
+    if prompt.document:
         try:
-            bot.send_media_group(chat_id, media)
-            print("Медиагруппа отправлена успешно!")
+            return assets.send_document(chat_id, prompt.document, caption=prompt.caption,
+                                        reply_markup=prompt.reply_markup)
         except Exception as e:
-            print(f"Ошибка отправки медиагруппы: {e}")
-            # Если медиагруппа не сработала, отправляем по одному
-            for photo_file in photo_files:
-                if os.path.exists(photo_file):
-                    try:
-                        with open(photo_file, 'rb') as tshirt:
-                            bot.send_photo(chat_id, tshirt)
-                    except Exception as e2:
-                        print(f"Ошибка отправки {photo_file}: {e2}")
-    else:
-        bot.send_message(chat_id, "Фото мерча временно недоступны")
-        print("Нет доступных фото для отправки")
-
-    # Создаем медиагруппу для футболок
-    media2 = []
-    tshirt_files = [
-        os.path.join(tshirt_folders, "tshirt1.JPG"),
-        os.path.join(tshirt_folders, "tshirt2.JPG"),
-        os.path.join(tshirt_folders, "tshirt3.JPG"),
-        os.path.join(tshirt_folders, "tshirt4.JPG"),
-        os.path.join(tshirt_folders, "tshirt5.JPG"),
-        os.path.join(tshirt_folders, "tshirt6.JPG"),
-        os.path.join(tshirt_folders, "tshirt7.JPG"),
-        os.path.join(tshirt_folders, "tshirt8.JPG"),
-        os.path.join(tshirt_folders, "tshirt9.JPG"),
-        os.path.join(tshirt_folders, "tshirt10.JPG")
-    ]
-
-    # Формируем медиагруппу для футболок
-    for i, tshirt_file in enumerate(tshirt_files):
-        if os.path.exists(tshirt_file):
-            try:
-                with open(tshirt_file, 'rb') as tshirt:
-                    tshirt_data = tshirt.read()
-
-                if i == 0:
-                    media2.append(types.InputMediaPhoto(tshirt_data,
-                                                        caption="<b>Футболки MORTAL</b>\n\n«FRIENDS OR MONEY», «YOUR GRANDMOTHER» и другие - от 3.500руб",
-                                                        parse_mode="HTML"))
-                else:
-                    media2.append(types.InputMediaPhoto(tshirt_data))
-
-            except Exception as e:
-                print(f"Ошибка чтения {tshirt_file}: {e}")
-
-    # Отправляем медиагруппу с футболками
-    if media2:
-        try:
-            bot.send_media_group(chat_id, media2)
-            print("Медиагруппа с футболками отправлена успешно!")
-        except Exception as e:
-            print(f"Ошибка отправки медиагруппы с футболками: {e}")
-    else:
-        bot.send_message(chat_id, "Фото футболок временно недоступны")
-
-    # Отправляем текстовое сообщение с кнопкой
-    markup = types.InlineKeyboardMarkup()
-    btn = types.InlineKeyboardButton("Заказать", url="https://t.me/mortal_shop_team")
-    markup.add(btn)
-
-    text = """
-<b>Ассортимент МЕРЧ:</b>
-
-<b>Майки «ME vs ME»</b>
-• Синий цвет - 3.500руб
-• Красный цвет - 3.500руб  
-• Чёрный цвет - 3.500руб
+            logger.error("Ошибка отправки %s: %s", prompt.document, e)
+            return bot.send_message(chat_id, prompt.caption, reply_markup=prompt.reply_markup)
+    return bot.send_message(chat_id, prompt.text, reply_markup=prompt.reply_markup)
 
-<b>Футболки:</b>
-• «FRIENDS OR MONEY» - 3.500руб
-• «YOUR GRANDMOTHER» - 3.500руб
-• «CHIKO» - 4.500руб
-• «NO BOXING» - 4.500руб
-• «BABY» - 4.500руб
 
-При заказе вы будете перенаправлены менеджеру @mortal_shop_team
-    """
-    bot.send_message(chat_id, text, parse_mode="HTML", reply_markup=markup)
-
-
-# Функции для разработки дизайна капы
 def start_design_process(message, capa_type):
     user_id = str(message.from_user.id)
 
     # Создаем или обновляем сессию пользователя
-    user_sessions[user_id] = UserResponse(user_id)
-    user_sessions[user_id].username = message.from_user.username
-    user_sessions[user_id].first_name = message.from_user.first_name
-    user_sessions[user_id].capa_type = capa_type
-    user_states[user_id] = 'waiting_main_color'
+    user_response = UserResponse(user_id)
+    user_response.username = message.from_user.username
+    user_response.first_name = message.from_user.first_name
+    user_response.capa_type = capa_type
+    session_table.put(user_id, 'waiting_main_color', user_response)
+    persist_session(user_id)
 
-    bot.send_message(
-        message.chat.id,
-        f"Отлично! Вы выбрали {capa_type.lower()} капу. Давайте создадим макет.\n\n"
-        "1. Укажите основной цвет капы или прикрепите фото/изображение для фона в хорошем качестве (не скриншот).\n\n"
-        "Напишите название цвета или отправьте изображение:",
-        reply_markup=types.ReplyKeyboardRemove()
-    )
+    send_prompt(message.chat.id, DESIGN_FUNNEL.prompts['waiting_main_color'].with_prefix(
+        f"Отлично! Вы выбрали {capa_type.lower()} капу. Давайте создадим макет.\n\n"))
 
 
 def handle_design_states(message):
     user_id = str(message.from_user.id)
-    current_state = user_states.get(user_id)
-
-    if current_state == 'waiting_main_color':
-        user_sessions[user_id].main_color = message.text
-        user_states[user_id] = 'waiting_text_color'
-
-        bot.send_message(
-            message.chat.id,
-            "2. Какой цвет должен быть у надписи?\n\n"
-            "Укажите цвет текста:"
-        )
-
-    elif current_state == 'waiting_text_color':
-        user_sessions[user_id].text_color = message.text
-        user_states[user_id] = 'waiting_text'
-
-        bot.send_message(
-            message.chat.id,
-            "3. Напишите текст для нанесения.\n\n"
-            "Укажите именно так, как должно быть отображено (например, \"ИВАНОВ\", \"Победитель\" или \"чемпион\"):"
-        )
-
-    elif current_state == 'waiting_text':
-        user_sessions[user_id].text = message.text
-        user_states[user_id] = 'waiting_additional_elements'
-
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        btn_yes = types.KeyboardButton('Да')
-        btn_no = types.KeyboardButton('Нет')
-        markup.add(btn_yes, btn_no)
-
-        bot.send_message(
-            message.chat.id,
-            "4. Планируются ли дополнительные элементы (логотип, картинка, фото)?\n\n"
-            "Если да, пожалуйста, прикрепите файл в хорошем качестве (не скриншот).\n"
-            "Сначала выберете <Да> либо <Нет>",
-            reply_markup=markup
-        )
-
-    elif current_state == 'waiting_additional_elements':
-        if message.text == 'Да':
-            user_sessions[user_id].additional_elements = "Да (ожидается файл)"
-            user_states[user_id] = 'waiting_additional_file'
-            bot.send_message(
-                message.chat.id,
-                "Пожалуйста, прикрепите файл с дополнительными элементами:",
-                reply_markup=types.ReplyKeyboardRemove()
-            )
-        else:
-            user_sessions[user_id].additional_elements = "Нет"
-            user_states[user_id] = 'waiting_elements_position'
-            bot.send_message(
-                message.chat.id,
-                "5. Опишите расположение всех элементов на капе.\n\n"
-                "Где и как именно должны находиться надпись, логотип и другие детали?",
-                reply_markup=types.ReplyKeyboardRemove()
-            )
-
-    elif current_state == 'waiting_elements_position':
-        user_sessions[user_id].elements_position = message.text
-        user_states[user_id] = 'waiting_age_height'
-
-        bot.send_message(
-            message.chat.id,
-            "6. Подтвердите, пожалуйста:\n"
-            "• Ваш возраст\n"
-            "• Ваш рост\n\n"
-            "Укажите в формате: Возраст, Рост\n"
-            "Например: 16, 175"
-        )
-
-    elif current_state == 'waiting_age_height':
-        try:
-            parts = message.text.split(',')
-            if len(parts) == 2:
-                age = parts[0].strip()
-                height = parts[1].strip()
-                user_sessions[user_id].age = age
-                user_sessions[user_id].height = height
-                user_states[user_id] = 'waiting_font'
-
+    session = session_table.get(user_id)
+    user_response = session.response
+    logger.debug("Ответ на шаге анкеты", extra=dict(logs.sampled(), step=session.state))
 
+    try:
+        new_state, prompt = DESIGN_FUNNEL.answer_text(user_response, session.state, message.text)
+    except InvalidAnswer as e:
+        send_prompt(message.chat.id, e.prompt)
+        return
 
-                font = open("font.JPG", "rb")
-                bot.send_document(
-                    message.chat.id, font,caption="7. Выберите шрифт:")
-            else:
-                bot.send_message(
-                    message.chat.id,
-                    "Пожалуйста, укажите в правильном формате:\n"
-                    "Возраст, Рост\n"
-                    "Например: 16, 175"
-                )
-        except Exception as e:
-            bot.send_message(
-                message.chat.id,
-                "Ошибка в формате. Пожалуйста, укажите:\n"
-                "Возраст, Рост\n"
-                "Например: 16, 175"
-            )
+    if new_state == COMPLETED:
+        user_response.timestamp = datetime.now().isoformat()
+        # Сохраняем ответы как новую заявку пользователя, анкета больше не нужна
+        save_user_responses(user_response)
+        session_table.remove(user_id)
+    else:
+        session.state = new_state
+    persist_session(user_id)
+    send_prompt(message.chat.id, prompt)
 
-    elif current_state == 'waiting_font':
-        user_sessions[user_id].font = message.text
-        user_sessions[user_id].timestamp = datetime.now().isoformat()
 
-        # Сохраняем ответы в отдельный файл пользователя
-        save_user_responses(user_sessions[user_id])
+def save_user_file(message, user_id, prefix):
+    """Проверяет файл пользователя и кладет его в папку пользователя.
 
-        # Очищаем состояние
-        user_states[user_id] = 'completed'
+    Содержимое хранится в общем хранилище по хэшу, а в папке пользователя появляется
+    ссылка на него. Уже известный файл повторно не скачивается.
+    Возвращает запись для списка файлов анкеты.
+    """
+    file_id, file_unique_id, file_ext, file_size, mime_type = describe_upload(message)
+    # Отказываем до скачивания, если размер или тип из апдейта не подходят
+    check_upload(file_size, mime_type, MAX_UPLOAD_SIZE, ALLOWED_UPLOAD_TYPES)
 
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        btn_send = types.KeyboardButton('/send_to_admin')
-        btn_new = types.KeyboardButton('/start')
-        markup.add(btn_send, btn_new)
+    blob_path, result = blob_store.fetch(bot, file_id, file_unique_id, file_ext, MAX_UPLOAD_SIZE)
+    if result['cached']:
+        files_log.debug("Файл %s уже есть в хранилище: %s", file_unique_id, blob_path, extra=logs.sampled())
+    else:
+        files_log.info("Файл %s скачан: %s байт", blob_path, result['bytes'],
+                       extra={'duration_ms': round(result['seconds'] * 1000, 1)})
+        metrics.download_bytes.inc(amount=result['bytes'])
 
-        bot.send_message(
-            message.chat.id,
-            "✅ Все ответы сохранены в ваш персональный файл!\n\n"
-            "Используйте команды:\n"
-            "/send_to_admin - отправить заявку администратору\n"
-            "/start - вернуться в главное меню",
-            reply_markup=markup
-        )
+    user_photos_dir = os.path.join(USERS_DATA_DIR, f"user_{user_id}_photos")
+    file_name = f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.{file_ext}"
+    file_path = os.path.join(user_photos_dir, file_name)
+    link_blob(blob_path, file_path)
+    return {'kind': prefix, 'path': file_path, 'blob': blob_path}
 
 
 @bot.message_handler(content_types=['photo', 'document'])
 def handle_files(message):
     user_id = str(message.from_user.id)
 
-    print(f"🖼️ Обработка файла от пользователя {user_id}")  # Отладочное сообщение
-
     # Проверяем, находится ли пользователь в процессе разработки дизайна
-    if user_id not in user_sessions or user_id not in user_states:
-        print(f"❌ Пользователь {user_id} не в процессе дизайна")
+    session = session_table.get(user_id)
+    if session is None:
+        files_log.info("Файл от пользователя не в процессе дизайна")
         # Если пользователь не в процессе дизайна, игнорируем файл
         bot.send_message(message.chat.id, "❌ Сначала начните процесс разработки дизайна через меню")
         return
 
-    current_state = user_states[user_id]
-    print(f"📊 Текущее состояние пользователя: {current_state}")
+    current_state = session.state
+    files_log.debug("Обработка файла", extra=dict(logs.sampled(), step=current_state))
 
     try:
-        if current_state == 'waiting_main_color':
-            # Создаем папку для фото пользователя
-            user_photos_dir = os.path.join(USERS_DATA_DIR, f"user_{user_id}_photos")
-            if not os.path.exists(user_photos_dir):
-                os.makedirs(user_photos_dir)
-
-            if message.content_type == 'photo':
-                file_info = bot.get_file(message.photo[-1].file_id)
-                downloaded_file = bot.download_file(file_info.file_path)
-                file_path = os.path.join(user_photos_dir, f"main_color_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg")
-            else:
-                file_info = bot.get_file(message.document.file_id)
-                downloaded_file = bot.download_file(file_info.file_path)
-                file_ext = message.document.file_name.split('.')[-1] if message.document.file_name else 'bin'
-                file_path = os.path.join(user_photos_dir,
-                                         f"main_color_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_ext}")
-
-            with open(file_path, 'wb') as new_file:
-                new_file.write(downloaded_file)
-
-            user_sessions[user_id].main_color = f"Файл: {file_path}"
-            user_states[user_id] = 'waiting_text_color'
-
-            bot.send_message(
-                message.chat.id,
-                "✅ Файл основного цвета сохранен!\n\n"
-                "2. Какой цвет должен быть у надписи?\n\n"
-                "Укажите цвет текста:"
-            )
-
-        elif current_state == 'waiting_additional_file':
-            user_photos_dir = os.path.join(USERS_DATA_DIR, f"user_{user_id}_photos")
-            if not os.path.exists(user_photos_dir):
-                os.makedirs(user_photos_dir)
-
-            if message.content_type == 'photo':
-                file_info = bot.get_file(message.photo[-1].file_id)
-                downloaded_file = bot.download_file(file_info.file_path)
-                file_path = os.path.join(user_photos_dir, f"additional_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg")
-            else:
-                file_info = bot.get_file(message.document.file_id)
-                downloaded_file = bot.download_file(file_info.file_path)
-                file_ext = message.document.file_name.split('.')[-1] if message.document.file_name else 'bin'
-                file_path = os.path.join(user_photos_dir,
-                                         f"additional_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_ext}")
-
-            with open(file_path, 'wb') as new_file:
-                new_file.write(downloaded_file)
-
-            user_sessions[user_id].additional_elements = f"Файл: {file_path}"
-            user_states[user_id] = 'waiting_elements_position'
-
-            bot.send_message(
-                message.chat.id,
-                "✅ Дополнительный файл сохранен!\n\n"
-                "5. Опишите расположение всех элементов на капе.\n\n"
-                "Где и как именно должны находиться надпись, логотип и другие детали?"
-            )
+        file_kind = DESIGN_FUNNEL.file_kind(current_state)
+        if file_kind is not None:
+            saved_file = save_user_file(message, user_id, file_kind)
+            chat_id = message.chat.id
+            file_name = os.path.basename(saved_file['path'])
+            upload_processor.submit(saved_file['blob'], on_invalid=lambda error: bot.send_message(
+                chat_id, f"⚠️ Файл {file_name} поврежден или не открывается как изображение. "
+                         "Менеджер увидит пометку в заявке и попросит прислать его еще раз."))
+
+            new_state, prompt = DESIGN_FUNNEL.answer_file(session.response, current_state, saved_file)
+            session.state = new_state
+            send_prompt(message.chat.id, prompt)
         else:
-            print(f"❌ Неожиданное состояние: {current_state}")
+            files_log.info("Файл на шаге без файлов", extra={'step': current_state})
             bot.send_message(message.chat.id, "❌ Сейчас нельзя отправлять файлы. Продолжайте отвечать на вопросы.")
 
+        persist_session(user_id)
+
+    except DownloadRejected as e:
+        files_log.info("Файл отклонен: %s", e, extra={'step': current_state})
+        bot.send_message(message.chat.id, f"❌ {e}")
+
     except Exception as e:
-        print(f"❌ Ошибка обработки файла: {e}")
+        files_log.exception("Ошибка обработки файла: %s", e, extra={'step': current_state})
         bot.send_message(message.chat.id, f"❌ Ошибка при обработке файла: {str(e)}")
 
 
@@ -629,26 +773,84 @@ def handle_callback(call):
         })
         start_design_process(fake_message, "Двухслойная")
 
+    elif call.data.startswith("gallery:"):
+        # Отвечаем сразу, а сообщение правится с учетом склейки частых нажатий
+        bot.answer_callback_query(call.id)
+        _, category, index, step = call.data.split(":")
+        gallery_navigator.tap(chat_id, call.message.message_id, category, int(index), int(step))
 
-@bot.message_handler(commands=['send_to_admin'])
-def send_to_admin(message):
-    try:
-        user_id = message.chat.id
-        print(f"🔄 Отправка заявки от пользователя {user_id}")
-
-        # Загружаем данные пользователя
-        user_file = f"users_data/user_{user_id}.json"
+    elif call.data.startswith("order:") and call.from_user.id == ADMIN_ID:
+        order = order_repo.get_order(int(call.data.split(":", 1)[1]))
+        if order is None:
+            bot.answer_callback_query(call.id, "Заявка не найдена")
+            return
+        notify_admin(order)
+        bot.answer_callback_query(call.id, f"Заявка №{order['order_id']} в очереди")
 
-        if not os.path.exists(user_file):
-            bot.send_message(user_id, "❌ У вас нет сохраненной заявки. Сначала заполните анкету через /start")
+    elif call.data.startswith("originals:") and call.from_user.id == ADMIN_ID:
+        order = order_repo.get_order(int(call.data.split(":", 1)[1]))
+        if order is None:
+            bot.answer_callback_query(call.id, "Заявка не найдена")
             return
+        files_count = enqueue_order_files(chat_id, None, order['files'], originals=True)
+        bot.answer_callback_query(call.id, f"Оригиналов в очереди: {files_count}")
+
+
+def enqueue_order_files(chat_id, summary, files, originals=False):
+    """Ставит в очередь заявку и ее файлы медиагруппами до 10 штук.
+
+    По умолчанию вместо фото уходят их уменьшенные превью, с originals=True -
+    исходные файлы документами, без пережатия Telegram.
+    Фото и документы группируются отдельно. Текст заявки становится подписью
+    первого файла, если помещается в лимит подписи, иначе уходит отдельным сообщением.
+    Возвращает число файлов.
+    """
+    photos = []
+    documents = []
+    for file in files:
+        if not os.path.exists(file['path']):
+            continue
+        name = os.path.basename(file['path'])
+        preview = None if originals else upload_processor.preview_for(file.get('blob') or file['path'])
+        if originals:
+            documents.append((file['path'], name))
+        elif upload_processor.is_invalid(file.get('blob') or file['path']):
+            # Файл не открылся как изображение: отправляем как есть, с пометкой
+            documents.append((file['path'], f"{name}\n⚠️ Не открывается как изображение, "
+                                            "попросите клиента прислать файл заново"))
+        elif preview:
+            photos.append((preview, name))
+        elif file['path'].endswith(('.jpg', '.jpeg', '.png', '.gif')):
+            photos.append((file['path'], name))
+        else:
+            documents.append((file['path'], name))
+
+    batches = []
+    for kind, paths in (('photo', photos), ('document', documents)):
+        for start in range(0, len(paths), MEDIA_GROUP_LIMIT):
+            items = [{'path': path, 'caption': f"📎 Файл от пользователя: {name}"}
+                     for path, name in paths[start:start + MEDIA_GROUP_LIMIT]]
+            batches.append((kind, items))
+
+    if summary:
+        first_caption = f"{summary}\n{batches[0][1][0]['caption']}" if batches else None
+        if first_caption and len(first_caption) <= CAPTION_LIMIT:
+            batches[0][1][0]['caption'] = first_caption
+        else:
+            outbox.enqueue('send_message', chat_id, text=summary)
+
+    for kind, items in batches:
+        if len(items) == 1:
+            outbox.enqueue(f'send_{kind}', chat_id, **items[0])
+        else:
+            outbox.enqueue('send_media_group', chat_id, kind=kind, items=items)
+    return len(photos) + len(documents)
 
-        with open(user_file, 'r', encoding='utf-8') as f:
-            user_data = json.load(f)
 
-        # Формируем сообщение для администратора
-        admin_message = f"""
-📋 НОВАЯ ЗАЯВКА НА КАПУ
+def notify_admin(user_data):
+    """Ставит в очередь администратору заявку целиком: текст, файлы и кнопку оригиналов"""
+    admin_message = f"""
+📋 НОВАЯ ЗАЯВКА НА КАПУ №{user_data['order_id']}
 
 👤 Пользователь: {user_data['user_info']['first_name']} 
 📛 Username: @{user_data['user_info']['username']}
@@ -667,62 +869,76 @@ def send_to_admin(message):
 9. Шрифт: {user_data['answers']['font']}
 """
 
-        # Отправляем администратору текстовую заявку
-        print("📤 Отправка текстовой заявки администратору")
-        bot.send_message(ADMIN_ID, admin_message)
-
-        # Проверяем и отправляем файлы, если они есть
-        user_photos_dir = os.path.join(USERS_DATA_DIR, f"user_{user_id}_photos")
-
-        if os.path.exists(user_photos_dir):
-            print(f"📁 Найдена папка с файлами: {user_photos_dir}")
-
-            # Получаем все файлы из папки
-            all_files = []
-            for root, dirs, files in os.walk(user_photos_dir):
-                for file in files:
-                    all_files.append(os.path.join(root, file))
-
-            # Сортируем файлы по времени создания (новые первыми)
-            all_files.sort(key=os.path.getmtime, reverse=True)
-
-            # Отправляем файлы администратору
-            files_sent = 0
-            for file_path in all_files:
-                try:
-                    if file_path.endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                        # Это изображение
-                        with open(file_path, 'rb') as photo_file:
-                            bot.send_photo(ADMIN_ID, photo_file,
-                                           caption=f"📎 Файл от пользователя: {os.path.basename(file_path)}")
-                        files_sent += 1
-                        print(f"🖼️ Отправлено фото: {os.path.basename(file_path)}")
-                    else:
-                        # Это другой файл
-                        with open(file_path, 'rb') as doc_file:
-                            bot.send_document(ADMIN_ID, doc_file,
-                                              caption=f"📎 Файл от пользователя: {os.path.basename(file_path)}")
-                        files_sent += 1
-                        print(f"📄 Отправлен документ: {os.path.basename(file_path)}")
-
-                    # Небольшая задержка между отправками, чтобы не спамить
-                    import time
-                    time.sleep(0.5)
-
-                except Exception as file_error:
-                    print(f"❌ Ошибка отправки файла {file_path}: {file_error}")
-
-            if files_sent > 0:
-                bot.send_message(ADMIN_ID, f"✅ Всего отправлено файлов: {files_sent}")
-                print(f"✅ Отправлено файлов: {files_sent}")
-            else:
-                bot.send_message(ADMIN_ID, "📭 Файлы от пользователя отсутствуют")
-                print("📭 Файлы отсутствуют")
+    # Заявка и файлы (новые первыми) уходят через очередь медиагруппами, без пауз в обработчике
+    files_sent = enqueue_order_files(ADMIN_ID, admin_message, list(reversed(user_data['files'])))
+
+    if user_data['files']:
+        if files_sent > 0:
+            # Администратор получает превью, оригиналы - по кнопке
+            markup = types.InlineKeyboardMarkup()
+            markup.add(types.InlineKeyboardButton("📂 Прислать оригиналы",
+                                                  callback_data=f"originals:{user_data['order_id']}"))
+            outbox.enqueue('send_message', ADMIN_ID, text=f"✅ Всего отправлено файлов: {files_sent}",
+                           reply_markup=markup.to_json())
         else:
-            bot.send_message(ADMIN_ID, "📭 Пользователь не прикреплял файлов")
-            print("📭 Папка с файлами не найдена")
+            outbox.enqueue('send_message', ADMIN_ID, text="📭 Файлы от пользователя отсутствуют")
+    else:
+        outbox.enqueue('send_message', ADMIN_ID, text="📭 Пользователь не прикреплял файлов")
+    return files_sent
+
+
+def send_order_digest(orders):
+    """Одна сводка за окно: строка на заявку и кнопки, по которым приходит заявка целиком"""
+    for start in range(0, len(orders), DIGEST_PAGE_SIZE):
+        page = orders[start:start + DIGEST_PAGE_SIZE]
+        lines = [f"🗂 Новые заявки: {len(orders)}" if start == 0 else "🗂 Новые заявки (продолжение)", ""]
+        markup = types.InlineKeyboardMarkup(row_width=4)
+        for order in page:
+            user_info = order['user_info']
+            lines.append(f"№{order['order_id']} · {order['capa_type']} · {user_info['first_name']} "
+                         f"(@{user_info['username']}) · {user_info['timestamp'][11:16]} · 📎 {order['files_count']}")
+        markup.add(*[types.InlineKeyboardButton(f"№{order['order_id']}", callback_data=f"order:{order['order_id']}")
+                     for order in page])
+        outbox.enqueue('send_message', ADMIN_ID, text="\n".join(lines), reply_markup=markup.to_json())
+
+
+# Заявки обычных типов копятся и уходят администратору одной сводкой
+admin_digest = AdminDigest(order_repo, ADMIN_DIGEST_WINDOW, send_order_digest)
+if ADMIN_DIGEST_WINDOW and WORKER_INDEX == 0:
+    admin_digest.start()
+    atexit.register(admin_digest.close)
 
-        print(f"✅ Заявка полностью отправлена администратору {ADMIN_ID}")
+
+@bot.message_handler(commands=['send_to_admin'])
+def send_to_admin(message):
+    try:
+        user_id = message.chat.id
+        # Загружаем последнюю заявку пользователя
+        user_data = load_user_responses(user_id)
+
+        if user_data is None:
+            bot.send_message(user_id, "❌ У вас нет сохраненной заявки. Сначала заполните анкету через /start")
+            return
+
+        # Повторная команда (или тот же апдейт после перезапуска) не дублирует заявку у администратора
+        if not order_repo.claim_notification(user_data['order_id']):
+            orders_log.info("Заявка №%s уже отправлена администратору", user_data['order_id'])
+            bot.send_message(user_id, "✅ Эта заявка уже отправлена администратору.\n\n"
+                                      "Чтобы оформить новую, заполните анкету через /start")
+            return
+
+        try:
+            if ADMIN_DIGEST_WINDOW and user_data['answers']['capa_type'] not in ADMIN_URGENT_TYPES:
+                admin_digest.add(user_data['order_id'])
+                orders_log.info("Заявка №%s отложена до сводки администратору", user_data['order_id'])
+            else:
+                files_sent = notify_admin(user_data)
+                orders_log.info("Заявка №%s поставлена в очередь администратору, файлов: %s",
+                                user_data['order_id'], files_sent)
+        except Exception:
+            # Заявка не дошла до очереди - повторная команда должна отправить ее снова
+            order_repo.release_notification(user_data['order_id'])
+            raise
 
         # Отправляем подтверждение пользователю
         bot.send_message(
@@ -732,7 +948,7 @@ def send_to_admin(message):
         )
 
     except Exception as e:
-        print(f"❌ Ошибка: {e}")
+        orders_log.exception("Ошибка отправки заявки: %s", e)
         bot.send_message(
             message.chat.id,
             f"❌ Произошла ошибка: {str(e)}\n\n"
@@ -740,52 +956,209 @@ def send_to_admin(message):
         )
 
 
-def send_sertificate(chat_id):
-    markup = types.InlineKeyboardMarkup()
-    btn = types.InlineKeyboardButton("Заказать", url="https://t.me/mortal_shop_team")
-    markup.add(btn)
-
-    # Папка с сертификатами
-    sertificate_folder = "sertifikate"
-
-    if os.path.exists(sertificate_folder):
-        # Отправляем PDF файлы
-        pdf_files = [
-            os.path.join(sertificate_folder, "сертификат-MOPTAЛ1.pdf"),
-            os.path.join(sertificate_folder, "сертификат-MOPTAЛ2.pdf")
-        ]
-
-        for pdf_file in pdf_files:
-            if os.path.exists(pdf_file):
-                try:
-                    with open(pdf_file, 'rb') as doc:
-                        bot.send_document(chat_id, doc, timeout=600)
-                except Exception as e:
-                    print(f"Ошибка отправки {pdf_file}: {e}")
-
-        # Отправляем фото (если есть)
-        photo_files = [
-            os.path.join(sertificate_folder, "подарочный-сертификат-MOPTAЛ.jpg"),
-        ]
-
-        for photo_file in photo_files:
-            if os.path.exists(photo_file):
-                try:
-                    with open(photo_file, 'rb') as photo:
-                        bot.send_photo(chat_id, photo)
-                except Exception as e:
-                    print(f"Ошибка отправки {photo_file}: {e}")
-    else:
-        print(f"Папка {sertificate_folder} не найдена")
+# Выгрузки идут по одной в отдельном потоке, чтобы не занимать обработчики апдейтов
+export_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export")
+atexit.register(export_pool.shutdown, wait=False, cancel_futures=True)
+
+
+def parse_export_args(text):
+    """'/export 2025-01-01 2025-01-31 Однослойная zip' -> (since, until, capa_type, with_files).
+
+    Даты включительно, любые другие слова - тип капы.
+    """
+    dates = []
+    type_words = []
+    with_files = False
+    for arg in text.split()[1:]:
+        if arg.lower() == 'zip':
+            with_files = True
+            continue
+        try:
+            dates.append(datetime.strptime(arg, '%Y-%m-%d'))
+        except ValueError:
+            type_words.append(arg)
+    since = dates[0].date().isoformat() if dates else None
+    until = (dates[1] + timedelta(days=1)).date().isoformat() if len(dates) > 1 else None
+    return since, until, ' '.join(type_words) or None, with_files
+
+
+def run_export(chat_id, since, until, capa_type, with_files):
+    """Пишет выгрузку на диск, отправляет документами и удаляет"""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    base_path = os.path.join(EXPORT_DIR, f"orders_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    parts = []
+    try:
+        if with_files:
+            count, parts = export_zip(lambda: order_repo.iter_orders(since, until, capa_type),
+                                      base_path + "_{}.zip", EXPORT_PART_SIZE)
+        else:
+            parts = [base_path + ".csv"]
+            count = export_csv(order_repo.iter_orders(since, until, capa_type), parts[0])
+            if os.path.getsize(parts[0]) > EXPORT_PART_SIZE:
+                # Большую таблицу отправляем сжатой: текст сжимается в разы
+                parts.append(compress_file(parts[0], base_path + ".zip"))
+                os.remove(parts.pop(0))
+        orders_log.info("Выгрузка готова: заявок %s, файлов %s", count, len(parts))
+
+        for number, part in enumerate(parts, 1):
+            caption = f"📦 Заявок: {count}" + (f" (часть {number} из {len(parts)})" if len(parts) > 1 else "")
+            with open(part, 'rb') as f:
+                bot.send_document(chat_id, f, caption=caption, timeout=600)
+    except Exception as e:
+        orders_log.exception("Ошибка выгрузки заявок: %s", e)
+        bot.send_message(chat_id, f"❌ Ошибка выгрузки: {e}")
+    finally:
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+
+
+@bot.message_handler(commands=['export'], func=lambda message: message.from_user.id == ADMIN_ID)
+def export_orders(message):
+    since, until, capa_type, with_files = parse_export_args(message.text)
+    bot.send_message(message.chat.id, "⏳ Готовлю выгрузку заявок" + (" с файлами" if with_files else ""))
+    export_pool.submit(run_export, message.chat.id, since, until, capa_type, with_files)
+
+
+@bot.message_handler(commands=['stats'], func=lambda message: message.from_user.id == ADMIN_ID)
+def send_stats(message):
+    stats = bot.dispatcher.stats()
+    sessions = session_table.stats()
+    throttled = flood_guard.stats()
+    bot.send_message(
+        message.chat.id,
+        f"⚙️ Потоков: {stats['workers']}\n"
+        f"📥 В очереди: {stats['queued']} (макс. в одном потоке: {stats['max_queue']})\n"
+        f"✅ Обработано апдейтов: {stats['processed']}\n\n"
+        f"📝 Анкет в памяти: {sessions['live']} (~{sessions['bytes_per_session']} байт на анкету)\n"
+        f"🧹 Удалено по простою: {sessions['evicted_ttl']}, по лимиту: {sessions['evicted_lru']}\n"
+        f"⏳ Напоминаний: {sessions['reminded']}\n"
+        f"🚫 Отклонено анти-флудом: {sum(throttled.values())}"
+    )
+
+
+if CERTIFICATE_SECRET:
+    certificates = CertificateRenderer(os.path.join(CACHE_DIR, "certificates"), CERTIFICATE_TEMPLATE,
+                                       CERTIFICATE_FONT, CERTIFICATE_SECRET, CERTIFICATE_WORKERS,
+                                       CERTIFICATE_CACHE_SIZE, on_evict=assets.forget)
+    atexit.register(certificates.close)
+else:
+    certificates = None
+    logger.error("CERTIFICATE_SECRET не задан, сертификаты выключены")
+
+CERTIFICATE_USAGE = (f"Чтобы получить именной сертификат, отправьте сумму от {CERTIFICATE_MIN_AMOUNT} руб. "
+                     "и имя получателя, например:\n/certificate 5000 Анна")
+CERTIFICATE_MARKUP = types.InlineKeyboardMarkup()
+CERTIFICATE_MARKUP.add(types.InlineKeyboardButton("Оплатить", url="https://t.me/mortal_shop_team"))
+CERTIFICATE_MARKUP = CERTIFICATE_MARKUP.to_json()
+
+
+def parse_certificate_args(text):
+    """'/certificate 5000 Анна Иванова' -> (5000, 'Анна Иванова'). ValueError с подсказкой для пользователя"""
+    args = text.split(maxsplit=2)[1:]
+    if len(args) < 2:
+        raise ValueError(CERTIFICATE_USAGE)
+    try:
+        amount = int(args[0].replace('.', '').replace(' ', ''))
+    except ValueError:
+        raise ValueError(CERTIFICATE_USAGE)
+    if not CERTIFICATE_MIN_AMOUNT <= amount <= CERTIFICATE_MAX_AMOUNT:
+        raise ValueError(f"Сумма сертификата - от {CERTIFICATE_MIN_AMOUNT} до {CERTIFICATE_MAX_AMOUNT} руб.")
+    name = ' '.join(args[1].split())
+    if len(name) > CERTIFICATE_NAME_LIMIT:
+        raise ValueError(f"Имя получателя - не длиннее {CERTIFICATE_NAME_LIMIT} символов")
+    return amount, name
+
+
+@bot.message_handler(commands=['certificate'])
+def send_certificate(message):
+    chat_id = message.chat.id
+    if certificates is None:
+        bot.send_message(chat_id, "Сертификаты сейчас недоступны, напишите менеджеру: @mortal_shop_team")
+        return
+    try:
+        amount, name = parse_certificate_args(message.text)
+    except ValueError as e:
+        bot.send_message(chat_id, str(e))
+        return
+    try:
+        certificate = certificates.render(amount, name, message.from_user.id)
+        assets.send_photo(chat_id, certificate.photo,
+                          caption=f"🎁 Сертификат на {format_amount(amount)} для {name}\n"
+                                  f"Код: {certificate.code}\n\n"
+                                  "Для оплаты напишите менеджеру и назовите код сертификата",
+                          reply_markup=CERTIFICATE_MARKUP)
+        assets.send_document(chat_id, certificate.pdf, caption="PDF для печати",
+                             visible_file_name=f"сертификат-MORTAL-{certificate.code}.pdf")
+    except Exception as e:
+        logger.exception("Ошибка сертификата: %s", e)
+        bot.send_message(chat_id, "❌ Не удалось подготовить сертификат, попробуйте позже")
+
+
+# Время всех обработчиков
+metrics.instrument_bot(bot)
 
-    # Сообщение с описанием отправляем В КОНЦЕ
-    text = "Подарочный сертификат можно приобрести на любую сумму от 2.700. Для оформления сертификата напишите нашему менеджеру: @mortal_shop_team"
-    bot.send_message(chat_id, text, reply_markup=markup)
 
+def owns_update(update):
+    """Апдейт (словарь JSON) относится к пользователю этого процесса"""
+    key = raw_update_user_id(update)
+    return worker_for(key if key is not None else update['update_id'], WORKER_COUNT) == WORKER_INDEX
+
+
+def shutdown(checkpoint):
+    """Доделывает принятые апдейты и сохраняет номер последнего обработанного"""
+    left = bot.dispatcher.drain(SHUTDOWN_TIMEOUT)
+    if left:
+        logger.warning("Не обработано апдейтов к остановке: %s, они обработаются после перезапуска", left)
+    if checkpoint is not None:
+        checkpoint.close()
+    logger.info("Бот остановлен")
 
 
 # Запуск бота
 if __name__ == "__main__":
-    print("Бот запущен...")
-    print(f"Файлы пользователей сохраняются в папку: {USERS_DATA_DIR}")
-    bot.polling(none_stop=True)
+    # SIGTERM (остановка при деплое) прерывает работу так же, как Ctrl+C: прием апдейтов
+    # прекращается, принятые доделываются, а недоделанные остаются в журнале до перезапуска
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    update_checkpoint = None
+    try:
+        logger.info("Бот запущен (процесс %s из %s), файлы пользователей сохраняются в папку: %s",
+                    WORKER_INDEX + 1, WORKER_COUNT, USERS_DATA_DIR)
+        # Разовые задачи при запуске выполняет только первый процесс
+        if WORKER_INDEX == 0:
+            logger.info("Перенесено заявок из json-файлов: %s", order_repo.migrate_json_files(USERS_DATA_DIR))
+            logger.info("Подготовлено фото каталога: %s",
+                        preprocess_catalog(CATALOG_CACHE_DIR, catalog.current.photo_folders()))
+        catalog.start()
+        if METRICS_PORT:
+            start_metrics_server(metrics, METRICS_HOST, METRICS_PORT)
+
+        # Принятые, но не обработанные до остановки апдейты остаются в журнале и
+        # обрабатываются после перезапуска. Каждый процесс кластера берет из журнала
+        # апдейты своих пользователей, номер апдейта для getUpdates у них свой ключ
+        if BOT_MODE == "webhook":
+            update_checkpoint = UpdateCheckpoint(DB_PATH, key=f"webhook_update_id_{WORKER_INDEX}")
+        else:
+            update_checkpoint = UpdateCheckpoint(DB_PATH)
+            # Продолжаем с апдейта после последнего принятого в прошлый запуск
+            bot.last_update_id = update_checkpoint.load()
+        bot.journal = update_checkpoint
+        update_checkpoint.start(finished=bot.take_finished)
+        pending_updates = update_checkpoint.pending(owns=owns_update)
+        if pending_updates:
+            logger.info("Апдейтов из журнала: %s", len(pending_updates))
+            bot.process_new_updates([types.Update.de_json(update) for update in pending_updates])
+
+        if BOT_MODE == "webhook":
+            webhook_secret = WEBHOOK_SECRET
+            if WEBHOOK_URL:
+                webhook_secret = webhook_secret or secrets.token_urlsafe(32)
+                bot.remove_webhook()
+                bot.set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=webhook_secret)
+            run_webhook_server(bot, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, webhook_secret)
+        else:
+            bot.polling(none_stop=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown(update_checkpoint)
@@ -0,0 +1,261 @@
+"""Метрики бота в формате Prometheus: время обработчиков, вызовы Bot API, анкеты.
+
+Без внешних зависимостей: счетчики и гистограммы хранятся в памяти процесса,
+текст для Prometheus собирается при запросе /metrics.
+"""
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import apihelper
+
+import logs
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм времени, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _by_labels(item):
+    """Ключ сортировки серий: значения меток сравниваются как строки, даже если они разных типов"""
+    labels = item[0] if isinstance(item[0], tuple) else (item[0],)
+    return tuple(str(value) for value in labels)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items(), key=_by_labels):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # значения меток -> [счетчики по корзинам..., сумма, количество]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._values.items(), key=_by_labels):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = _format_labels(self.labels, label_values, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                le = _format_labels(self.labels, label_values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{le} {series[-1]}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Значение считается в момент запроса: callback возвращает {значения меток: число}"""
+
+    def __init__(self, name, help_text, labels, callback):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for label_values, value in sorted(self.callback().items(), key=_by_labels):
+            if not isinstance(label_values, tuple):
+                label_values = (label_values,)
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+def _payload_size(value):
+    """Размер загружаемого файла: bytes, открытый файл или кортеж (имя, файл)"""
+    if isinstance(value, tuple):
+        value = value[1]
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    try:
+        return os.fstat(value.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+class BotMetrics:
+    """Метрики бота и обертки, которые их собирают.
+
+    trace=True дополнительно пишет в лог по записи на каждый апдейт: обработчик,
+    время и все вызовы Bot API, сделанные при его обработке.
+    """
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self._metrics = []
+        self._local = threading.local()
+
+        self.handler_seconds = self.add(Histogram(
+            "bot_handler_seconds", "Время работы обработчика", ('handler',)))
+        self.handler_errors = self.add(Counter(
+            "bot_handler_errors_total", "Исключения в обработчиках", ('handler',)))
+        self.api_seconds = self.add(Histogram(
+            "bot_api_request_seconds", "Время вызова Bot API", ('method',)))
+        self.api_errors = self.add(Counter(
+            "bot_api_errors_total", "Ошибки вызовов Bot API", ('method', 'code')))
+        self.upload_bytes = self.add(Counter(
+            "bot_api_upload_bytes_total", "Байт файлов, загруженных в Telegram"))
+        self.download_bytes = self.add(Counter(
+            "bot_download_bytes_total", "Байт файлов, скачанных из Telegram"))
+        self.throttled = self.add(Counter(
+            "bot_throttled_total", "Апдейты, отброшенные анти-флудом", ('action',)))
+        self.funnel_dropoff = self.add(Counter(
+            "bot_funnel_dropoff_total", "Брошенные анкеты по шагу, на котором остановился пользователь",
+            ('step', 'reason')))
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, labels, callback):
+        return self.add(Gauge(name, help_text, labels, callback))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def timed(self, name, func):
+        """Оборачивает обработчик: время, исключения и трассировка апдейта"""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            outer = getattr(self._local, 'calls', None)
+            if self.trace and outer is None:
+                self._local.calls = []
+            context = logs.bind(handler=name)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                self.handler_errors.inc(name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                self.handler_seconds.observe(elapsed, name)
+                duration_ms = round(elapsed * 1000, 1)
+                if self.trace and outer is None:
+                    calls = self._local.calls
+                    self._local.calls = None
+                    details = ', '.join(f"{method} {seconds * 1000:.0f} мс" for method, seconds in calls)
+                    logger.info("Апдейт обработан; API: %s", details or 'нет вызовов',
+                                extra={'duration_ms': duration_ms})
+                else:
+                    logger.debug("Обработчик завершен", extra=dict(logs.sampled(name), duration_ms=duration_ms))
+                logs.restore(context)
+
+        return wrapper
+
+    def instrument_bot(self, bot):
+        """Оборачивает все зарегистрированные обработчики бота"""
+        for handlers in (bot.message_handlers, bot.callback_query_handlers, bot.inline_handlers):
+            for handler in handlers:
+                handler['function'] = self.timed(handler['function'].__name__, handler['function'])
+
+    def instrument_api(self):
+        """Подменяет apihelper._make_request: все вызовы Bot API проходят через метрики"""
+        make_request = apihelper._make_request
+
+        @functools.wraps(make_request)
+        def instrumented(token, method_name, method='get', params=None, files=None):
+            if files:
+                self.upload_bytes.inc(amount=sum(_payload_size(value) for value in files.values()))
+            started = time.perf_counter()
+            try:
+                return make_request(token, method_name, method, params=params, files=files)
+            except apihelper.ApiTelegramException as e:
+                self.api_errors.inc(method_name, str(e.error_code))
+                raise
+            except Exception as e:
+                self.api_errors.inc(method_name, type(e).__name__)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                self.api_seconds.observe(elapsed, method_name)
+                calls = getattr(self._local, 'calls', None)
+                if calls is not None:
+                    calls.append((method_name, elapsed))
+
+        apihelper._make_request = instrumented
+
+
+def start_metrics_server(metrics, host, port):
+    """Отдает метрики по GET /metrics в фоновом потоке"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, server.server_address[1])
+    return server
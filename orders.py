@@ -0,0 +1,244 @@
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    created_at TEXT NOT NULL,
+    capa_type TEXT,
+    answers TEXT NOT NULL,
+    notified_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at);
+CREATE INDEX IF NOT EXISTS idx_orders_capa ON orders (capa_type, created_at);
+
+CREATE TABLE IF NOT EXISTS order_files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL REFERENCES orders (id),
+    kind TEXT,
+    path TEXT NOT NULL,
+    blob TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_order_files_order ON order_files (order_id);
+
+CREATE TABLE IF NOT EXISTS admin_digest (
+    order_id INTEGER PRIMARY KEY REFERENCES orders (id),
+    queued_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Ответы анкеты, которые хранятся в заявке
+ANSWER_FIELDS = ('capa_type', 'main_color', 'text_color', 'text', 'additional_elements',
+                 'elements_position', 'age', 'height', 'font')
+
+
+def _legacy_order(users_data_dir, user_file):
+    """Заявка из старого файла users_data/user_<id>.json: (user_info, answers, files)"""
+    with open(user_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    user_info = data['user_info']
+    user_info = dict(user_info, user_id=str(user_info['user_id']), timestamp=user_info['timestamp'])
+
+    photos_dir = os.path.join(users_data_dir, data.get('files_info', {}).get(
+        'photos_dir', f"user_{user_info['user_id']}_photos"))
+    files = []
+    if os.path.isdir(photos_dir):
+        for name in sorted(os.listdir(photos_dir)):
+            kind = 'main_color' if name.startswith('main_color_') else 'additional'
+            files.append({'kind': kind, 'path': os.path.join(photos_dir, name)})
+
+    answers = {field: data.get('answers', {}).get(field) for field in ANSWER_FIELDS}
+    return user_info, answers, files
+
+
+class OrderRepository:
+    """Заявки пользователей в SQLite: у одного пользователя может быть много заявок"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _insert_order(self, user_info, answers, files):
+        """Добавляет заявку в текущей транзакции. Вызывается под self._lock"""
+        cursor = self._conn.execute(
+            "INSERT INTO orders (user_id, username, first_name, created_at, capa_type, answers)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (str(user_info['user_id']), user_info.get('username'), user_info.get('first_name'),
+             user_info['timestamp'], answers.get('capa_type'), json.dumps(answers, ensure_ascii=False))
+        )
+        order_id = cursor.lastrowid
+        self._conn.executemany(
+            "INSERT INTO order_files (order_id, kind, path, blob) VALUES (?, ?, ?, ?)",
+            [(order_id, file.get('kind'), file['path'], file.get('blob')) for file in files]
+        )
+        return order_id
+
+    def create_order(self, user_info, answers, files):
+        """Сохраняет заявку вместе со списком файлов. files - список словарей {'kind', 'path', 'blob'}"""
+        with self._lock, self._conn:
+            return self._insert_order(user_info, answers, files)
+
+    def _order_dict(self, row, files=None):
+        if files is None:
+            files = self._conn.execute(
+                "SELECT kind, path, blob FROM order_files WHERE order_id = ? ORDER BY id", (row['id'],)
+            ).fetchall()
+        return {
+            'order_id': row['id'],
+            'user_info': {
+                'user_id': row['user_id'],
+                'username': row['username'],
+                'first_name': row['first_name'],
+                'timestamp': row['created_at'],
+            },
+            'answers': json.loads(row['answers']),
+            'files': [{'kind': file['kind'], 'path': file['path'], 'blob': file['blob']} for file in files],
+        }
+
+    def get_order(self, order_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM orders WHERE id = ?", (order_id,)).fetchone()
+            return self._order_dict(row) if row else None
+
+    def latest_order(self, user_id):
+        """Последняя заявка пользователя или None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT 1",
+                (str(user_id),)
+            ).fetchone()
+            return self._order_dict(row) if row else None
+
+    def iter_orders(self, since=None, until=None, capa_type=None, batch_size=500):
+        """Перебирает заявки по возрастанию номера, читая базу пачками по batch_size.
+
+        В памяти одновременно только одна пачка. since / until - начало и конец
+        периода в формате ISO (until не включается), capa_type - тип капы.
+        """
+        conditions = ["id > ?"]
+        filters = []
+        if since:
+            conditions.append("created_at >= ?")
+            filters.append(since)
+        if until:
+            conditions.append("created_at < ?")
+            filters.append(until)
+        if capa_type:
+            conditions.append("capa_type = ?")
+            filters.append(capa_type)
+        query = f"SELECT * FROM orders WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?"
+
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(query, [last_id, *filters, batch_size]).fetchall()
+                if not rows:
+                    return
+                files = {}
+                placeholders = ','.join('?' * len(rows))
+                for file in self._conn.execute(
+                        f"SELECT order_id, kind, path, blob FROM order_files WHERE order_id IN ({placeholders})"
+                        " ORDER BY id", [row['id'] for row in rows]):
+                    files.setdefault(file['order_id'], []).append(file)
+            for row in rows:
+                yield self._order_dict(row, files.get(row['id'], []))
+            last_id = rows[-1]['id']
+
+    def count_orders(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                return self._conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM orders WHERE user_id = ?",
+                                      (str(user_id),)).fetchone()[0]
+
+    def claim_notification(self, order_id):
+        """Отмечает, что администратору сообщено о заявке. False, если это уже было сделано раньше"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute("UPDATE orders SET notified_at = ? WHERE id = ? AND notified_at IS NULL",
+                                        (time.time(), order_id))
+        return cursor.rowcount == 1
+
+    def release_notification(self, order_id):
+        """Снимает отметку claim_notification, если заявку не удалось поставить в очередь администратору"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE orders SET notified_at = NULL WHERE id = ?", (order_id,))
+
+    def queue_digest(self, order_id):
+        """Откладывает уведомление о заявке до следующей сводки администратору"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO admin_digest (order_id, queued_at) VALUES (?, ?)",
+                               (order_id, time.time()))
+
+    def pending_digest(self):
+        """Все отложенные заявки (краткие данные без ответов). Очередь не меняется, см. done_digest"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT orders.id, orders.user_id, orders.username, orders.first_name, orders.created_at,"
+                " orders.capa_type, (SELECT COUNT(*) FROM order_files WHERE order_id = orders.id) AS files"
+                " FROM admin_digest JOIN orders ON orders.id = admin_digest.order_id"
+                " ORDER BY admin_digest.order_id"
+            ).fetchall()
+        return [{
+            'order_id': row['id'],
+            'user_info': {'user_id': row['user_id'], 'username': row['username'],
+                          'first_name': row['first_name'], 'timestamp': row['created_at']},
+            'capa_type': row['capa_type'],
+            'files_count': row['files'],
+        } for row in rows]
+
+    def done_digest(self, order_ids):
+        """Убирает из очереди сводки заявки, сводка о которых уже поставлена в отправку"""
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM admin_digest WHERE order_id = ?",
+                                   [(order_id,) for order_id in order_ids])
+
+    def migrate_json_files(self, users_data_dir):
+        """Однократно переносит старые файлы users_data/user_<id>.json в базу.
+
+        Сами json-файлы не удаляются. Возвращает число перенесенных заявок.
+        """
+        with self._lock:
+            done = self._conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        if done:
+            return 0
+
+        orders = []
+        for user_file in sorted(glob.glob(os.path.join(users_data_dir, "user_*.json"))):
+            try:
+                orders.append(_legacy_order(users_data_dir, user_file))
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                logger.error("Не удалось перенести %s: %s", user_file, e)
+
+        # Заявки и отметка о переносе пишутся одной транзакцией: после сбоя перенос повторится целиком
+        with self._lock, self._conn:
+            if self._conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone():
+                return 0
+            for user_info, answers, files in orders:
+                self._insert_order(user_info, answers, files)
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', '1')")
+        return len(orders)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
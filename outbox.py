@@ -0,0 +1,266 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from contextlib import ExitStack
+
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    method TEXT NOT NULL,
+    params TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_at REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_next ON outbox (next_at, id);
+"""
+
+MAX_BACKOFF = 60
+
+
+def _send_message(bot, chat_id, params, progress):
+    return bot.send_message(chat_id, **params)
+
+
+def _send_file(send, field, chat_id, params):
+    params = dict(params)
+    path = params.pop('path', None)
+    if path is None:
+        return send(chat_id, **params)
+    with open(path, 'rb') as f:
+        params[field] = f
+        return send(chat_id, **params)
+
+
+def _send_media_group(bot, chat_id, params, progress):
+    """Отправляет медиагруппу, а если Telegram ее не принял - файлы по одному.
+
+    Число уже отправленных по одному файлов сохраняется через progress(sent),
+    поэтому при повторе задачи они не уходят второй раз.
+    """
+    kind = params['kind']
+    items = params['items']
+    sent = params.get('sent', 0)
+    if not sent:
+        media_class = types.InputMediaPhoto if kind == 'photo' else types.InputMediaDocument
+        try:
+            with ExitStack() as stack:
+                media = [media_class(stack.enter_context(open(item['path'], 'rb')), caption=item.get('caption'))
+                         for item in items]
+                return bot.send_media_group(chat_id, media)
+        except ApiTelegramException as e:
+            if _is_temporary(e):
+                raise
+            logger.warning("Медиагруппа не отправлена, отправляю файлы по одному: %s", e)
+
+    send = bot.send_photo if kind == 'photo' else bot.send_document
+    for number, item in enumerate(items[sent:], sent + 1):
+        _send_file(send, kind, chat_id, item)
+        progress(number)
+
+
+SENDERS = {
+    'send_message': _send_message,
+    'send_photo': lambda bot, chat_id, params, progress: _send_file(bot.send_photo, 'photo', chat_id, params),
+    'send_document': lambda bot, chat_id, params, progress: _send_file(bot.send_document, 'document',
+                                                                        chat_id, params),
+    'send_media_group': _send_media_group,
+}
+
+
+def _job_cost(method, params):
+    """Сколько сообщений в чате займет задача (медиагруппа - по сообщению на файл)"""
+    if method == 'send_media_group':
+        return len(params['items'])
+    return 1
+
+
+def _is_temporary(error):
+    """429 и ошибки сервера Telegram проходят сами, остальные ответы - ошибка в запросе"""
+    return error.error_code == 429 or error.error_code >= 500
+
+
+def _retry_after(error):
+    parameters = error.result_json.get('parameters') or {}
+    return parameters.get('retry_after')
+
+
+class Outbox:
+    """Очередь исходящих сообщений с фоновой отправкой.
+
+    Задачи сохраняются в SQLite и переживают перезапуск. Отправка ограничена
+    общим и отдельным для каждого чата token bucket, ответ 429 откладывает
+    задачу на retry_after, а 429 без retry_after, ошибки сервера и сети повторяются
+    с нарастающей паузой.
+    Сообщения в один чат уходят строго в порядке постановки в очередь.
+
+    Если очередь общая для нескольких процессов, отправлять должен один из них
+    (sender=True), остальные только ставят задачи. Задачи из других процессов
+    отправитель замечает, проверяя базу не реже раза в idle_interval секунд.
+    """
+
+    def __init__(self, bot, path, global_rate=30, chat_rate=1, chat_burst=3, max_attempts=5,
+                 sender=True, idle_interval=5.0):
+        self.bot = bot
+        self.idle_interval = idle_interval
+        self.max_attempts = max_attempts
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        if sender:
+            self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, method, chat_id, **params):
+        """Ставит вызов Bot API в очередь. params должны сериализоваться в JSON"""
+        if method not in SENDERS:
+            raise ValueError(f"Неизвестный метод отправки: {method}")
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO outbox (chat_id, method, params, next_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (str(chat_id), method, json.dumps(params, ensure_ascii=False), now, now)
+            )
+        self._wakeup.set()
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                self._chat_buckets = {key: value for key, value in self._chat_buckets.items()
+                                      if not value.is_full()}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                delay = self._process_due()
+            except Exception as e:
+                logger.exception("Ошибка очереди отправки: %s", e)
+                delay = 1.0
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def _process_due(self):
+        """Отправляет все задачи, которым пора. Возвращает паузу до следующей проверки"""
+        now = time.time()
+
+        # Чаты, у которых есть отложенное сообщение, ждут целиком, чтобы не нарушить порядок
+        with self._lock:
+            jobs = self._conn.execute(
+                "SELECT id, chat_id, method, params, attempts FROM outbox"
+                " WHERE next_at <= ? AND chat_id NOT IN (SELECT chat_id FROM outbox WHERE next_at > ?)"
+                " ORDER BY id LIMIT 200",
+                (now, now)
+            ).fetchall()
+            next_due = self._conn.execute("SELECT MIN(next_at) FROM outbox WHERE next_at > ?",
+                                          (now,)).fetchone()[0]
+        delay = min(self.idle_interval, next_due - now) if next_due else self.idle_interval
+
+        blocked_chats = set()
+        for job_id, chat_id, method, params, attempts in jobs:
+            if self._stopped.is_set():
+                break
+            if chat_id in blocked_chats:
+                continue
+            params = json.loads(params)
+
+            # Ждем, пока лимит чата и общий лимит позволят отправку
+            cost = _job_cost(method, params)
+            wait = max(self._chat_bucket(chat_id).wait_time(cost), self._global_bucket.wait_time(cost))
+            if wait > 0:
+                blocked_chats.add(chat_id)
+                delay = min(delay, wait)
+                continue
+
+            self._chat_bucket(chat_id).take(cost)
+            self._global_bucket.take(cost)
+            if not self._deliver(job_id, chat_id, method, params, attempts):
+                blocked_chats.add(chat_id)
+
+        # Выбрали полную пачку - возможно, в очереди есть еще задачи
+        if len(jobs) == 200 and len(blocked_chats) < len(jobs):
+            return 0
+        return max(delay, 0.01)
+
+    def _deliver(self, job_id, chat_id, method, params, attempts):
+        """Выполняет одну задачу. Возвращает False, если задача отложена"""
+        try:
+            SENDERS[method](self.bot, chat_id, params, lambda sent: self._save_progress(job_id, params, sent))
+        except ApiTelegramException as e:
+            retry_after = _retry_after(e) if e.error_code == 429 else None
+            if retry_after is not None:
+                logger.warning("Telegram просит подождать %s с (чат %s)", retry_after, chat_id)
+                self._reschedule(job_id, attempts, retry_after)
+                return False
+            if not _is_temporary(e):
+                # Ошибка в самом запросе (чат недоступен, неверные параметры) - повтор не поможет
+                logger.error("Сообщение в чат %s отброшено: %s", chat_id, e)
+                self._remove(job_id)
+                return True
+            return self._retry(job_id, chat_id, attempts, e)
+        except Exception as e:
+            return self._retry(job_id, chat_id, attempts, e)
+
+        self._remove(job_id)
+        return True
+
+    def _retry(self, job_id, chat_id, attempts, error):
+        attempts += 1
+        if attempts >= self.max_attempts:
+            logger.error("Сообщение в чат %s не отправлено после %s попыток: %s", chat_id, attempts, error)
+            self._remove(job_id)
+            return True
+        backoff = min(MAX_BACKOFF, 2 ** attempts) * random.uniform(0.8, 1.2)
+        logger.warning("Повтор отправки в чат %s через %.1f с: %s", chat_id, backoff, error)
+        self._reschedule(job_id, attempts, backoff)
+        return False
+
+    def _reschedule(self, job_id, attempts, delay):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE outbox SET attempts = ?, next_at = ? WHERE id = ?",
+                               (attempts, time.time() + delay, job_id))
+
+    def _save_progress(self, job_id, params, sent):
+        params['sent'] = sent
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE outbox SET params = ? WHERE id = ?",
+                               (json.dumps(params, ensure_ascii=False), job_id))
+
+    def _remove(self, job_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (job_id,))
+
+    def close(self, timeout=10):
+        """Останавливает отправку. Неотправленные задачи остаются в базе до следующего запуска"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._lock:
+            self._conn.close()
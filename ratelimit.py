@@ -0,0 +1,86 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Классический token bucket: rate жетонов в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost=1):
+        """Сколько секунд ждать, пока наберется cost жетонов (0 - можно сейчас)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            cost = min(cost, self.capacity)
+            if self.tokens >= cost:
+                return 0.0
+            return (cost - self.tokens) / self.rate
+
+    def take(self, cost=1):
+        """Списывает cost жетонов, если их хватает. Возвращает True при успехе"""
+        with self._lock:
+            self._refill(time.monotonic())
+            cost = min(cost, self.capacity)
+            if self.tokens < cost:
+                return False
+            self.tokens -= cost
+            return True
+
+    def is_full(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens >= self.capacity
+
+
+class Debouncer:
+    """Склеивает частые вызовы по одному ключу.
+
+    Первый вызов выполняется сразу. Вызовы в течение interval после него не
+    выполняются, а запоминаются: по окончании интервала выполняется только
+    последний из них (и открывается новый интервал).
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        # Ключ -> отложенный вызов или None, пока интервал открыт
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def call(self, key, func):
+        """Выполняет func сейчас или откладывает до конца интервала. True, если выполнено сразу"""
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] = func
+                return False
+            self._pending[key] = None
+        try:
+            func()
+        finally:
+            self._schedule(key)
+        return True
+
+    def _schedule(self, key):
+        timer = threading.Timer(self.interval, self._fire, args=(key,))
+        timer.daemon = True
+        timer.start()
+
+    def _fire(self, key):
+        with self._lock:
+            func = self._pending.get(key)
+            if func is None:
+                self._pending.pop(key, None)
+                return
+            self._pending[key] = None
+        try:
+            func()
+        finally:
+            self._schedule(key)
@@ -0,0 +1,272 @@
+import importlib
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MemorySessionStore:
+    """Сессии живут только в памяти процесса и теряются при перезапуске.
+
+    Интерфейс хранилища сессий: load_all() -> {user_id: (state, data)},
+    save(user_id, state, data), delete(user_id), flush(), close().
+    """
+
+    def load_all(self):
+        return {}
+
+    def save(self, user_id, state, data):
+        pass
+
+    def delete(self, user_id):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteSessionStore:
+    """Хранит незавершенные анкеты в SQLite с отложенной пакетной записью.
+
+    save() и delete() только запоминают изменение в памяти, а фоновый поток
+    раз в flush_interval секунд записывает все накопленное одной транзакцией.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " user_id TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, name="session-flush", daemon=True)
+        self._thread.start()
+
+    def load_all(self):
+        """Возвращает {user_id: (состояние, данные анкеты)} для всех сохраненных сессий"""
+        with self._db_lock:
+            rows = self._conn.execute("SELECT user_id, state, data FROM sessions").fetchall()
+        return {user_id: (state, json.loads(data)) for user_id, state, data in rows}
+
+    def save(self, user_id, state, data):
+        with self._lock:
+            self._pending[user_id] = (state, json.dumps(data, ensure_ascii=False))
+
+    def delete(self, user_id):
+        with self._lock:
+            self._pending[user_id] = None
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        now = time.time()
+        upserts = []
+        deletes = []
+        for user_id, change in pending.items():
+            if change is None:
+                deletes.append((user_id,))
+            else:
+                upserts.append((user_id, change[0], change[1], now))
+
+        with self._db_lock, self._conn:
+            if upserts:
+                self._conn.executemany(
+                    "INSERT INTO sessions (user_id, state, data, updated_at) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT(user_id) DO UPDATE SET"
+                    " state = excluded.state, data = excluded.data, updated_at = excluded.updated_at",
+                    upserts
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM sessions WHERE user_id = ?", deletes)
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("Ошибка записи сессий: %s", e)
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+
+class Session:
+    """Незавершенная анкета пользователя: текущий шаг и ответы"""
+    __slots__ = ('state', 'response', 'touched', 'reminded')
+
+    def __init__(self, state, response):
+        self.state = state
+        self.response = response
+        self.touched = time.monotonic()
+        self.reminded = False
+
+
+class SessionTable:
+    """Таблица незавершенных анкет с ограничением по размеру и времени простоя.
+
+    Анкеты, к которым не обращались дольше ttl секунд, удаляет периодическая уборка,
+    а при превышении max_sessions вытесняются самые давние (LRU).
+    Если задан reminder_after, перед удалением пользователю один раз вызывается on_remind.
+    on_evict(user_id, session, reason) вызывается для каждой удаленной анкеты.
+    """
+
+    def __init__(self, max_sessions=10000, ttl=24 * 3600, reminder_after=None,
+                 on_remind=None, on_evict=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.reminder_after = reminder_after
+        self.on_remind = on_remind
+        self.on_evict = on_evict
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._evicted = {'ttl': 0, 'lru': 0}
+        self._reminded = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, user_id):
+        """Анкета пользователя или None. Обращение продлевает жизнь анкеты"""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None:
+                session.touched = time.monotonic()
+                session.reminded = False
+                self._sessions.move_to_end(user_id)
+            return session
+
+    def put(self, user_id, state, response):
+        session = Session(state, response)
+        with self._lock:
+            self._sessions[user_id] = session
+            self._sessions.move_to_end(user_id)
+            evicted = []
+            while len(self._sessions) > self.max_sessions:
+                evicted.append(self._sessions.popitem(last=False))
+                self._evicted['lru'] += 1
+        for evicted_user_id, evicted_session in evicted:
+            self._notify_evict(evicted_user_id, evicted_session, 'lru')
+        return session
+
+    def remove(self, user_id):
+        with self._lock:
+            return self._sessions.pop(user_id, None)
+
+    def _notify_evict(self, user_id, session, reason):
+        if self.on_evict is not None:
+            try:
+                self.on_evict(user_id, session, reason)
+            except Exception as e:
+                logger.exception("Ошибка при удалении анкеты %s: %s", user_id, e)
+
+    def sweep(self):
+        """Удаляет заброшенные анкеты и рассылает напоминания. Возвращает число удаленных"""
+        now = time.monotonic()
+        expired = []
+        to_remind = []
+        with self._lock:
+            # Самые давние анкеты в начале, дальше можно не смотреть
+            for user_id, session in self._sessions.items():
+                idle = now - session.touched
+                if idle >= self.ttl:
+                    expired.append((user_id, session))
+                elif self.reminder_after and idle >= self.reminder_after:
+                    if not session.reminded:
+                        session.reminded = True
+                        to_remind.append((user_id, session))
+                else:
+                    break
+            for user_id, _ in expired:
+                del self._sessions[user_id]
+            self._evicted['ttl'] += len(expired)
+            self._reminded += len(to_remind)
+
+        for user_id, session in to_remind:
+            if self.on_remind is not None:
+                try:
+                    self.on_remind(user_id, session)
+                except Exception as e:
+                    logger.error("Не удалось напомнить пользователю %s: %s", user_id, e)
+        for user_id, session in expired:
+            self._notify_evict(user_id, session, 'ttl')
+        return len(expired)
+
+    def start_sweeper(self, interval=60):
+        def sweep_forever():
+            while True:
+                time.sleep(interval)
+                self.sweep()
+
+        thread = threading.Thread(target=sweep_forever, name="session-sweeper", daemon=True)
+        thread.start()
+        return thread
+
+    def count_by_state(self):
+        with self._lock:
+            counts = {}
+            for session in self._sessions.values():
+                counts[session.state] = counts.get(session.state, 0) + 1
+            return counts
+
+    def stats(self, sample_size=100):
+        with self._lock:
+            sample = [session for _, session in zip(range(sample_size), self._sessions.values())]
+            live = len(self._sessions)
+            evicted = dict(self._evicted)
+            reminded = self._reminded
+        per_session = 0
+        if sample:
+            per_session = sum(_session_size(session) for session in sample) // len(sample)
+        return {'live': live, 'evicted_ttl': evicted['ttl'], 'evicted_lru': evicted['lru'],
+                'reminded': reminded, 'bytes_per_session': per_session}
+
+
+def _session_size(session):
+    """Примерный объем памяти анкеты в байтах"""
+    size = sys.getsizeof(session) + sys.getsizeof(session.response)
+    for field in getattr(session.response, '__slots__', ()):
+        size += sys.getsizeof(getattr(session.response, field, None))
+    return size
+
+
+def create_session_store(backend, path, flush_interval=1.0):
+    """Создает хранилище сессий по названию: sqlite, memory или "модуль:Класс".
+
+    Свой класс создается как Класс(path, flush_interval) и должен реализовать
+    интерфейс MemorySessionStore (например, общее хранилище для нескольких хостов).
+    """
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SqliteSessionStore(path, flush_interval)
+    if ':' in backend:
+        module_name, class_name = backend.split(':', 1)
+        return getattr(importlib.import_module(module_name), class_name)(path, flush_interval)
+    raise ValueError(f"Неизвестное хранилище сессий: {backend}")
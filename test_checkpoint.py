@@ -0,0 +1,43 @@
+"""Журнал апдейтов: принятые, но не обработанные апдейты переживают перезапуск."""
+import pytest
+
+from checkpoint import UpdateCheckpoint
+
+
+def update(update_id, user_id):
+    return {'update_id': update_id, 'message': {'message_id': update_id, 'from': {'id': user_id}}}
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    journal = UpdateCheckpoint(str(tmp_path / 'bot.db'))
+    yield journal
+    journal.close()
+
+
+def test_add_returns_only_new_updates(checkpoint):
+    assert checkpoint.add([update(1, 10), update(2, 11)]) == [update(1, 10), update(2, 11)]
+    # Повторная доставка: первый апдейт уже в журнале
+    assert checkpoint.add([update(1, 10), update(3, 12)]) == [update(3, 12)]
+    assert checkpoint.load() == 3
+
+
+def test_pending_filters_by_owner(checkpoint):
+    checkpoint.add([update(1, 10), update(2, 11), update(3, 12)])
+
+    assert checkpoint.pending() == [update(1, 10), update(2, 11), update(3, 12)]
+    assert checkpoint.pending(owns=lambda item: item['message']['from']['id'] % 2 == 0) == \
+        [update(1, 10), update(3, 12)]
+
+
+def test_done_removes_handled_updates(checkpoint, tmp_path):
+    checkpoint.add([update(1, 10), update(2, 11)])
+    checkpoint.done([1])
+
+    assert checkpoint.pending() == [update(2, 11)]
+    # После перезапуска в журнале остается только необработанный
+    reopened = UpdateCheckpoint(str(tmp_path / 'bot.db'))
+    try:
+        assert reopened.pending() == [update(2, 11)]
+    finally:
+        reopened.close()
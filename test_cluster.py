@@ -0,0 +1,77 @@
+"""Кластер из нескольких процессов на локальном Bot API: апдейты пользователя
+обрабатывает ровно один процесс, worker_for(user_id, N).
+
+Запуск: python -m pytest test_cluster.py
+"""
+import json
+import socket
+
+import pytest
+
+from dispatcher import worker_for
+from fake_api import FakeBotAPI
+from loadtest import make_update, start_bot
+
+WORKERS = 3
+USERS = range(1_000_001, 1_000_010)
+# Шаги каждого пользователя и сколько сообщений бот пришлет в ответ на каждый
+STEPS = [({'text': '/start'}, 1), ({'text': 'МЕРЧ'}, 2), ({'text': '/start'}, 1)]
+
+
+def free_base_port(count):
+    """Первый из count свободных подряд портов"""
+    for base in range(18700, 19700, count):
+        try:
+            for port in range(base, base + count):
+                with socket.socket() as sock:
+                    sock.bind(('127.0.0.1', port))
+        except OSError:
+            continue
+        return base
+    pytest.skip("нет свободных портов для обработчиков")
+
+
+def handled_updates(log_path):
+    """user_id -> номера процессов по строкам трассировки апдейтов"""
+    workers = {}
+    with open(log_path, 'rb') as log_file:
+        for line in log_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('msg', '').startswith("Апдейт обработан") and 'user_id' in entry:
+                workers.setdefault(entry['user_id'], []).append(entry.get('worker'))
+    return workers
+
+
+@pytest.fixture
+def api():
+    fake = FakeBotAPI().start()
+    yield fake
+    fake.stop()
+
+
+def test_updates_of_a_user_reach_one_worker(api, tmp_path):
+    log_path = tmp_path / 'bot.log'
+    env = {'METRICS_TRACE': '1', 'LOG_FORMAT': 'json'}
+    with open(log_path, 'wb') as log_file:
+        bot_process = start_bot(api, str(tmp_path), env, log_file, WORKERS, free_base_port(WORKERS))
+        try:
+            assert api.polling.wait(120), "кластер не начал опрашивать getUpdates"
+            expected = {user_id: 0 for user_id in USERS}
+            for sequence, (step, replies) in enumerate(STEPS, 1):
+                for user_id in USERS:
+                    expected[user_id] += replies
+                    api.push_update(make_update(user_id, step, sequence))
+                for user_id in USERS:
+                    assert api.wait_for_calls(user_id, expected[user_id], 30), f"нет ответа пользователю {user_id}"
+        finally:
+            bot_process.terminate()
+            bot_process.wait(60)
+
+    workers = handled_updates(log_path)
+    for user_id in USERS:
+        assert workers.get(user_id) == [worker_for(user_id, WORKERS)] * len(STEPS)
+    # Пользователи действительно распределены по всем процессам
+    assert {worker_for(user_id, WORKERS) for user_id in USERS} == set(range(WORKERS))
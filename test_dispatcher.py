@@ -0,0 +1,23 @@
+"""Раздача апдейтов по процессам кластера и потокам внутри процесса."""
+import pytest
+
+from dispatcher import OrderedDispatcher, worker_for
+
+THREADS = 8
+
+
+@pytest.fixture(scope='module')
+def dispatcher():
+    return OrderedDispatcher(THREADS)
+
+
+@pytest.mark.parametrize('processes', [1, 2, 4, 8])
+def test_every_thread_gets_users_of_its_process(dispatcher, processes):
+    users = range(1_000_000, 1_002_000)
+    for process in range(processes):
+        own_users = [user_id for user_id in users if worker_for(user_id, processes) == process]
+        assert {dispatcher.shard(user_id) for user_id in own_users} == set(range(THREADS))
+
+
+def test_user_always_gets_the_same_thread(dispatcher):
+    assert len({dispatcher.shard(123456789) for _ in range(10)}) == 1
@@ -0,0 +1,43 @@
+"""Превью файлов пользователей: поврежденное изображение помечается и о нем сообщается."""
+import threading
+
+import pytest
+from PIL import Image
+
+from images import UploadProcessor
+
+
+@pytest.fixture
+def processor(tmp_path):
+    upload_processor = UploadProcessor(str(tmp_path / 'previews'), workers=1)
+    yield upload_processor
+    upload_processor.close()
+
+
+def test_broken_image_is_marked_invalid(processor, tmp_path):
+    source = tmp_path / 'broken.jpg'
+    source.write_bytes(b"not a jpeg")
+    errors = []
+    reported = threading.Event()
+
+    def on_invalid(error):
+        errors.append(error)
+        reported.set()
+
+    processor.submit(str(source), on_invalid=on_invalid).exception(30)
+
+    assert reported.wait(5)
+    assert processor.is_invalid(str(source))
+    assert processor.preview_for(str(source)) is None
+
+
+def test_valid_image_gets_preview(processor, tmp_path):
+    source = tmp_path / 'photo.jpg'
+    Image.new("RGB", (64, 48), (200, 30, 30)).save(source, "JPEG")
+
+    errors = []
+    processor.submit(str(source), on_invalid=errors.append).result(30)
+
+    assert processor.preview_for(str(source)) is not None
+    assert errors == []
+    assert not processor.is_invalid(str(source))
@@ -0,0 +1,36 @@
+"""Метрики Prometheus: /metrics отдается при любых сочетаниях меток."""
+import pytest
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException
+
+from metrics import BotMetrics, Counter
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    def make_request(token, method_name, method='get', params=None, files=None):
+        if params and params.get('fail') == 'api':
+            raise ApiTelegramException(method_name, None, {'error_code': 429, 'description': "Too Many Requests"})
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(apihelper, '_make_request', make_request)
+    bot_metrics = BotMetrics()
+    bot_metrics.instrument_api()
+    return bot_metrics
+
+
+def test_api_errors_of_both_kinds_render(metrics):
+    for params in ({'fail': 'api'}, {'fail': 'network'}):
+        with pytest.raises(Exception):
+            apihelper._make_request('token', 'sendMessage', params=params)
+
+    text = metrics.render()
+    assert 'bot_api_errors_total{method="sendMessage",code="429"} 1' in text
+    assert 'bot_api_errors_total{method="sendMessage",code="ConnectionError"} 1' in text
+
+
+def test_counter_renders_labels_of_mixed_types():
+    counter = Counter("test_total", "test", ('code',))
+    counter.inc(400)
+    counter.inc("Timeout")
+    assert counter.render()[2:] == ['test_total{code="400"} 1', 'test_total{code="Timeout"} 1']
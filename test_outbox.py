@@ -0,0 +1,121 @@
+"""Очередь отправки: повторы по retry_after и с паузой, медиагруппа без повторной отправки файлов."""
+import json
+import time
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from outbox import Outbox
+
+CHAT_ID = 42
+
+
+def telegram_error(code, retry_after=None):
+    result = {'error_code': code, 'description': f"Error {code}"}
+    if retry_after is not None:
+        result['parameters'] = {'retry_after': retry_after}
+    return ApiTelegramException('sendMessage', None, result)
+
+
+class FakeBot:
+    """Bot API, который отвечает по списку: исключение или результат на каждый вызов"""
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.calls = []
+
+    def _call(self, method, chat_id, payload):
+        self.calls.append((method, payload))
+        response = self.responses.pop(0) if self.responses else None
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._call('send_message', chat_id, text)
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        return self._call('send_photo', chat_id, photo.name)
+
+    def send_media_group(self, chat_id, media):
+        return self._call('send_media_group', chat_id, len(media))
+
+
+@pytest.fixture
+def make_outbox(tmp_path):
+    outboxes = []
+
+    def make(bot, **kwargs):
+        outbox = Outbox(bot, str(tmp_path / 'bot.db'), sender=False, **kwargs)
+        outboxes.append(outbox)
+        return outbox
+
+    yield make
+    for outbox in outboxes:
+        outbox.close()
+
+
+def jobs(outbox):
+    rows = outbox._conn.execute("SELECT attempts, next_at, params FROM outbox ORDER BY id").fetchall()
+    return [(attempts, next_at, json.loads(params)) for attempts, next_at, params in rows]
+
+
+def test_retry_after_postpones_without_spending_an_attempt(make_outbox):
+    outbox = make_outbox(FakeBot([telegram_error(429, retry_after=7)]))
+    outbox.enqueue('send_message', CHAT_ID, text="hi")
+
+    outbox._process_due()
+
+    [(attempts, next_at, _)] = jobs(outbox)
+    assert attempts == 0
+    assert next_at == pytest.approx(time.time() + 7, abs=1)
+
+
+def test_server_errors_back_off_until_max_attempts(make_outbox):
+    bot = FakeBot([telegram_error(502), telegram_error(502)])
+    outbox = make_outbox(bot, max_attempts=2)
+    outbox.enqueue('send_message', CHAT_ID, text="hi")
+
+    outbox._process_due()
+    [(attempts, next_at, _)] = jobs(outbox)
+    assert attempts == 1
+    # Пауза 2 ** attempts секунд с разбросом 20%
+    assert time.time() + 1.5 < next_at < time.time() + 2.5
+
+    outbox._conn.execute("UPDATE outbox SET next_at = 0")
+    outbox._process_due()
+    assert jobs(outbox) == []
+    assert len(bot.calls) == 2
+
+
+def test_bad_request_is_dropped(make_outbox):
+    outbox = make_outbox(FakeBot([telegram_error(400)]))
+    outbox.enqueue('send_message', CHAT_ID, text="hi")
+
+    outbox._process_due()
+
+    assert jobs(outbox) == []
+
+
+def test_media_group_fallback_does_not_resend_sent_files(make_outbox, tmp_path):
+    paths = []
+    for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+        path = tmp_path / name
+        path.write_bytes(b"jpeg")
+        paths.append(str(path))
+    # Медиагруппа отклонена, первое фото ушло, на втором Telegram ответил 502
+    bot = FakeBot([telegram_error(400), None, telegram_error(502)])
+    outbox = make_outbox(bot, chat_burst=10)
+    outbox.enqueue('send_media_group', CHAT_ID, kind='photo', items=[{'path': path} for path in paths])
+
+    outbox._process_due()
+    [(attempts, _, params)] = jobs(outbox)
+    assert attempts == 1
+    assert params['sent'] == 1
+
+    outbox._conn.execute("UPDATE outbox SET next_at = 0")
+    outbox._process_due()
+
+    assert jobs(outbox) == []
+    assert bot.calls == [('send_media_group', 3), ('send_photo', paths[0]),
+                         ('send_photo', paths[1]), ('send_photo', paths[1]), ('send_photo', paths[2])]
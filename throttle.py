@@ -0,0 +1,112 @@
+import logging
+import threading
+
+from telebot.handler_backends import BaseMiddleware, CancelUpdate
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+def message_action(message):
+    """Действие, которое запрашивает сообщение: команда, текст кнопки меню, файл или текст"""
+    if message.content_type in ('photo', 'document'):
+        return 'file'
+    text = message.text or ''
+    if text.startswith('/'):
+        return text.split()[0].split('@')[0]
+    return text
+
+
+def callback_action(call):
+    return 'callback:' + (call.data or '').split(':')[0]
+
+
+class FloodGuard(BaseMiddleware):
+    """Middleware перед всеми обработчиками: лимиты на действия каждого пользователя.
+
+    Для каждой пары (пользователь, действие) свой token bucket: rate жетонов в секунду,
+    тяжелые действия списывают больше жетонов (costs: действие -> вес; действия не из
+    costs идут в общее действие 'other' с весом 1). Кроме того, число апдейтов
+    пользователя по всем действиям вместе ограничено user_rate / user_burst. Лишние апдейты отбрасываются
+    до обработчика, on_throttled(update, action, wait, first) вызывается на каждый
+    отброшенный апдейт; first=True - первый раз за период ожидания (для ответа пользователю).
+    """
+
+    def __init__(self, rate, burst, user_rate, user_burst, costs=None, on_throttled=None,
+                 max_buckets=10000):
+        super().__init__()
+        self.update_sensitive = True
+        self.update_types = ['message', 'callback_query']
+        self.rate = rate
+        self.burst = burst
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.costs = costs or {}
+        self.on_throttled = on_throttled
+        self.max_buckets = max_buckets
+        self._buckets = {}
+        # (пользователь, действие) -> сколько раз отброшено подряд
+        self._warned = {}
+        self._throttled = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, rate, capacity):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) > self.max_buckets:
+                # Полные корзины ничего не ограничивают, их можно забыть
+                self._buckets = {k: v for k, v in self._buckets.items() if not v.is_full()}
+            bucket = self._buckets[key] = TokenBucket(rate, capacity)
+        return bucket
+
+    def check(self, user_id, action):
+        """Списывает жетоны за действие. Возвращает 0, если можно, иначе сколько секунд ждать"""
+        cost = self.costs.get(action, 1)
+        with self._lock:
+            action_bucket = self._bucket((user_id, action), self.rate, max(self.burst, cost))
+            user_bucket = self._bucket((user_id, None), self.user_rate, self.user_burst)
+            wait = max(action_bucket.wait_time(cost), user_bucket.wait_time())
+            if wait > 0:
+                self._throttled[action] = self._throttled.get(action, 0) + 1
+                return wait
+            action_bucket.take(cost)
+            user_bucket.take()
+            self._warned.pop((user_id, action), None)
+            return 0.0
+
+    def _guard(self, update, user_id, action):
+        # Действия не из таблицы весов (ответы анкеты, неизвестные команды) считаются вместе
+        if action not in self.costs:
+            action = 'other'
+        wait = self.check(user_id, action)
+        if not wait:
+            return None
+        with self._lock:
+            if len(self._warned) > self.max_buckets:
+                self._warned.clear()
+            count = self._warned.get((user_id, action), 0)
+            self._warned[(user_id, action)] = count + 1
+        logger.info("Действие %s ограничено на %.1f с", action, wait, extra={'user_id': user_id})
+        if self.on_throttled is not None:
+            try:
+                self.on_throttled(update, action, wait, count == 0)
+            except Exception as e:
+                logger.error("Не удалось ответить на ограниченное действие: %s", e)
+        return CancelUpdate()
+
+    def pre_process_message(self, message, data):
+        return self._guard(message, message.from_user.id, message_action(message))
+
+    def pre_process_callback_query(self, call, data):
+        return self._guard(call, call.from_user.id, callback_action(call))
+
+    def post_process_message(self, message, data, exception):
+        pass
+
+    def post_process_callback_query(self, call, data, exception):
+        pass
+
+    def stats(self):
+        with self._lock:
+            return dict(self._throttled)
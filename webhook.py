@@ -0,0 +1,92 @@
+import hmac
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Апдейт Telegram - несколько килобайт, запросы больше этого отклоняются не читая
+MAX_BODY_SIZE = 1024 * 1024
+
+
+def make_handler(bot, path, secret):
+    """Создает обработчик HTTP-запросов, который передает апдейты боту"""
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+
+        def _reply(self, code, body=b""):
+            self.send_response(code)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path != path:
+                self._reply(404)
+                return
+
+            # Telegram присылает секрет, заданный в set_webhook
+            if not hmac.compare_digest(self.headers.get(SECRET_HEADER, "").encode(), secret.encode()):
+                self._reply(403)
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+            except ValueError:
+                self._reply(400)
+                return
+            if not 0 < length <= MAX_BODY_SIZE:
+                self._reply(413 if length > MAX_BODY_SIZE else 400)
+                return
+
+            try:
+                raw_update = json.loads(self.rfile.read(length))
+                update = types.Update.de_json(raw_update)
+            except Exception as e:
+                logger.warning("Некорректный апдейт: %s", e)
+                self._reply(400)
+                return
+
+            # Ответ 200 подтверждает апдейт, поэтому до ответа он записывается в журнал.
+            # Апдейт, который уже есть в журнале, прислан повторно и уже ждет обработки
+            journal = getattr(bot, 'journal', None)
+            if journal is not None:
+                try:
+                    if not journal.add([raw_update]):
+                        self._reply(200)
+                        return
+                except Exception as e:
+                    logger.error("Не удалось записать апдейт в журнал: %s", e)
+                    self._reply(500)
+                    return
+
+            bot.process_new_updates([update])
+            self._reply(200)
+
+        def do_GET(self):
+            self._reply(200 if self.path == path else 404)
+
+        def log_message(self, format, *args):
+            # Не печатаем строку на каждый запрос
+            pass
+
+    return WebhookHandler
+
+
+def run_webhook_server(bot, host, port, path, secret):
+    """Запускает встроенный HTTP-сервер для приема апдейтов от Telegram.
+
+    Без секрета сервер не запускается: иначе любой, кто достучится до порта,
+    сможет прислать апдейт от имени администратора.
+    """
+    if not secret:
+        raise ValueError("Для режима webhook нужен WEBHOOK_SECRET")
+    server = ThreadingHTTPServer((host, port), make_handler(bot, path, secret))
+    logger.info("Вебхук слушает http://%s:%s%s", host, port, path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()